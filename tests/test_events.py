@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "wrapper"))
+
+from core.events import Events  # noqa
+
+
+class _Stub(object):
+    pass
+
+
+class _Commands(object):
+    """Runs `handler(payload)` as the player command handler."""
+    def __init__(self):
+        self.handler = None
+
+    def playercommand(self, payload):
+        self.handler(payload)
+
+
+def _wrapper():
+    wrapper = _Stub()
+    wrapper.log = logging.getLogger("test_events")
+    wrapper.config = {"General": {"event-workers": 2}}
+    wrapper.commands = _Commands()
+    wrapper.servervitals = _Stub()
+    wrapper.servervitals.clients = []
+    wrapper.servervitals.players = {}
+    wrapper.api = _Stub()
+    wrapper.api.minecraft = _Stub()
+    wrapper.api.minecraft.getPlayer = lambda name: name
+    return wrapper
+
+
+class TestBlockingForPlayerEvents(unittest.TestCase):
+    def setUp(self):
+        self.wrapper = _wrapper()
+        self.events = Events(self.wrapper)
+        # a plugin handling the player's messages puts them on the
+        #  player's lane
+        self.events.register("plugin", "player.message", lambda p: None)
+
+    def _wait_in(self, ready, received):
+        # blockForEvent, as a plugin would call it
+        with self.events.listen(("player.message",)) as waiter:
+            ready.set()
+            received.append(waiter.get(3))
+
+    def test_command_handler_blocks_for_same_player_event(self):
+        ready = threading.Event()
+        received = []
+        self.wrapper.commands.handler = lambda payload: self._wait_in(
+            ready, received)
+        self.events.callevent("player.runCommand",
+                              {"playername": "Bob", "command": "ask"})
+        self.assertTrue(ready.wait(3))
+        self.events.callevent("player.message",
+                              {"playername": "Bob", "message": "yes"},
+                              abortable=False)
+        for _ in range(30):
+            if received:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(received), 1)
+        self.assertIsNotNone(received[0])
+        self.assertEqual(received[0]["payload"]["message"], "yes")
+
+    def test_commands_run_on_a_bounded_pool(self):
+        release = threading.Event()
+        threads = set()
+
+        def handler(payload):
+            threads.add(threading.current_thread().name)
+            release.wait(3)
+        self.wrapper.commands.handler = handler
+        before = threading.active_count()
+        for number in range(50):
+            self.events.callevent("player.runCommand",
+                                  {"playername": "Bot%d" % number,
+                                   "command": "spam"})
+        time.sleep(0.2)
+        self.assertLessEqual(threading.active_count(), before)
+        self.assertTrue(all(name.startswith("PlayerCommand")
+                            for name in threads))
+        release.set()
+
+    def test_lane_handler_blocks_for_same_player_event(self):
+        ready = threading.Event()
+        received = []
+        self.events.register("plugin", "player.login",
+                             lambda payload: self._wait_in(ready, received))
+        self.events.callevent("player.login", {"playername": "Bob"},
+                              abortable=False)
+        self.assertTrue(ready.wait(3))
+        self.events.callevent("player.message",
+                              {"playername": "Bob", "message": "hi"},
+                              abortable=False)
+        for _ in range(30):
+            if received:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(received), 1)
+        self.assertIsNotNone(received[0])
+        self.assertEqual(received[0]["payload"]["message"], "hi")
+
+
+if __name__ == "__main__":
+    unittest.main()
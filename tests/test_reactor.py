@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "wrapper"))
+
+from proxy import reactor  # noqa
+from proxy.packets.compression import PacketCompressor  # noqa
+from proxy.packets.packet import Packet  # noqa
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = False
+
+
+class _Packet(object):
+    """Each chunk fed is one frame."""
+    def __init__(self, sock):
+        self.socket = sock
+        self.on_queue = None
+        self._lock = threading.Lock()
+        self._inbox = []
+
+    def feed(self, data):
+        with self._lock:
+            self._inbox.append(data)
+
+    def has_fed_data(self):
+        with self._lock:
+            return len(self._inbox) > 0
+
+    def grabbuffered(self):
+        with self._lock:
+            if self._inbox:
+                return 0, self._inbox.pop(0)
+        return None
+
+    def take_frames(self):
+        return [], None
+
+
+class _Connection(object):
+    def __init__(self, sock):
+        self.packet = _Packet(sock)
+        self.abort = False
+        self.received = 0
+        self.got = threading.Condition()
+
+    def process_packet(self, pkid, frame):
+        with self.got:
+            self.received += len(frame)
+            self.got.notify_all()
+
+    def connection_lost(self, reason):
+        pass
+
+    def wait_for(self, count, timeout=5):
+        end = time.time() + timeout
+        with self.got:
+            while self.received < count and time.time() < end:
+                self.got.wait(0.1)
+            return self.received
+
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self.max_backlog = reactor._MAX_BACKLOG
+        reactor._MAX_BACKLOG = 16
+        self.reactor = reactor.ProxyReactor(logging.getLogger("test"), 2)
+        self.reactor.start()
+        self.ours, theirs = socket.socketpair()
+        self.conn = _Connection(theirs)
+        self.reactor.add_connection(self.conn)
+
+    def tearDown(self):
+        self.reactor.stop()
+        self.ours.close()
+        reactor._MAX_BACKLOG = self.max_backlog
+
+    def test_paused_channel_resumes_when_drained(self):
+        # more than _MAX_BACKLOG pauses reading the channel...
+        self.ours.sendall(b"x" * 1000)
+        self.assertEqual(self.conn.wait_for(1000), 1000)
+        channel = list(self.reactor.channels.values())[0]
+        # ... and parsing it all resumes it
+        end = time.time() + 5
+        while channel.paused and time.time() < end:
+            time.sleep(0.05)
+        self.assertFalse(channel.paused)
+        self.ours.sendall(b"y" * 1000)
+        self.assertEqual(self.conn.wait_for(2000), 2000)
+
+
+class _HeldCompressor(PacketCompressor):
+    """Hands out futures that the test completes."""
+    def __init__(self):
+        PacketCompressor.__init__(self, workers=0)
+        self.jobs = []
+
+    def submit(self, payload):
+        job = futures.Future()
+        self.jobs.append(job)
+        return job
+
+
+class _Owner(object):
+    log = logging.getLogger("test")
+
+
+class _PacketConnection(object):
+    def __init__(self, sock):
+        self.packet = Packet(sock, _Owner())
+        self.abort = False
+
+    def process_packet(self, pkid, frame):
+        pass
+
+    def connection_lost(self, reason):
+        pass
+
+
+def _recv(sock, count, timeout=5):
+    sock.settimeout(timeout)
+    data = b""
+    try:
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    return data
+
+
+@unittest.skipUnless(futures, "needs concurrent.futures")
+class TestPendingCompression(unittest.TestCase):
+    def setUp(self):
+        self.reactor = reactor.ProxyReactor(logging.getLogger("test"), 2)
+        self.reactor.start()
+        self.sockets = []
+
+    def tearDown(self):
+        self.reactor.stop()
+        for sock in self.sockets:
+            sock.close()
+
+    def _connection(self):
+        ours, theirs = socket.socketpair()
+        self.sockets.append(ours)
+        conn = _PacketConnection(theirs)
+        conn.packet.compressThreshold = 256
+        self.reactor.add_connection(conn)
+        return ours, conn
+
+    def test_loop_does_not_wait_for_compression(self):
+        ours, conn = self._connection()
+        compressor = conn.packet.compressor = _HeldCompressor()
+        other, other_conn = self._connection()
+        big = b"b" * 100000
+        small = b"small"
+        conn.packet.send_raw(big)
+        conn.packet.send_raw(small)
+        # the big frame is still compressing: nothing is sent (the small
+        #  frame waits behind it), but the loop serves other connections
+        other_conn.packet.send_raw(small)
+        expected_small = conn.packet.handle_compression(256, small)
+        self.assertEqual(_recv(other, len(expected_small)), expected_small)
+        self.assertEqual(_recv(ours, 1, timeout=0.2), b"")
+
+        compressor.jobs[0].set_result(b"compressed")
+        expected = conn.packet._compressed_frame(
+            big, b"compressed") + expected_small
+        self.assertEqual(_recv(ours, len(expected)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
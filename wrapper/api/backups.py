@@ -36,7 +36,8 @@ class Backups(object):
 
     def verifyTarInstalled(self):
         """
-        checks for tar on users system.
+        checks for tar on users system.  Wrapper no longer needs tar to
+        make backups (archives are written by wrapper itself).
 
         :returns: True if installed, False if not (along with error logs
          and console messages).
@@ -77,13 +78,11 @@ class Backups(object):
         Allow plugin to re-enable disabled backups or enable backups
         during this wrapper session.
 
-        :returns: False if tar is not installed, otherwise, nothing.
+        :returns: Nothing.
 
         """
         self.wrapper.backups.enabled = True
         if not self.wrapper.backups.timerstarted:
-            if not self.wrapper.backups.dotarchecks():
-                return False
             self.wrapper.backups.timerstarted = True
             self.wrapper.backups.api.registerEvent(
                 "timer.second", self.wrapper.backups.eachsecond)
@@ -137,3 +136,31 @@ class Backups(object):
         """
         return self.wrapper.backups_idle()
 
+    def listBackups(self):
+        """
+        List the backups wrapper is keeping.
+
+        :returns: A list of (timestamp, name) of each backup, oldest
+         first.  Names ending in ".manifest" are incremental backups.
+
+        """
+        return list(self.wrapper.backups.backups)
+
+    def restoreBackup(self, name, destination, paths=None):
+        """
+        Restore an incremental backup into a folder.  Restore into an
+        empty folder (not the folder of the running server) and swap
+        the files in while the server is stopped.
+
+        :arg name: the backup name (from `listBackups`).
+        :arg destination: the folder to restore into.
+        :arg paths: optional list of the paths (relative to the server
+         folder, like "world/region") to restore, instead of all of them.
+
+        :returns: The number of files restored.
+
+        :raises: ValueError for a full (tar) backup, which is restored by
+         extracting it.
+
+        """
+        return self.wrapper.backups.restore(name, destination, paths)
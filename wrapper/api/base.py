@@ -6,10 +6,15 @@
 # General Public License, version 3 or later.
 
 
-import time
+try:
+    import asyncio
+except ImportError:
+    # Py2
+    asyncio = False
 
 from api.minecraft import Minecraft
 from core.storage import Storage
+from core.sqlitestorage import SqliteStorage
 from api.backups import Backups
 from api import helpers
 
@@ -176,10 +181,8 @@ class API(object):
             if not self.internal:
                 self.wrapper.log.debug("[%s] Registered command '%s'",
                                        self.name, name)
-            if self.id not in self.wrapper.commands:
-                self.wrapper.commands[self.id] = {}
-            self.wrapper.commands[self.id][name] = {"callback": callback,
-                                                    "permission": permission}
+            self.wrapper.commands.register(self.id, name, callback,
+                                           permission)
 
     def registerEvent(self, eventname, callback):
         """
@@ -200,9 +203,7 @@ class API(object):
         if not self.internal:
             self.wrapper.log.debug("[%s] Registered event '%s'",
                                    self.name, eventname)
-        if self.id not in self.wrapper.events:
-            self.wrapper.events[self.id] = {}
-        self.wrapper.events[self.id][eventname] = callback
+        self.wrapper.events.register(self.id, eventname, callback)
 
     def registerPermission(self, permission=None, value=False):
         """
@@ -228,6 +229,7 @@ class API(object):
         if self.id not in self.wrapper.registered_permissions:
             self.wrapper.registered_permissions[self.id] = {}
         self.wrapper.registered_permissions[self.id][permission] = value
+        self.wrapper.perms.invalidate()
 
     def registerHelp(self, groupname, summary, commands):
         """
@@ -261,22 +263,97 @@ class API(object):
             self.wrapper.help[self.id] = {}
         self.wrapper.help[self.id][groupname] = (summary, commands)
 
-    def blockForEvent(self, eventtype):
+    def blockForEvent(self, eventtype, timeout=None):
         """
         Blocks until the specified event is called.
+
+        :Args:
+            :eventtype: the event name, for example, "player.login".
+            :timeout: seconds to wait (None, the default, waits forever).
+
+        :returns: The event's payload, or None if `timeout` passed
+         before the event occurred.
+
+        """
+        with self.wrapper.events.listen((eventtype,)) as waiter:
+            event = waiter.get(timeout)
+        if event is None:
+            return None
+        return event["payload"]
+
+    def listenForEvents(self, *eventtypes):
+        """
+        Open a channel receiving every occurrence of the named events,
+        from now until it is closed.  Unlike repeated blockForEvent
+        calls, no event is missed between two waits.
+
+        :Args:
+            :eventtypes: one or more event names.
+
+        :returns: a listener with these methods:
+            :get(timeout=None): waits for the next event and returns
+             {"event": name, "payload": payload}, or None if `timeout`
+             seconds passed first.
+            :close(): stop listening.  The listener can also be used
+             in a `with` block, which closes it.
+
+        :sample usage:
+
+            .. code:: python
+
+                with self.api.listenForEvents("player.login",
+                                              "player.logout") as events:
+                    while running:
+                        event = events.get(timeout=5)
+                        if event:
+                            ...
+
+            ..
+
         """
-        sock = []
-        self.wrapper.events.listeners.append(sock)  #
-        while True:
-            for event in sock:
-                if event["event"] == eventtype:
-                    payload = event["payload"][:]
-                    self.wrapper.events.listeners.remove(sock)
-                    return payload
-                else:
-                    pass
-                    # sock.remove(event)
-            time.sleep(0.05)
+        return self.wrapper.events.listen(eventtypes)
+
+    def awaitEvent(self, eventtype, timeout=None, loop=None):
+        """
+        The asyncio version of blockForEvent, for plugins running an
+        event loop (Python 3.4+).
+
+        :Args:
+            :eventtype: the event name.
+            :timeout: seconds to wait; asyncio.TimeoutError is raised if
+             it passes first.
+            :loop: the event loop (default: asyncio.get_event_loop()).
+
+        :returns: an awaitable for the event's payload.
+
+        :sample usage:
+
+            .. code:: python
+
+                payload = await self.api.awaitEvent("player.login")
+
+            ..
+
+        """
+        if not asyncio:
+            raise NotImplementedError("awaitEvent requires asyncio")
+        loop = loop or asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def _resolve(payload):
+            if not future.done():
+                future.set_result(payload)
+
+        def _deliver(event, payload):
+            loop.call_soon_threadsafe(_resolve, payload)
+
+        waiter = self.wrapper.events.listen((eventtype,), _deliver)
+        # stops listening once the future is resolved, cancelled or
+        #  timed out (events arriving before that are ignored by _resolve)
+        future.add_done_callback(lambda f: waiter.close())
+        if timeout is None:
+            return future
+        return asyncio.wait_for(future, timeout)
 
     def sendAlerts(self, message, group="wrapper", blocking=False):
         """
@@ -364,7 +441,8 @@ class API(object):
         else:
             raise LookupError("Plugin %s does not exist!" % plugin_id)
 
-    def getStorage(self, name, world=False, pickle=True):
+    def getStorage(self, name, world=False, pickle=True, journal=False,
+                   backend="file"):
         """
         Returns a storage object manager for saving data between reboots.
 
@@ -382,6 +460,15 @@ class API(object):
              pickle is not generally human-readable, whereas json is human
              readable.
 
+            :journal:  For large dictionaries; saves only the changed
+             top-level keys, appending them to a journal file.
+            :backend:  "file" (the default) or "sqlite".  A sqlite
+             storage keeps the data in a database, only reads the
+             records that are used, and its Data can be indexed and
+             queried by ranges (see core.sqlitestorage.SqliteData).
+             An existing file storage of the same name is imported
+             when the database is first created.
+
         :Returns: A storage object manager.  The manager contains a
          storage dictionary called 'Data'. 'Data' contains the
          data your plugin will remember across reboots.
@@ -409,7 +496,8 @@ class API(object):
                     print("player %s has a home at: %s" % (
                         player, self.homes.Data[player]))
 
-                # to save (storages also do periodic saves every minute):
+                # to save (storages also do periodic saves every minute,
+                # if the data has changed):
                 self.homes.save()
 
                 # to close (and save):
@@ -454,12 +542,15 @@ class API(object):
 
         """
         if world:
-            return Storage(name, root="%s/%s/plugins/%s" % (
-                self.serverpath, self.minecraft.getWorldName(),
-                self.id), pickle=pickle)
+            root = "%s/%s/plugins/%s" % (
+                self.serverpath, self.minecraft.getWorldName(), self.id)
         else:
-            return Storage(name, root="wrapper-data/plugins/%s" %
-                                      self.id, pickle=pickle)
+            root = "wrapper-data/plugins/%s" % self.id
+        if backend == "sqlite":
+            return SqliteStorage(name, root=root, pickle=pickle)
+        if backend != "file":
+            raise ValueError("Unknown storage backend '%s'" % backend)
+        return Storage(name, root=root, pickle=pickle, journal=journal)
 
     def wrapperHalt(self):
         """
@@ -433,6 +433,16 @@ def pickle_save(path, filename, data, encoding="machine"):
 
     :returns: Nothing.  Assumes success; errors will raise exception.
 
+    """
+    with open("%s/%s" % (path, filename), "wb") as f:
+        Pickle.dump(data, f, protocol=pickle_protocol(encoding))
+
+
+def pickle_protocol(encoding="machine"):
+    """
+    The pickle protocol `pickle_save` uses for an `encoding` of
+    'Machine' or 'Human'.
+
     """
     if "human" in encoding.lower():
         _protocol = 0
@@ -458,9 +468,7 @@ def pickle_save(path, filename, data, encoding="machine"):
         # Human-readable (unless that is what you specify), while
         # still permitting some portability of the final files
         _protocol = Pickle.HIGHEST_PROTOCOL // 2
-
-    with open("%s/%s" % (path, filename), "wb") as f:
-        Pickle.dump(data, f, protocol=_protocol)
+    return _protocol
 
 
 def processcolorcodes(messagestring):
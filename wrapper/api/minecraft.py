@@ -327,6 +327,31 @@ class Minecraft(object):
 
         return None
 
+    def getProxyMetrics(self):
+        """
+        Get the proxy's packet metrics (Proxy config "proxy-metrics"
+        must be enabled).  Packet ids are shown in hex with their
+        direction ("SB" serverbound, "CB" clientbound).
+
+        :returns: None if the proxy or its metrics are disabled.
+         Otherwise a dictionary:
+
+            :uptime: seconds since metrics started.
+            :totals: packets and bytes in and out, bytes sent after
+             framing/compression, the compression ratio (of the
+             packets the proxy compressed itself), and the most
+             packets sent in one flush ("batch-max").
+            :rates: packets in/out per second since the previous call.
+            :connections: a list of the counters of each open client
+             and server socket.
+            :parse: parse time statistics of the ten packet types that
+             took the most parse time.
+
+        """
+        if self.wrapper.proxymode and self.wrapper.proxy.metrics:
+            return self.wrapper.proxy.metrics.snapshot()
+        return None
+
     def getPlayer(self, username=""):
         """
         Returns the player object of the specified logged-in player.
@@ -438,6 +463,34 @@ class Minecraft(object):
         """
         return self.wrapper.uuids.getuuidbyusername(name)
 
+    def lookupbyNames(self, names):
+        """
+        Look up many players' UUIDs at once (see lookupbyName).  Names
+        not in the user cache are sent to Mojang in batches, which is
+        much faster than calling lookupbyName for each one.
+
+        :arg names:  a list of player names
+
+        :returns: a dictionary of each name: its UUID (MCUUID), or False
+         if the name is invalid.
+
+        """
+        return self.wrapper.uuids.getuuidsbyusernames(names)
+
+    def lookupbyUUIDs(self, uuids):
+        """
+        Look up many players' names at once (see lookupbyUUID).
+
+        :arg uuids:  a list of string uuids (with dashes)
+
+        :returns: a dictionary of each uuid: its username, or False if
+         the UUID is invalid.
+
+        """
+        # just in case MCUUIDs were passed instead.
+        return self.wrapper.uuids.getusernamesbyuuids(
+            [getattr(uuid, "string", uuid) for uuid in uuids])
+
     # World and console interaction
 
     def setLocalName(self, MojangUUID, desired_name, kick=True):
@@ -470,7 +523,7 @@ class Minecraft(object):
             pass
         # do the name change in the cache
         if MojangUUID in cache:
-            cache[MojangUUID]["localname"] = desired_name
+            self.wrapper.uuids.setlocalname(MojangUUID, desired_name)
             cache.save()
 
         # kicking them is needed to complete the process
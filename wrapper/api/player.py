@@ -6,7 +6,6 @@
 # General Public License, version 3 or later.
 
 import time
-import threading
 import pprint
 
 from proxy.packets.mcpackets_cb import Packets as Packets_cb
@@ -251,10 +250,10 @@ class Player(object):
         self.data.Data["lastLoggedIn"] = (self.loggedIn, time.tzname)
         self.data.save()
 
-        # start player logged in time tracking thread
-        t = threading.Thread(target=self._track, args=())
-        t.daemon = True
-        t.start()
+        # player logged in time tracking
+        self.data.Data["logins"][int(self.loggedIn)] = time.time()
+        self._tracking = self.wrapper.scheduler.call_every(
+            1, self._track, name="player tracking")
 
     def __str__(self):
         return self.username
@@ -287,17 +286,17 @@ class Player(object):
     def _track(self):
         """
         internal tracking that updates a player's server play time.
-        Not a part of the public player object API.
+        Not a part of the public player object API.  Run each second
+        by the wrapper scheduler, so the storage closes promptly on
+        player logoff.
         """
-        self.data.Data["logins"][int(self.loggedIn)] = time.time()
-        while not (self.abort or self.wrapper_signal.halt):
-            timeupdate = time.time()
-            if timeupdate % 60:  # Just update every 60 seconds
-                self.data.Data["logins"][int(self.loggedIn)] = int(time.time())
-            # this needs a fast response to ensure the storage closes 
-            # immediately on player logoff
-            time.sleep(.5)
-        self.data.close()
+        if self.abort or self.wrapper_signal.halt:
+            self._tracking.cancel()
+            self.wrapper.scheduler.call_later(
+                0, self.data.close, name="player storage close",
+                blocking=True)
+            return
+        self.data.Data["logins"][int(self.loggedIn)] = int(time.time())
 
     def kick(self, reason):
         """
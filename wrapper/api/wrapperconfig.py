@@ -49,6 +49,14 @@ CONFIG = {
             # NODOC
             "backup-compression": False,
 
+         # Compression used when backup-compression is on: "gzip" (.tar.gz) or "zstd" (.tar.zst, needs the 'zstandard' module; gzip is used without it).
+
+            "backup-compression-format": "gzip",
+
+         # Threads compressing backups (0 = one per cpu).
+
+            "backup-compression-threads": 0,
+
          # Specify server files and folders you want backed up.  Items must be in your server folder (see 'General' section)
 
             "backup-folders":
@@ -70,8 +78,16 @@ CONFIG = {
 
             "backup-location": "backup-directory",
 
+         # "full" writes a complete archive each time.  "incremental" stores only the region chunks and files that changed since the last backup (in <backup-location>/incremental), sharing unchanged data between backups.  Restore incremental backups with the api (backups.restoreBackup).
+
+            "backup-mode": "full",
+
             "backup-notification": True,
 
+         # Limit (in MB per second) on reading files for a backup, so the running server keeps some disk bandwidth.  0 = no limit.
+
+            "backup-rate-limit": 0,
+
             "backups-keep": 10,
 
             "enabled": False
@@ -254,6 +270,40 @@ CONFIG = {
 
             "encoding": "utf-8",
 
+         # Mojang API used to look up player names and UUIDs.  Change this only to use a stand-in service (for testing, or a caching mirror).  When Mojang says no player has a name, wrapper will not ask again for "name-lookup-negative-seconds".
+
+            "mojang-api": "https://api.mojang.com",
+
+            "name-lookup-negative-seconds": 300,
+
+         # Limit on requests to the Mojang API, and the number of threads used to look up many players at once (such as when converting the whitelist with "/whitelist online").  Set "mojang-requests-per-second" to 0 for no limit.
+
+            "mojang-requests-per-second": 5,
+
+            "mojang-lookup-workers": 4,
+
+         # Server output lines wait in a queue of up to "console-queue-size" lines for wrapper to parse them.  If the server prints faster than wrapper can keep up, "console-queue-full" decides whether the server output readers wait ("block") or lines are discarded ("drop").
+
+            "console-queue-size": 5000,
+
+            "console-queue-full": "block",
+
+         # Non-abortable events (console lines, timers, chat...) are run by a pool of "event-workers" threads.  At most "event-queue-size" events wait for a worker; when the queue is full, "event-queue-full" decides whether the event is delayed until there is room ("block") or discarded ("drop").  Events of one player, or of one group (like "server." or "timer.") keep their order.
+
+            "event-workers": 4,
+
+            "event-queue-size": 1000,
+
+            "event-queue-full": "block",
+
+         # Player commands run on a separate pool of "command-workers" threads, so a command waiting for its player's next event does not hold up that player's events.  At most "command-queue-size" commands wait for a worker; "command-queue-full" works like "event-queue-full".  One player's commands run in order.
+
+            "command-workers": 4,
+
+            "command-queue-size": 100,
+
+            "command-queue-full": "block",
+
          # Using the default '.' roots the server in the same folder with wrapper. Change this to another folder to keep the wrapper and server folders separate.  Do not use a trailing slash...  e.g. - '/full/pathto/the/server'.  relative paths are ok too, as long as there is no trailing slash.  For instance, to use a sister directory, use `../server`.
 
             "server-directory": ".",
@@ -367,10 +417,36 @@ CONFIG = {
 
             "proxy-enabled": False,
 
+         # "threaded" (default) runs several threads for each connected player.  "reactor" services every player socket from one event loop and runs packet parsing on a fixed pool of "proxy-engine-workers" threads; use it for large player counts (requires Python 3.4+).
+
+            "proxy-engine": "threaded",
+
+            "proxy-engine-workers": 8,
+
          # the wrapper's proxy port that accepts client connections from the internet. This port is exposed to the internet via your port forwards.
 
             "proxy-port": 25565,
 
+         # Compressed packets that wrapper does not parse are passed along without being decompressed.  Set to False to inflate every packet (only useful for debugging).
+
+            "passthrough-unparsed": True,
+
+         # zlib level (1 fastest - 9 smallest; 6 is zlib's default) for packets the proxy compresses.  "compression-threshold" (False or a size in bytes) stops the proxy compressing packets smaller than that; it can only raise the threshold set in server.properties.  Packets larger than 16 KB (chunks re-sent when changing worlds, etc) are compressed on a pool of "compression-workers" threads (0 compresses everything on the sending connection's thread).
+
+            "compression-level": 6,
+
+            "compression-threshold": False,
+
+            "compression-workers": 2,
+
+         # Count packets and bytes per connection and time the parsing of each packet type.  See `/wrapper metrics` and api.minecraft.getProxyMetrics().  Costs a little CPU, so leave it off unless you are investigating proxy load.
+
+            "proxy-metrics": False,
+
+         # False, or a file name to record every packet the proxy receives (both directions, decrypted) for replaying with `python -m proxy.replay <file>` from the wrapper source directory.  Captures include everything players type (chat, /password...) - only use this on test servers.
+
+            "packet-capture": False,
+
          # silent bans cause your server to ignore sockets from that IP (for IP bans). This will cause your server to appear offline and avoid possible confrontations.
 
             "silent-ipban": True,
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+The backup archiver: writes a tar stream of the backup folders with
+`tarfile`, in process, compressing it on several threads.
+
+gzip output is compressed in independent blocks, one gzip member per
+block (as pigz does), which any gzip reader (including tar xzf and
+Python's tarfile) reads as one stream.  zstd output (when the
+`zstandard` module is installed) uses that module's own threads.
+
+Source files are read through a rate limiter so a backup does not
+starve the running server of disk bandwidth.
+"""
+
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+from collections import deque
+
+try:
+    from concurrent import futures
+except ImportError:
+    # Py2 - blocks are compressed one at a time
+    futures = False
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = False
+
+# bytes of tar stream per gzip member
+BLOCK = 1024 * 1024
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def gzip_member(data, level):
+    """:returns: `data` as one complete gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    return b"".join((
+        b"\x1f\x8b\x08\x00", struct.pack("<I", int(time.time())),
+        b"\x00\xff", body,
+        struct.pack("<II", zlib.crc32(data) & 0xffffffff,
+                    len(data) & 0xffffffff)))
+
+
+def _stored_size(path):
+    """
+    :returns: the bytes of data tar stores for `path`: the size of a
+     regular file, 0 for links (which are stored as links, not followed),
+     folders and anything else.
+    """
+    info = os.lstat(path)
+    if stat.S_ISREG(info.st_mode):
+        return info.st_size
+    return 0
+
+
+class Throttle(object):
+    """
+    Limits a byte stream to `rate` bytes per second (0 is unlimited).
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._start = time.time()
+        self._count = 0
+
+    def consume(self, count):
+        if not self.rate:
+            return
+        self._count += count
+        ahead = self._count / float(self.rate) - (time.time() - self._start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class ParallelGzipWriter(object):
+    """
+    A write-only file object that gzips what is written to `fileobj`
+    in BLOCK sized members on `threads` threads, keeping their order.
+    """
+    def __init__(self, fileobj, level=6, threads=0):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads or cpu_count()
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._executor = None
+        if futures and self.threads > 1:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=self.threads)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BLOCK:
+            self._submit()
+
+    def _submit(self):
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self._executor is None:
+            self._emit(gzip_member(block, self.level))
+            return
+        self._pending.append(
+            self._executor.submit(gzip_member, block, self.level))
+        # bound the memory held by blocks in flight
+        while len(self._pending) > self.threads * 2:
+            self._emit(self._pending.popleft().result())
+
+    def _emit(self, member):
+        self.fileobj.write(member)
+
+    def close(self):
+        if self._buffered:
+            self._submit()
+        while self._pending:
+            self._emit(self._pending.popleft().result())
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.fileobj.close()
+
+
+class _SourceReader(object):
+    """
+    Reads a source file for tarfile through the throttle.  A file that
+    shrank since it was stat'ed is padded with zeros (as GNU tar does)
+    so the archive stays readable.
+    """
+    def __init__(self, fileobj, size, throttle, log, path):
+        self.fileobj = fileobj
+        self.remaining = size
+        self.throttle = throttle
+        self.log = log
+        self.path = path
+        self.padded = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        if len(data) < size:
+            if not self.padded:
+                self.log.warning("Backup: '%s' shrank while being read",
+                                 self.path)
+                self.padded = True
+            data += b"\0" * (size - len(data))
+        self.remaining -= len(data)
+        self.throttle.consume(len(data))
+        return data
+
+
+class Archiver(object):
+    """
+    Writes one backup archive.
+
+    :log: a logger.
+    :compression: None (plain tar), "gzip" or "zstd" ("zstd" becomes
+     "gzip" without the zstandard module).
+    :threads: compression threads (0 = one per cpu).
+    :rate: bytes per second read from the source files (0 = no limit).
+    :progress: called with (path, files done, bytes done) after each
+     file is archived (total_files and total_bytes are set by then).
+    """
+    def __init__(self, log, compression="gzip", threads=0, rate=0,
+                 level=6, progress=None):
+        if compression == "zstd" and not zstandard:
+            log.warning("Backups: the zstandard module is not installed; "
+                        "using gzip compression.")
+            compression = "gzip"
+        self.log = log
+        self.compression = compression
+        self.threads = threads or cpu_count()
+        self.rate = rate
+        self.level = level
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        self.written = 0
+        self.abort = False
+
+    @property
+    def extension(self):
+        return {"gzip": ".tar.gz", "zstd": ".tar.zst"}.get(
+            self.compression, ".tar")
+
+    @staticmethod
+    def scan(paths):
+        """
+        :returns: the files (and directories) under `paths`, as a list
+         of (path, size), in archive order.
+        """
+        found = []
+        for path in paths:
+            found.append((path, _stored_size(path)))
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in dirs:
+                    found.append((os.path.join(root, name), 0))
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    try:
+                        found.append((full, _stored_size(full)))
+                    except OSError:
+                        # deleted since the directory was listed
+                        pass
+        return found
+
+    def _open(self, filename):
+        fileobj = open(filename, "wb")
+        if self.compression == "gzip":
+            return ParallelGzipWriter(fileobj, self.level, self.threads)
+        if self.compression == "zstd":
+            compressor = zstandard.ZstdCompressor(
+                level=self.level, threads=self.threads)
+            # the stream writer closes `fileobj` when it is closed
+            return compressor.stream_writer(fileobj)
+        return fileobj
+
+    def archive(self, filename, paths):
+        """
+        Archive `paths` (files or folders) into `filename`.  The archive
+        is written to `filename`.part and renamed when complete.
+
+        :returns: the number of bytes written.
+
+        :raises: EnvironmentError (IOError/OSError) or tarfile.TarError.
+        """
+        entries = self.scan(paths)
+        self.total_files = len(entries)
+        self.total_bytes = sum(size for path, size in entries)
+        throttle = Throttle(self.rate)
+        partial = "%s.part" % filename
+        writer = self._open(partial)
+        try:
+            try:
+                tar = tarfile.open(fileobj=writer, mode="w|")
+                for path, size in entries:
+                    if self.abort:
+                        raise IOError("Backup aborted")
+                    self._add(tar, path, throttle)
+                    self.files += 1
+                    if self.progress:
+                        self.progress(path, self.files, self.bytes)
+                tar.close()
+            finally:
+                writer.close()
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        self.written = os.path.getsize(partial)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(partial, filename)
+        return self.written
+
+    def _add(self, tar, path, throttle):
+        try:
+            info = tar.gettarinfo(path)
+        except (IOError, OSError) as e:
+            # deleted since the scan
+            self.log.debug("Backup: skipping '%s' (%s)", path, e)
+            return
+        if info is None:
+            # sockets and the like
+            return
+        if not info.isreg():
+            tar.addfile(info)
+            return
+        try:
+            source = open(path, "rb")
+        except (IOError, OSError) as e:
+            self.log.warning("Backup: could not read '%s' (%s)", path, e)
+            return
+        with source:
+            tar.addfile(info, _SourceReader(source, info.size, throttle,
+                                            self.log, path))
+        self.bytes += info.size
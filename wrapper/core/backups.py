@@ -6,6 +6,8 @@
 # General Public License, version 3 or later.
 
 import datetime
+import tarfile
+import threading
 import time
 
 import subprocess
@@ -13,6 +15,8 @@ import os
 import platform
 
 from api.base import API
+from core.archiver import Archiver
+from core.backupstore import BackupStore, StoreError
 from api.helpers import putjsonfile, getjsonfile, mkdir_p
 # noinspection PyProtectedMember
 from api.helpers import _secondstohuman, format_bytes
@@ -41,8 +45,11 @@ class Backups(object):
         # allow plugins to shutdown backups via api
         self.enabled = self.config["Backups"]["enabled"]
 
-        # only register event if used and tar installed.
-        if self.enabled and self.dotarchecks():
+        # only register event if used.  Archives are written in
+        # process, so tar need not be installed.
+        self.timerstarted = False
+        if self.enabled:
+            self.timerstarted = True
             self.api.registerEvent("timer.second", self.eachsecond)
             self.log.debug("Backups Enabled..")
 
@@ -50,8 +57,54 @@ class Backups(object):
     def eachsecond(self, payload):
         # only run backups in server running/starting states
         if self.wrapper.javaserver.vitals.state in (1, 2) and not self.idle:
-            if time.time() - self.time > self.backup_interval and self.enabled:
-                self.dobackup()
+            if time.time() - self.time > self.backup_interval and \
+                    self.enabled and not self.inprogress:
+                # backups take a while; don't hold up the timer events
+                self.inprogress = True
+                t = threading.Thread(target=self.dobackup, name="Backup",
+                                     args=())
+                t.daemon = True
+                t.start()
+
+    def _store(self, rate=0):
+        """:returns: the BackupStore of incremental backups."""
+        return BackupStore(
+            "%s/incremental" % self.config["Backups"]["backup-location"],
+            self.log, rate=rate)
+
+    def _incremental(self):
+        return self.config["Backups"].get("backup-mode", "full") == \
+            "incremental"
+
+    def restore(self, name, destination, only=None):
+        """
+        Restore the incremental backup `name` (as listed in
+        backups.json) into the folder `destination`.
+
+        :only: if given, a list of the paths to restore (relative to
+         the server folder, e.g. "world/region").
+
+        :returns: the number of files restored.
+        """
+        if not name.endswith(".manifest"):
+            raise ValueError("'%s' is not an incremental backup; extract it "
+                             "with tar." % name)
+        store = self._store()
+        try:
+            return store.restore(name, destination, only)
+        finally:
+            store.close()
+
+    def _deletebackup(self, name):
+        if name.endswith(".manifest"):
+            store = self._store()
+            try:
+                store.delete(name)
+            finally:
+                store.close()
+        else:
+            os.remove('%s/%s' % (self.config["Backups"]["backup-location"],
+                                 name))
 
     def pruneoldbackups(self, filename="IndependentPurge"):
         if len(self.backups) > self.config["Backups"]["backups-keep"]:
@@ -77,10 +130,7 @@ class Backups(object):
                                 """  # noqa
                     break
                 try:
-                    os.remove(
-                        '%s/%s' % (self.config["Backups"]["backup-location"],
-                                   backup[1])
-                    )
+                    self._deletebackup(backup[1])
                 except Exception as e:
                     self.log.error("Failed to delete backup (%s)", e)
                 self.log.info("Deleting old backup: %s",
@@ -141,23 +191,30 @@ class Backups(object):
 
     def dobackup(self):
         self.inprogress = True
-        self.log.debug("Backup starting.")
-        self._settime()
-        if not self._checkforbackupfolder():
+        try:
+            self.log.debug("Backup starting.")
+            self._settime()
+            if not self._checkforbackupfolder():
+                self.wrapper.events.callevent(
+                    "wrapper.backupFailure",
+                    {
+                     "reasonCode": 5,
+                     "reasonText": "Backup location could not be "
+                                   "found/created!"
+                    },
+                    abortable=False
+                )
+                self.log.warning("")
+            self._getbackups()  # populate self.backups
+            self._performbackup()
+            self.log.debug("dobackup() cycle complete.")
+        except Exception as e:
+            # a failed backup must not stop later backups (or postpone
+            #  timed reboots, which wait for backups to be idle).
+            self.log.exception("Backup failed: %s", e)
+            self.wrapper.javaserver.doserversaving(True)
+        finally:
             self.inprogress = False
-            self.wrapper.events.callevent(
-                "wrapper.backupFailure",
-                {
-                 "reasonCode": 5,
-                 "reasonText": "Backup location could not be found/created!"
-                },
-                abortable=False
-            )
-            self.log.warning("")
-        self._getbackups()  # populate self.backups
-        self._performbackup()
-        self.log.debug("dobackup() cycle complete.")
-        self.inprogress = False
 
     def _checkforbackupfolder(self):
         if not os.path.exists(self.config["Backups"]["backup-location"]):
@@ -182,17 +239,35 @@ class Backups(object):
         # give server time to save
         time.sleep(1)
 
-        # Create tar arguments
-        filename = "backup-%s.tar" % datetime.datetime.fromtimestamp(
-            int(timestamp)).strftime("%Y-%m-%d_%H.%M.%S")
-        if self.config["Backups"]["backup-compression"]:
-            filename += ".gz"
-            arguments = ["tar", "czf", "%s/%s" % (
-                self.config["Backups"]["backup-location"].replace(" ", "\\ "),
-                filename)]
+        rate = self.config["Backups"].get("backup-rate-limit", 0) * 1048576
+        incremental = self._incremental()
+        if incremental:
+            try:
+                archiver = self._store(rate)
+            except (ImportError, StoreError, OSError) as e:
+                self.log.error("Incremental backups are not available (%s);"
+                               " making a full backup.", e)
+                incremental = False
+        if incremental:
+            extension = ".manifest"
+        else:
+            compression = None
+            if self.config["Backups"]["backup-compression"]:
+                compression = self.config["Backups"].get(
+                    "backup-compression-format", "gzip")
+            archiver = Archiver(
+                self.log, compression=compression,
+                threads=self.config["Backups"].get(
+                    "backup-compression-threads", 0),
+                rate=rate)
+            extension = archiver.extension
+        filename = "backup-%s%s" % (datetime.datetime.fromtimestamp(
+            int(timestamp)).strftime("%Y-%m-%d_%H.%M.%S"), extension)
+        if incremental:
+            finalbackup = archiver.manifest_path(filename)
         else:
-            arguments = ["tar", "cfpv", "%s/%s" % (
-                self.config["Backups"]["backup-location"], filename)]
+            finalbackup = "%s/%s" % (
+                self.config["Backups"]["backup-location"], filename)
 
         # Process begin Events
         if not self.wrapper.events.callevent("wrapper.backupBegin", {"file": filename}):  # noqa
@@ -226,10 +301,11 @@ class Backups(object):
 
         # Do backups
         serverpath = self.config["General"]["server-directory"]
+        paths = []
         for backupfile in self.config["Backups"]["backup-folders"]:
             backup_file_and_path = "%s/%s" % (serverpath, backupfile)
             if os.path.exists(backup_file_and_path):
-                arguments.append(backup_file_and_path)
+                paths.append(backup_file_and_path)
             else:
                 self.log.warning(
                     "Backup file '%s' does not exist - canceling backup",
@@ -246,9 +322,52 @@ class Backups(object):
                                 <description> internalfunction <description>
 
                             """
+                self.wrapper.javaserver.doserversaving(True)
                 return
-        # perform TAR backup
-        statuscode = os.system(" ".join(arguments))
+
+        def progress(path, files, done):
+            self.wrapper.events.callevent(
+                "wrapper.backupProgress",
+                {"file": filename, "path": path, "files": files,
+                 "total-files": archiver.total_files, "bytes": done,
+                 "total-bytes": archiver.total_bytes},
+                abortable=False
+            )
+            """ eventdoc
+                <group> Backups <group>
+
+                <description> Sent as each file is added to a backup.
+                <description>
+
+                <abortable> No - informational only <abortable>
+
+                <comments>
+                <comments>
+                <payload>
+                "file": Name of backup file.
+                "path": the file just added.
+                "files": number of files (and folders) added so far.
+                "total-files": number of files (and folders) in the backup.
+                "bytes": bytes of file data added so far.
+                "total-bytes": bytes of file data in the backup.
+                <payload>
+
+            """
+        archiver.progress = progress
+
+        # write the archive (or the incremental backup)
+        statuscode = 0
+        try:
+            if incremental:
+                archiver.snapshot(filename, paths, serverpath)
+            else:
+                archiver.archive(finalbackup, paths)
+        except (IOError, OSError, tarfile.TarError, StoreError) as e:
+            self.log.error("Backup '%s' failed: %s", filename, e)
+            statuscode = 1
+        finally:
+            if incremental:
+                archiver.close()
 
         # TODO add a wrapper properties config item to set save mode of server
         # restart saves, call finish Events
@@ -259,9 +378,6 @@ class Backups(object):
         self.pruneoldbackups(filename)
 
         # Check for success
-        finalbackup = "%s/%s" % (self.config["Backups"]["backup-location"],
-                                 filename)
-
         if not os.path.exists(finalbackup):
             self.wrapper.events.callevent(
                 "wrapper.backupFailure",
@@ -276,12 +392,20 @@ class Backups(object):
             """
             summary = "backup failed"
         else:
-            # find size of completed backup file
-            backupsize = os.path.getsize(finalbackup)
-            size_of, units = format_bytes(backupsize)
             timetook = _secondstohuman(int(time.time()) - timestamp)
-            desc = "were backed up.  The operation took"
-            summary = "%s %s %s %s" % (size_of, units, desc, timetook)
+            if incremental:
+                # size of the files backed up, and of the new data stored
+                size_of, units = format_bytes(archiver.bytes)
+                new_of, new_units = format_bytes(archiver.written)
+                summary = "%s %s were backed up (%s %s new).  The " \
+                          "operation took %s" % (size_of, units, new_of,
+                                                 new_units, timetook)
+            else:
+                # find size of completed backup file
+                backupsize = os.path.getsize(finalbackup)
+                size_of, units = format_bytes(backupsize)
+                desc = "were backed up.  The operation took"
+                summary = "%s %s %s %s" % (size_of, units, desc, timetook)
 
         self.wrapper.events.callevent(
             "wrapper.backupEnd",
@@ -300,7 +424,7 @@ class Backups(object):
             <comments>
             <payload>
             "file": Name of backup file.
-            "status": Status code from TAR
+            "status": 0, or 1 if the archive could not be written
             "summary": string summary of operation 
             <payload>
 
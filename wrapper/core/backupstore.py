@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Incremental backups ("backup-mode": "incremental" in the Backups
+config section).
+
+Each backup is a manifest listing every backed up file as a list of
+pieces, each piece named by the sha1 of its content.  Piece contents
+are kept once, zlib compressed, in pack files; an index (sqlite) maps
+each hash to its pack, offset and length, and counts the manifests
+referring to it.
+
+- Files whose size and modification time match the previous backup are
+  not read at all; the previous manifest's pieces are reused.
+- Region files (Anvil .mca and the older McRegion .mcr, which share
+  the same header) are cut at the sector boundaries of the chunks in
+  their location table, so a changed region file only adds the chunks
+  that actually changed.  Other files are cut in PIECE sized pieces.
+- Deleting a backup releases its references; packs that no longer hold
+  anything referenced are deleted, and mostly unreferenced packs are
+  rewritten.
+
+Layout of the store directory:
+    index.db, manifests/<backup name> (gzipped json), packs/<n>.pack
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import sqlite3
+    StoreError = sqlite3.Error
+except ImportError:
+    # Python built without sqlite
+    sqlite3 = False
+    StoreError = IOError
+
+from api.helpers import mkdir_p
+from core.archiver import Throttle
+
+SECTOR = 4096
+# largest piece of a file (region chunks included)
+PIECE = 1024 * 1024
+# a pack is rewritten when less than this fraction of it is referenced
+PACK_LIVE_MIN = 0.5
+
+# one backup or restore at a time per process
+_LOCK = threading.Lock()
+
+
+def region_cuts(data):
+    """
+    :returns: the offsets at which to cut the region file `data`: the
+     header (location and timestamp tables), and the start and end of
+     each chunk's sectors, so that each chunk is its own piece.
+    """
+    size = len(data)
+    cuts = set((0, min(SECTOR, size), min(2 * SECTOR, size), size))
+    if size < 2 * SECTOR:
+        return sorted(cuts)
+    for entry in range(1024):
+        location = struct.unpack(">I", data[entry * 4:entry * 4 + 4])[0]
+        offset, count = location >> 8, location & 0xff
+        if offset < 2 or not count:
+            continue
+        cuts.add(min(offset * SECTOR, size))
+        cuts.add(min((offset + count) * SECTOR, size))
+    return sorted(cuts)
+
+
+def _pieces(cuts):
+    """(start, end) pairs between `cuts`, none longer than PIECE."""
+    for start, end in zip(cuts, cuts[1:]):
+        while start < end:
+            yield start, min(end, start + PIECE)
+            start += PIECE
+
+
+class BackupStore(object):
+    """
+    :directory: the store directory.
+    :log: a logger.
+    :rate: bytes per second read from the source files (0 = no limit).
+    :progress: called with (path, files done, bytes done) after each
+     file (see core.archiver.Archiver).
+    """
+    def __init__(self, directory, log, rate=0, progress=None):
+        if not sqlite3:
+            raise ImportError("Incremental backups need the Python sqlite3 "
+                              "module.")
+        self.directory = directory
+        self.log = log
+        self.rate = rate
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        # bytes of new pieces written by snapshot()
+        self.written = 0
+        mkdir_p("%s/manifests" % directory)
+        mkdir_p("%s/packs" % directory)
+        self.db = sqlite3.connect("%s/index.db" % directory,
+                                  check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pieces (hash TEXT "
+                        "PRIMARY KEY, pack TEXT, offset INTEGER, "
+                        "length INTEGER, refs INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pieces_pack "
+                        "ON pieces (pack)")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def manifest_path(self, name):
+        return "%s/manifests/%s" % (self.directory, name)
+
+    def manifests(self):
+        """:returns: the backup names in the store, oldest first."""
+        found = []
+        for name in os.listdir("%s/manifests" % self.directory):
+            if not name.endswith(".tmp"):
+                found.append(name)
+        return sorted(found)
+
+    def load_manifest(self, name):
+        with gzip.open(self.manifest_path(name), "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+
+    def _save_manifest(self, name, manifest):
+        path = self.manifest_path(name)
+        with gzip.open("%s.tmp" % path, "wb") as f:
+            f.write(json.dumps(manifest).encode("utf-8"))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename("%s.tmp" % path, path)
+
+    # backing up
+
+    def snapshot(self, name, paths, root):
+        """
+        Back up `paths` (files or folders under `root`) as the backup
+        `name`.
+
+        :returns: the manifest.
+
+        :raises: EnvironmentError (IOError/OSError) or StoreError.
+        """
+        with _LOCK:
+            previous = {}
+            names = self.manifests()
+            if names:
+                previous = self.load_manifest(names[-1])["files"]
+            entries = self._scan(paths, root)
+            self.total_files = len(entries)
+            self.total_bytes = sum(size for rel, size, isdir in entries)
+            manifest = {"time": time.time(), "folders": [], "files": {}}
+            throttle = Throttle(self.rate)
+            pack, pack_path = self._new_pack()
+            packfile = open(pack_path, "wb")
+            try:
+                for rel, size, isdir in entries:
+                    full = os.path.join(root, rel)
+                    if isdir:
+                        manifest["folders"].append(rel)
+                    else:
+                        entry = self._backup_file(
+                            full, rel, previous.get(rel), packfile, pack,
+                            throttle)
+                        if entry is not None:
+                            manifest["files"][rel] = entry
+                            self.bytes += entry["size"]
+                    self.files += 1
+                    if self.progress:
+                        self.progress(full, self.files, self.bytes)
+                packfile.flush()
+                os.fsync(packfile.fileno())
+                self.written = packfile.tell()
+            finally:
+                packfile.close()
+            if not self.written:
+                os.remove(pack_path)
+            hashes = set()
+            for entry in manifest["files"].values():
+                hashes.update(entry["pieces"])
+            self.db.executemany("UPDATE pieces SET refs = refs + 1 "
+                                "WHERE hash = ?", [(h,) for h in hashes])
+            self._save_manifest(name, manifest)
+            self.db.commit()
+            return manifest
+
+    def _new_pack(self):
+        """:returns: the name and path of a pack that does not exist."""
+        stamp = int(time.time() * 1000)
+        while True:
+            pack = "%d.pack" % stamp
+            path = "%s/packs/%s" % (self.directory, pack)
+            if not os.path.exists(path):
+                return pack, path
+            stamp += 1
+
+    @staticmethod
+    def _scan(paths, root):
+        found = []
+        for path in paths:
+            rel = os.path.relpath(path, root)
+            if not os.path.isdir(path):
+                found.append((rel, os.path.getsize(path), False))
+                continue
+            found.append((rel, 0, True))
+            for walkroot, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in dirs:
+                    found.append((os.path.relpath(
+                        os.path.join(walkroot, name), root), 0, True))
+                for name in sorted(files):
+                    full = os.path.join(walkroot, name)
+                    try:
+                        found.append((os.path.relpath(full, root),
+                                      os.path.getsize(full), False))
+                    except OSError:
+                        # deleted since the directory was listed
+                        pass
+        return found
+
+    def _backup_file(self, full, rel, previous, packfile, pack, throttle):
+        try:
+            info = os.stat(full)
+        except OSError as e:
+            self.log.debug("Backup: skipping '%s' (%s)", full, e)
+            return None
+        entry = {"size": info.st_size, "mtime": info.st_mtime,
+                 "mode": info.st_mode & 0o7777}
+        if previous and previous["size"] == info.st_size and \
+                previous["mtime"] == info.st_mtime:
+            entry["pieces"] = previous["pieces"]
+            return entry
+        pieces = []
+        try:
+            with open(full, "rb") as f:
+                if rel.endswith((".mca", ".mcr")):
+                    data = f.read()
+                    throttle.consume(len(data))
+                    for start, end in _pieces(region_cuts(data)):
+                        pieces.append(self._store(
+                            data[start:end], packfile, pack))
+                else:
+                    while True:
+                        data = f.read(PIECE)
+                        if not data:
+                            break
+                        throttle.consume(len(data))
+                        pieces.append(self._store(data, packfile, pack))
+        except (IOError, OSError) as e:
+            self.log.warning("Backup: could not read '%s' (%s)", full, e)
+            return None
+        entry["pieces"] = pieces
+        # what was read, if the file changed since it was stat'ed
+        entry["size"] = sum(int(piece.split(":")[1]) for piece in pieces)
+        return entry
+
+    def _store(self, data, packfile, pack):
+        """:returns: the piece name ("<sha1>:<length>") of `data`."""
+        digest = hashlib.sha1(data).hexdigest()
+        piece = "%s:%d" % (digest, len(data))
+        if self.db.execute("SELECT 1 FROM pieces WHERE hash = ?",
+                           (piece,)).fetchone() is None:
+            blob = zlib.compress(data, 6)
+            offset = packfile.tell()
+            packfile.write(blob)
+            self.db.execute("INSERT INTO pieces (hash, pack, offset, "
+                            "length, refs) VALUES (?, ?, ?, ?, 0)",
+                            (piece, pack, offset, len(blob)))
+        return piece
+
+    # restoring
+
+    def _read(self, piece, packs):
+        pack, offset, length = self.db.execute(
+            "SELECT pack, offset, length FROM pieces WHERE hash = ?",
+            (piece,)).fetchone()
+        if pack not in packs:
+            packs[pack] = open("%s/packs/%s" % (self.directory, pack), "rb")
+        packs[pack].seek(offset)
+        data = zlib.decompress(packs[pack].read(length))
+        if "%s:%d" % (hashlib.sha1(data).hexdigest(), len(data)) != piece:
+            raise IOError("Backup piece %s is damaged" % piece)
+        return data
+
+    def restore(self, name, destination, only=None):
+        """
+        Restore the backup `name` into the folder `destination`.
+
+        :only: if given, a list of paths (as backed up, relative to the
+         server folder, e.g. "world/region") to restore.
+
+        :returns: the number of files restored.
+
+        :raises: EnvironmentError (IOError/OSError), or KeyError if a
+         piece is missing from the index.
+        """
+        def wanted(rel):
+            if not only:
+                return True
+            return any(rel == path or rel.startswith(path.rstrip("/") + "/")
+                       for path in only)
+
+        with _LOCK:
+            manifest = self.load_manifest(name)
+            for rel in manifest["folders"]:
+                if wanted(rel):
+                    mkdir_p(os.path.join(destination, rel))
+            packs = {}
+            restored = 0
+            try:
+                for rel, entry in sorted(manifest["files"].items()):
+                    if not wanted(rel):
+                        continue
+                    target = os.path.join(destination, rel)
+                    mkdir_p(os.path.dirname(target))
+                    with open(target, "wb") as f:
+                        for piece in entry["pieces"]:
+                            f.write(self._read(piece, packs))
+                    os.chmod(target, entry["mode"])
+                    os.utime(target, (entry["mtime"], entry["mtime"]))
+                    restored += 1
+            finally:
+                for packfile in packs.values():
+                    packfile.close()
+            return restored
+
+    # pruning
+
+    def delete(self, name):
+        """
+        Delete the backup `name`, releasing its pieces, and delete or
+        rewrite the packs left (mostly) unreferenced.
+        """
+        with _LOCK:
+            manifest = self.load_manifest(name)
+            hashes = set()
+            for entry in manifest["files"].values():
+                hashes.update(entry["pieces"])
+            self.db.executemany("UPDATE pieces SET refs = refs - 1 "
+                                "WHERE hash = ?", [(h,) for h in hashes])
+            os.remove(self.manifest_path(name))
+            self.db.commit()
+            self._collect()
+
+    def _collect(self):
+        packs = self.db.execute(
+            "SELECT pack, SUM(length), SUM(CASE WHEN refs > 0 THEN length "
+            "ELSE 0 END) FROM pieces GROUP BY pack").fetchall()
+        for pack, total, live in packs:
+            path = "%s/packs/%s" % (self.directory, pack)
+            if not live:
+                self.db.execute("DELETE FROM pieces WHERE pack = ?", (pack,))
+                self.db.commit()
+                os.remove(path)
+            elif live < total * PACK_LIVE_MIN:
+                self._rewrite(pack, path)
+        # packs of interrupted backups (nothing was committed)
+        indexed = set(row[0] for row in self.db.execute(
+            "SELECT DISTINCT pack FROM pieces").fetchall())
+        for pack in os.listdir("%s/packs" % self.directory):
+            if pack not in indexed:
+                os.remove("%s/packs/%s" % (self.directory, pack))
+
+    def _rewrite(self, pack, path):
+        """Copy the referenced pieces of `pack` to a new pack."""
+        newpack, newpath = self._new_pack()
+        rows = self.db.execute(
+            "SELECT hash, offset, length FROM pieces WHERE pack = ? AND "
+            "refs > 0 ORDER BY offset", (pack,)).fetchall()
+        with open(path, "rb") as source:
+            with open(newpath, "wb") as target:
+                for piece, offset, length in rows:
+                    source.seek(offset)
+                    newoffset = target.tell()
+                    target.write(source.read(length))
+                    self.db.execute(
+                        "UPDATE pieces SET pack = ?, offset = ? WHERE "
+                        "hash = ?", (newpack, newoffset, piece))
+                target.flush()
+                os.fsync(target.fileno())
+        self.db.execute("DELETE FROM pieces WHERE pack = ? AND refs <= 0",
+                        (pack,))
+        self.db.commit()
+        os.remove(path)
@@ -6,6 +6,7 @@
 # General Public License, version 3 or later.
 from pprint import pprint
 
+import bisect
 import time
 import json
 
@@ -17,6 +18,54 @@ from api.helpers import _secondstohuman, _showpage
 from utils.crypt import get_passphrase
 
 
+class CommandTable(object):
+    """
+    Every command wrapper runs, by name: wrapper's built in commands and
+    the commands plugins register (api.registerCommand).
+    """
+    def __init__(self):
+        # name: (handler(player, payload), proxy mode only)
+        self.builtins = {}
+        # name: [(plugin id, {"callback": .., "permission": ..}), ...]
+        #  in plugin load order.  Rebuilt (not modified) by rebuild().
+        self.plugins = {}
+        # sorted names of both, for prefix (tab completion) lookups
+        self._names = []
+
+    def add_builtin(self, names, handler, proxy_only=False):
+        for name in names:
+            self.builtins[name] = (handler, proxy_only)
+        self._names = sorted(set(self.builtins) | set(self.plugins))
+
+    def rebuild(self, commands):
+        """:commands: {plugin id: {command name: registration}}"""
+        plugins = {}
+        for plugin_id in list(commands):
+            for name, entry in list(commands[plugin_id].items()):
+                plugins.setdefault(name, []).append((plugin_id, entry))
+        self.plugins = plugins
+        self._names = sorted(set(self.builtins) | set(plugins))
+
+    def builtin(self, name, proxymode):
+        """:returns: the handler of built in command `name`, or None."""
+        try:
+            handler, proxy_only = self.builtins[name]
+        except KeyError:
+            return None
+        if proxy_only and not proxymode:
+            return None
+        return handler
+
+    def startingwith(self, prefix):
+        """:returns: the (sorted) command names starting with `prefix`."""
+        names = self._names
+        start = bisect.bisect_left(names, prefix)
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+
 # noinspection PyBroadException,PyMethodMayBeStatic
 class Commands(object):
 
@@ -28,9 +77,39 @@ class Commands(object):
         self.perms = wrapper.perms
         self.cipher = self.wrapper.cipher
         self.commands = {}
+        self.table = CommandTable()
         self.reset_confirmed = False
         self.reset_timeout = time.time()
 
+        # some minecraft commands (like op, ban, kick) will have
+        # implementations that should vary based on whether proxymode is
+        # enabled and are defined here to supercede the minecraft version.
+        # all commands here override their Minecraft equivalent.
+        for names, handler, proxy_only in (
+                (("plugins", "pl"),
+                 lambda player, payload: self.command_plugins(player),
+                 False),
+                (("op",), self.command_op, False),
+                (("deop",), self.command_deop, False),
+                (("kick",), self.command_kick, False),
+                (("whitelist",), self.command_whitelist, False),
+                (("wrapper",), self.command_wrapper, False),
+                (("reload",), self.command_reload, False),
+                (("help", "?"), self.command_help, False),
+                (("playerstats",), self.command_playerstats, False),
+                (("permissions", "perm", "perms", "super"),
+                 self.command_perms, False),
+                (("ent", "entity", "entities"), self.command_entities,
+                 False),
+                (("config", "con", "prop", "property", "properties"),
+                 self.command_setconfig, False),
+                (("ban",), self.command_banplayer, True),
+                (("pardon",), self.command_pardon, True),
+                (("ban-ip",), self.command_banip, True),
+                (("pardon-ip",), self.command_pardonip, True),
+                (("password",), self.command_password, False)):
+            self.table.add_builtin(names, handler, proxy_only)
+
     def __getitem__(self, index):
         if not type(index) == str:
             raise Exception("A string must be passed - got %s" % type(index))
@@ -40,17 +119,63 @@ class Commands(object):
         if not type(index) == str:
             raise Exception("A string must be passed - got %s" % type(index))
         self.commands[index] = value
+        self.table.rebuild(self.commands)
         return self.commands[index]
 
     def __delitem__(self, index):
         if not type(index) == str:
             raise Exception("A string must be passed - got %s" % type(index))
         del self.commands[index]
+        self.table.rebuild(self.commands)
 
     def __iter__(self):
         for i in self.commands:
             yield i
 
+    def register(self, plugin_id, name, callback, permission):
+        """Add a plugin's command (see API.registerCommand)."""
+        if plugin_id not in self.commands:
+            self.commands[plugin_id] = {}
+        self.commands[plugin_id][name] = {"callback": callback,
+                                          "permission": permission}
+        self.table.rebuild(self.commands)
+
+    def _plugin_good(self, plugin_id):
+        if plugin_id not in self.wrapper.plugins:
+            return False
+        return self.wrapper.plugins[plugin_id]["good"]
+
+    def complete(self, prefix, player=None):
+        """
+        :returns: the sorted names of the commands starting with `prefix`
+         that `player` (if given) may run.
+        """
+        names = []
+        for name in self.table.startingwith(prefix):
+            if self.table.builtin(name, self.wrapper.proxymode):
+                names.append(name)
+                continue
+            for plugin_id, entry in self.table.plugins.get(name, ()):
+                if not self._plugin_good(plugin_id):
+                    continue
+                if player is None or player.hasPermission(
+                        entry["permission"]) or player.isOp() > 4:
+                    names.append(name)
+                break
+        return names
+
+    def tab_complete(self, payload):
+        """server.autoCompletes handler - adds wrapper's commands to the
+        server's completions of a command name."""
+        text = payload.get("text") or ""
+        if not text.startswith("/") or " " in text:
+            return None
+        completes = payload["completes"]
+        for name in self.complete(text[1:], payload.get("player")):
+            if "/%s" % name not in completes:
+                completes.append("/%s" % name)
+        return None
+
     def playercommand(self, payload):
         player = payload["player"]
         command = str(payload["command"]).lower()
@@ -59,104 +184,35 @@ class Commands(object):
         if command not in ("password", "othersensitivecommand"):
             self.log.info("%s executed: %s", payload["player"], commandtext)
 
-        # We should get out of this by creating a wrapper command registering set # noqa
-
-        if command in ("plugins", "pl"):
-            self.command_plugins(player)
-            return
-
-        # some minecraft commands (like op, ban, kick) will have implementations
-        # that should vary based on whether proxymode is enabled and are
-        # defined here to supercede the minecraft version.
-        # all commands here override their Minecraft equivalent.
-
-        elif command == "op":
-            return self.command_op(player, payload)
-
-        elif command == "deop":
-            return self.command_deop(player, payload)
-
-        elif command == "kick":
-            return self.command_kick(player, payload)
-
-        elif command == "whitelist":
-            return self.command_whitelist(player, payload)
-
-        elif command == "wrapper":
-            return self.command_wrapper(player, payload)
-
-        elif command == "reload":
-            return self.command_reload(player, payload)
-
-        elif command in ("help", "?"):
-            return self.command_help(player, payload)
+        handler = self.table.builtin(command, self.wrapper.proxymode)
+        if handler is not None:
+            return handler(player, payload)
 
-        elif command == "playerstats":
-            return self.command_playerstats(player, payload)
-
-        elif command in ("permissions", "perm", "perms", "super"):
-            return self.command_perms(player, payload)
-
-        elif command in ("ent", "entity", "entities"):
-            return self.command_entities(player, payload)
-
-        elif command in (
-                "config", "con", "prop", "property", "properties"):
-            return self.command_setconfig(player, payload)
-
-        elif self.wrapper.proxymode and command == "ban":
-            return self.command_banplayer(player, payload)
-
-        elif self.wrapper.proxymode and command == "pardon":
-            return self.command_pardon(player, payload)
-
-        elif self.wrapper.proxymode and command == "ban-ip":
-            return self.command_banip(player, payload)
-
-        elif self.wrapper.proxymode and command == "pardon-ip":
-            return self.command_pardonip(player, payload)
-
-        elif command == "password":
-            return self.command_password(player, payload)
         # This section calls the commands defined by api.registerCommand()
-        for pluginID in self.commands:
-            command = payload["command"]
-            if pluginID == "Wrapper.py":
-                try:
-                    self.commands[pluginID][command](payload["player"],
-                                                     payload["args"])
-                except Exception as e:
-                    self.log.debug("Exception in 'Wrapper.py' while"
-                                   " trying to run '%s' command:\n%s",
-                                   (command, e))
-                continue
-            if pluginID not in self.wrapper.plugins:
+        command = payload["command"]
+        for pluginID, entry in self.table.plugins.get(command, ()):
+            if not self._plugin_good(pluginID):
                 continue
-            plugin = self.wrapper.plugins[pluginID]
-            if not plugin["good"]:
-                continue
-            if command in self.commands[pluginID]:
-                try:
-                    command = self.commands[pluginID][command]
-                    # require super op to bypass explicit permission
-                    if player.hasPermission(
-                            command["permission"]) or player.isOp() > 4:
-                        command["callback"](payload["player"], payload["args"])
-                    else:
-                        player.message(
-                            {"translate": "commands.generic.permission",
-                             "color": "red"})
-                    return
-                except Exception as e:
-                    self.log.exception(
-                        "Plugin '%s' errored out when executing command:"
-                        " '<%s> /%s':\n%s", pluginID,
-                        payload["player"], command, e)
-                    payload["player"].message(
-                        {"text": "An internal error occurred in wrapper"
-                         "while trying to execute this command. Apologies.",
+            try:
+                # require super op to bypass explicit permission
+                if player.hasPermission(
+                        entry["permission"]) or player.isOp() > 4:
+                    entry["callback"](payload["player"], payload["args"])
+                else:
+                    player.message(
+                        {"translate": "commands.generic.permission",
                          "color": "red"})
-                    return
+                return
+            except Exception as e:
+                self.log.exception(
+                    "Plugin '%s' errored out when executing command:"
+                    " '<%s> /%s':\n%s", pluginID,
+                    payload["player"], command, e)
+                payload["player"].message(
+                    {"text": "An internal error occurred in wrapper"
+                     "while trying to execute this command. Apologies.",
+                     "color": "red"})
+                return
 
         # command was not executed by werapper, so try server.
         player.execute(commandtext)
@@ -440,6 +496,8 @@ class Commands(object):
             elif subcommand == "halt":
                 player.message("&cHalting Wrapper.py... goodbye!")
                 self.wrapper.shutdown()
+            elif subcommand in ("metrics", "stats"):
+                self._command_wrapper_metrics(player)
             elif subcommand in ("mem", "memory"):
                 server_bytes = self.wrapper.javaserver.getmemoryusage()
                 if server_bytes:
@@ -461,6 +519,66 @@ class Commands(object):
             )
         return
 
+    def _command_wrapper_metrics(self, player):
+        events = self.wrapper.events.workers.stats()
+        player.message(
+            "&6Event queue: &7%s queued (max %s of %s), %s lanes, %s "
+            "workers, %s run, %s dropped" % (
+                events["queued"], events["max-queued"],
+                events["queue-size"], events["lanes"], events["workers"],
+                events["completed"], events["dropped"]))
+        commands = self.wrapper.events.commands.stats()
+        player.message(
+            "&6Command queue: &7%s queued (max %s of %s), %s workers, %s "
+            "run, %s dropped" % (
+                commands["queued"], commands["max-queued"],
+                commands["queue-size"], commands["workers"],
+                commands["completed"], commands["dropped"]))
+        server = self.wrapper.javaserver
+        player.message(
+            "&6Server console: &7%s lines queued, %s dropped" % (
+                server.console_output.qsize(), server.console_dropped))
+        scheduler = self.wrapper.scheduler.stats()
+        player.message(
+            "&6Scheduler: &7%s tasks, woke at most %sms late" % (
+                scheduler["scheduled"], scheduler["max-late-ms"]))
+        for name, cost in sorted(scheduler["tasks"].items(),
+                                 key=lambda x: x[1]["total-ms"],
+                                 reverse=True)[:5]:
+            player.message(
+                "&7 %s: %s runs, mean %sms, max %sms" % (
+                    name, cost["runs"], cost["mean-ms"], cost["max-ms"]))
+        if not (self.wrapper.proxymode and self.wrapper.proxy.metrics):
+            player.message("&cProxy metrics are off (enable 'proxy-metrics'"
+                           " in the Proxy section of wrapper.properties)")
+            return
+        stats = self.wrapper.proxy.metrics.snapshot()
+        totals = stats["totals"]
+        player.message("&6Proxy metrics (last %s):" % _secondstohuman(
+            stats["uptime"]))
+        player.message(
+            "&7 in: %s packets, %s bytes  out: %s packets, %s bytes "
+            "(%s bytes sent, ratio %s)" % (
+                totals["packets-in"], totals["bytes-in"],
+                totals["packets-out"], totals["bytes-out"],
+                totals["bytes-sent"], totals.get("compression-ratio", "-")))
+        player.message("&7 %s packets/sec in, %s packets/sec out" % (
+            stats["rates"]["packets-in/sec"],
+            stats["rates"]["packets-out/sec"]))
+        for conn in stats["connections"]:
+            player.message(
+                "&7 %s (%s): %s in, %s out, largest batch %s" % (
+                    conn["player"], conn["kind"], conn["packets-in"],
+                    conn["packets-out"], conn["batch-max"]))
+        player.message("&6Parse time by packet:")
+        for name, timing in sorted(stats["parse"].items(),
+                                   key=lambda x: x[1].get("total-ms", 0),
+                                   reverse=True):
+            player.message(
+                "&7 %s: %s parsed, mean %sms, p99 %sms, max %sms" % (
+                    name, timing["count"], timing["mean-ms"],
+                    timing["p99-ms"], timing["max-ms"]))
+
     def command_reload(self, player, payload):
         if not player.isOp() > 3:
             player.message("&cPermission Denied")
@@ -845,17 +963,19 @@ class Commands(object):
         whitelist = getjsonfile(
             "whitelist", self.wrapper.serverpath, self.wrapper.encoding
         )
+        onlineuuids = self.wrapper.uuids.getuuidsbyusernames(
+            [entry["name"] for entry in whitelist])
+        names = self.wrapper.uuids.getusernamesbyuuids(
+            [found.string for found in onlineuuids.values() if found])
         for index, entry in enumerate(whitelist):
-            onlineuuid = self.wrapper.uuids.getuuidbyusername(
-                whitelist[index]["name"])
+            onlineuuid = onlineuuids["%s" % whitelist[index]["name"]]
             if not onlineuuid:
                 player.message(
                     "Could not find Mojangs entry for %s" % whitelist[index][
                         "name"])
                 player.message("&cSkipped!")
                 continue
-            correctnamed = self.wrapper.uuids.getusernamebyuuid(
-                onlineuuid.string)
+            correctnamed = names[onlineuuid.string]
             whitelist[index]["name"] = correctnamed
             newuuid = self.wrapper.uuids.getuuidfromname(correctnamed).string
             whitelist[index]["uuid"] = newuuid
@@ -882,9 +1002,10 @@ class Commands(object):
         whitelist = getjsonfile(
             "whitelist", self.wrapper.serverpath, self.wrapper.encoding
         )
+        newuuids = self.wrapper.uuids.getuuidsbyusernames(
+            [entry["name"] for entry in whitelist])
         for index, entry in enumerate(whitelist):
-            newuuid = self.wrapper.uuids.getuuidbyusername(
-                whitelist[index]["name"])
+            newuuid = newuuids["%s" % whitelist[index]["name"]]
             if newuuid:
                 uuidlist.append(newuuid.string)
                 whitelist[index]["uuid"] = newuuid.string
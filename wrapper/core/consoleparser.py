@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Classification of server console lines for MCServer.readconsole.
+
+Rather than testing each line for a few dozen substrings in turn, every
+marker substring readconsole cares about is found in one pass of a single
+compiled regex, and the spam list is likewise compiled into one regex
+(recompiled only when the list changes).
+"""
+
+import re
+
+from api.helpers import getargs
+
+# (kind, substring) - the substrings readconsole looks for in a line
+MARKERS = (
+    ("version", "Starting minecraft server version"),
+    ("port", "Starting Minecraft server on"),
+    ("op_usage", "/op <player>"),
+    ("whitelist_usage", "/whitelist <on|off"),
+    ("online_warning", "While this makes the game possible to play"),
+    ("done", "Done ("),
+    ("level", "Preparing level"),
+    ("lost", "lost connection"),
+    ("achievement", "has just earned the achievement"),
+    ("lagged", "Can't keep up!"),
+)
+
+_MARKERS_RE = re.compile("|".join(
+    "(?P<%s>%s)" % (kind, re.escape(text)) for kind, text in MARKERS))
+
+
+class ConsoleClassifier(object):
+    """
+    :deathprefixes: the list of words following a player name in a
+     death message ("fell", "was", ...).
+    """
+    def __init__(self, deathprefixes):
+        self.deathprefixes = deathprefixes
+        self._spam_key = None
+        self._spam_re = None
+
+    @staticmethod
+    def scan(buff):
+        """
+        :returns: a set of the MARKERS kinds found in `buff`.
+        """
+        return set(match.lastgroup for match in _MARKERS_RE.finditer(buff))
+
+    def is_spam(self, buff, spammy_stuff):
+        """
+        :returns: True if `buff` contains any of the `spammy_stuff`
+         strings (which may be added to at any time).
+        """
+        key = tuple(spammy_stuff)
+        if key != self._spam_key:
+            self._spam_re = None
+            if key:
+                self._spam_re = re.compile(
+                    "|".join(re.escape(text) for text in key))
+            self._spam_key = key
+        return self._spam_re is not None and \
+            self._spam_re.search(buff) is not None
+
+    def classify(self, line_words, found):
+        """
+        Decide which kind of line readconsole has, with the same
+        precedence its checks have always had.
+
+        :line_words: the line split on spaces, without prepends.
+        :found: the result of scan().
+
+        :returns: "done", "level", "chat", "login", "logout", "action",
+         "achievement", "say", "death", "lagged", "teleported" (a player
+         teleporting another), "teleport", or None.
+        """
+        first_word = getargs(line_words, 0)
+        second_word = getargs(line_words, 1)
+        if "done" in found:
+            return "done"
+        if "level" in found:
+            return "level"
+        if first_word[0] == "<":
+            return "chat"
+        if second_word == "logged":
+            return "login"
+        if "lost" in found:
+            return "logout"
+        if first_word == "*":
+            return "action"
+        if "achievement" in found:
+            return "achievement"
+        if first_word[0] == "[" and first_word[-1] == "]":
+            return "say"
+        if second_word in self.deathprefixes:
+            return "death"
+        if "lagged" in found:
+            return "lagged"
+        if second_word == "Teleported" and getargs(line_words, 3) == "to":
+            return "teleported"
+        if first_word == "Teleported" and getargs(line_words, 2) == "to":
+            return "teleport"
+        return None
@@ -6,17 +6,217 @@
 # General Public License, version 3 or later.
 
 import threading
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import Queue as queue
 
 from api.player import Player
 
 
+def _lane(event, payload):
+    """
+    The ordering lane of a non-abortable event.  Events of one player run
+    in the order they were fired, as do events of one group ("server.",
+    "irc.", "timer." ...) that are not about a player.
+    """
+    if isinstance(payload, dict):
+        name = payload.get("playername")
+        if name is None and "player" in payload:
+            name = getattr(payload["player"], "username", None)
+        if name:
+            return "player:%s" % name
+    return event.split(".", 1)[0]
+
+
+class EventWorkers(object):
+    """
+    A fixed set of threads running non-abortable events.
+
+    Events are queued in lanes (see _lane).  A lane is run by one worker
+    at a time, so its events keep their order; different lanes run in
+    parallel.
+
+    :workers: number of worker threads.
+    :maxsize: events that may be waiting before the queue is full.
+    :policy: what callevent does when the queue is full: "block" waits
+     for room (backpressure on the thread firing events) and "drop"
+     discards the event.  Events fired by a worker itself (a plugin
+     handler firing another event) are always queued, to not deadlock.
+    """
+    def __init__(self, log, workers=4, maxsize=1000, policy="block",
+                 name="EventProcessor"):
+        self.log = log
+        self.name = name
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._room = threading.Condition(self._lock)
+        self._local = threading.local()
+        # lane: deque of (func, args) - present while the lane has
+        #  events queued or running
+        self._lanes = {}
+        # lanes waiting for a worker
+        self._ready = deque()
+        self.depth = 0
+        self.max_depth = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.workers = []
+        for number in range(max(workers, 1)):
+            t = threading.Thread(target=self._worker,
+                                 name="%s-%d" % (name, number))
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, lane, func, args):
+        """
+        Queue `func(*args)` on `lane`.
+
+        :returns: False if the event was dropped.
+        """
+        with self._lock:
+            while self.depth >= self.maxsize:
+                if getattr(self._local, "worker", False):
+                    break
+                if self.policy == "drop":
+                    self.dropped += 1
+                    if self.dropped in (1, 10, 100) or \
+                            not self.dropped % 1000:
+                        self.log.warning(
+                            "%s queue is full (%s events); %s events "
+                            "dropped so far", self.name, self.depth,
+                            self.dropped)
+                    return False
+                self._room.wait()
+            self.depth += 1
+            self.submitted += 1
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+            try:
+                self._lanes[lane].append((func, args))
+            except KeyError:
+                self._lanes[lane] = deque(((func, args),))
+                self._ready.append(lane)
+                self._work.notify()
+            return True
+
+    def _worker(self):
+        self._local.worker = True
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._work.wait()
+                lane = self._ready.popleft()
+                func, args = self._lanes[lane].popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.exception(
+                    "Exception processing %s: %s", args[0] if args and
+                    isinstance(args[0], str) else lane, e)
+            with self._lock:
+                self.depth -= 1
+                self.completed += 1
+                if self._lanes[lane]:
+                    self._ready.append(lane)
+                    self._work.notify()
+                else:
+                    del self._lanes[lane]
+                self._room.notify()
+
+    def stats(self):
+        with self._lock:
+            return {"workers": len(self.workers),
+                    "queued": self.depth,
+                    "max-queued": self.max_depth,
+                    "queue-size": self.maxsize,
+                    "lanes": len(self._lanes),
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "dropped": self.dropped}
+
+
+class EventWaiter(object):
+    """
+    A channel receiving the events in `events` (see Events.listen).
+
+    Events are queued as {"event": name, "payload": payload} until taken
+    with get(); or, if `callback` is given, passed to
+    `callback(event, payload)` (on the thread firing the event) instead.
+
+    Close the waiter when done with it (or use it in a `with` block).
+    """
+    def __init__(self, events, eventtypes, callback=None):
+        self._events = events
+        self.eventtypes = tuple(eventtypes)
+        self.callback = callback
+        self.queue = queue.Queue()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def deliver(self, event, payload):
+        if self.callback is not None:
+            self.callback(event, payload)
+        else:
+            self.queue.put({"event": event, "payload": payload})
+
+    def get(self, timeout=None):
+        """
+        Wait for the next event.
+
+        :timeout: seconds to wait, or None to wait forever.
+
+        :returns: {"event": name, "payload": payload}, or None if
+         `timeout` passed first.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._events.unlisten(self)
+
+
 class Events(object):
 
     def __init__(self, wrapper):
         self.wrapper = wrapper
         self.log = wrapper.log
-        self.listeners = []
+        config = wrapper.config["General"]
+        self.workers = EventWorkers(
+            self.log, config.get("event-workers", 4),
+            config.get("event-queue-size", 1000),
+            config.get("event-queue-full", "block"))
+        # player commands; kept apart so that a command waiting for its
+        #  player's next event does not hold up that player's lane
+        self.commands = EventWorkers(
+            self.log, config.get("command-workers", 4),
+            config.get("command-queue-size", 100),
+            config.get("command-queue-full", "block"), "PlayerCommand")
+        # event name: [EventWaiter, ...].  Rebuilt, like `index`.
+        self.waiters = {}
+        self._waiters_lock = threading.Lock()
+        # plugin id: {event name: callback}
         self.events = {}
+        # event name: [(plugin id, callback), ...] in plugin load order.
+        #  Rebuilt (not modified) whenever `events` changes, so
+        #  _callevent can use it without a lock.
+        self.index = {}
 
     def __getitem__(self, index):
         if not type(index) == str:
@@ -27,17 +227,58 @@ class Events(object):
         if not type(index) == str:
             raise Exception("A string must be passed - got %s" % type(index))
         self.events[index] = value
+        self._reindex()
         return self.events[index]
 
     def __delitem__(self, index):
         if not type(index) == str:
             raise Exception("A string must be passed - got %s" % type(index))
         del self.events[index]
+        self._reindex()
 
     def __iter__(self):
         for i in self.events:
             yield i
 
+    def register(self, plugin_id, event, callback):
+        """Add a plugin's event callback (see API.registerEvent)."""
+        if plugin_id not in self.events:
+            self.events[plugin_id] = {}
+        self.events[plugin_id][event] = callback
+        self._reindex()
+
+    def _reindex(self):
+        index = {}
+        for plugin_id in list(self.events):
+            for event, callback in list(self.events[plugin_id].items()):
+                index.setdefault(event, []).append((plugin_id, callback))
+        self.index = index
+
+    def listen(self, eventtypes, callback=None):
+        """
+        :returns: a new EventWaiter receiving the events named in
+         `eventtypes` (see EventWaiter).
+        """
+        waiter = EventWaiter(self, eventtypes, callback)
+        with self._waiters_lock:
+            waiters = dict(self.waiters)
+            for event in waiter.eventtypes:
+                waiters[event] = waiters.get(event, []) + [waiter]
+            self.waiters = waiters
+        return waiter
+
+    def unlisten(self, waiter):
+        with self._waiters_lock:
+            waiters = dict(self.waiters)
+            for event in waiter.eventtypes:
+                remaining = [w for w in waiters.get(event, ())
+                             if w is not waiter]
+                if remaining:
+                    waiters[event] = remaining
+                else:
+                    waiters.pop(event, None)
+            self.waiters = waiters
+
     def callevent(self, event, payload, abortable=True):
         """
         This needs some standardization
@@ -54,24 +295,31 @@ class Events(object):
         """
 
         if event == "player.runCommand":
-            abortable = False
+            self.commands.submit(_lane(event, payload),
+                                 self.wrapper.commands.playercommand,
+                                 (payload,))
+            return
 
-        # Event processor thread
+        # nothing is listening (the usual case for timer.tick etc)
+        if event not in self.index and event not in self.waiters:
+            if abortable:
+                return True
+            return
 
         if abortable:
             return self._callevent(event, payload)
-        else:
-            t = threading.Thread(target=self._callevent,
-                                 name="EventProcessor", args=(event, payload))
-            t.daemon = True
-            t.start()
-            return
 
-    def _callevent(self, event, payload):
-        if event == "player.runCommand":
-            self.wrapper.commands.playercommand(payload)
-            return
+        # waiters get the event now, not after the events queued ahead
+        #  of it in its lane (a plugin handler in that lane may be the
+        #  one waiting for it).
+        if event in self.waiters:
+            self._addplayer(payload)
+            self._notifywaiters(event, payload)
+        if event in self.index:
+            self.workers.submit(_lane(event, payload), self._callplugins,
+                                (event, payload))
 
+    def _addplayer(self, payload):
         # create reference player object for payload, if needed.
         if payload and ("playername" in payload) and ("player" not in payload):
 
@@ -84,70 +332,77 @@ class Events(object):
             payload["player"] = self.wrapper.api.minecraft.getPlayer(
                 payload["playername"])
 
-        # listeners is normally empty.
-        # Supposed to be part of the blockForEvent code.
-        for sock in self.listeners:
-            sock.append({"event": event, "payload": payload})
+    def _notifywaiters(self, event, payload):
+        # blockForEvent and other waiters of this event
+        for waiter in self.waiters.get(event, ()):
+            try:
+                waiter.deliver(event, payload)
+            except Exception as e:
+                self.log.exception("Exception delivering '%s' to a "
+                                   "waiter: %s", event, e)
+
+    def _callevent(self, event, payload):
+        self._addplayer(payload)
+        self._notifywaiters(event, payload)
+        return self._callplugins(event, payload)
 
+    def _callplugins(self, event, payload):
+        self._addplayer(payload)
         payload_status = None
         # old_payload = payload  # retaining the original payload might be helpful for the future features.  # noqa
 
         # in all plugins with this event listed..
-        for plugin_id in self.events:
-
-            # for each plugin...
-            if event in self.events[plugin_id]:
-
-                # run the plugin code and get the plugin's return value
-                result = None
-                try:
-                    # 'self.events[plugin_id][event]' is the
-                    # <bound method Main.plugin_event_function>
-                    # pass 'payload' as the argument for the plugin-defined
-                    # event code function
-                    result = self.events[plugin_id][event](payload)
-                except Exception as e:
-                    self.log.exception(
-                        "Plugin '%s' \n"
-                        "experienced an exception calling '%s': \n%s",
-                        plugin_id, event, e
-                    )
-
-                # Evaluate this plugin's result
-                # Every plugin will be given equal time to run it's event code.
-                # However, if one plugin returns a False, no payload changes
-                #  will be possible.
-                #
-                if result is False or payload_status is False:
-                    # mark this event permanently as False
-                    payload_status = False
+        for plugin_id, callback in self.index.get(event, ()):
+            # run the plugin code and get the plugin's return value
+            result = None
+            try:
+                # 'callback' is the
+                # <bound method Main.plugin_event_function>
+                # pass 'payload' as the argument for the plugin-defined
+                # event code function
+                result = callback(payload)
+            except Exception as e:
+                self.log.exception(
+                    "Plugin '%s' \n"
+                    "experienced an exception calling '%s': \n%s",
+                    plugin_id, event, e
+                )
+
+            # Evaluate this plugin's result
+            # Every plugin will be given equal time to run it's event code.
+            # However, if one plugin returns a False, no payload changes
+            #  will be possible.
+            #
+            if result is False or payload_status is False:
+                # mark this event permanently as False
+                payload_status = False
+
+            else:
+                # A payload is being returned
+                # If any plugin rejects the event, no payload changes
+                #  will be authorized.
 
+                # once the payload is modded, payload status must stay True
+                if result in (None, True) and payload_status is not True:
+                    payload_status = None
+                # the next plugin looking at this event sees the
+                #  new payload.
                 else:
-                    # A payload is being returned
-                    # If any plugin rejects the event, no payload changes
-                    #  will be authorized.
-
-                    # once the payload is modded, payload status must stay True
-                    if result in (None, True) and payload_status is not True:
-                        payload_status = None
-                    # the next plugin looking at this event sees the
-                    #  new payload.
+                    if type(result) == dict:
+                        payload = result
+                        payload_status = True
                     else:
-                        if type(result) == dict:
-                            payload = result
-                            payload_status = True
-                        else:
-                            # non dictionary payloads are deprecated and will
-                            # be overridden by dict payloads
-                            # Dict payloads are those that return the
-                            # payload in the same format as it was passed.
-                            self.log.warning("Non-Dict payload %s %s %s",
-                                             payload_status,
-                                             result,
-                                             type(result)
-                                             )
-                            payload = result
-                            payload_status = True
+                        # non dictionary payloads are deprecated and will
+                        # be overridden by dict payloads
+                        # Dict payloads are those that return the
+                        # payload in the same format as it was passed.
+                        self.log.warning("Non-Dict payload %s %s %s",
+                                         payload_status,
+                                         result,
+                                         type(result)
+                                         )
+                        payload = result
+                        payload_status = True
 
         # payload changed
         if payload_status is True:
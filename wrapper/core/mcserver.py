@@ -15,6 +15,8 @@ from api.base import API
 from api.world import World
 from api.player import Player
 
+from core.consoleparser import ConsoleClassifier
+
 import time
 import threading
 import subprocess
@@ -30,6 +32,15 @@ try:
 except ImportError:
     resource = False
 
+try:
+    import queue
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import Queue as queue
+
+# console lines readconsole handles before checking on the server process
+_CONSOLE_BATCH = 200
+
 OFF = 0  # this is the start mode.
 STARTING = 1
 STARTED = 2
@@ -79,7 +90,13 @@ class MCServer(object):
         self.server_autorestart = self.config["General"]["auto-restart"]
         self.proc = None
         self.lastsizepoll = 0
-        self.console_output_data = []
+        # server output lines, from the stdout/stderr reader threads to
+        #  the handle_server loop.
+        self.console_output = queue.Queue(
+            self.config["General"].get("console-queue-size", 5000))
+        self.console_drop = self.config["General"].get(
+            "console-queue-full", "block") == "drop"
+        self.console_dropped = 0
 
         self.server_muted = False
         self.queued_lines = []
@@ -88,6 +105,7 @@ class MCServer(object):
                               "went", "burned", "hit", "tried", "died", "got",
                               "starved", "suffocated", "withered", "shot",
                               "slain"]
+        self.classifier = ConsoleClassifier(self.deathprefixes)
 
         if not self.wrapper.storage["ServerStarted"]:
             self.log.warning(
@@ -109,10 +127,13 @@ class MCServer(object):
         #  just have not cluttered the events holder with another
         #  registration item.
 
+        # minutes and (in the last minute) seconds to a timed reboot
+        self.reboot_left = None
+        self.reboot_countdown = 0
+        self._reboot_task = None
         if self.config["General"]["timed-reboot"]:
-            rb = threading.Thread(target=self.reboot_timer, args=())
-            rb.daemon = True
-            rb.start()
+            self.wrapper.scheduler.call_every(60, self.reboot_timer,
+                                              name="timed reboot")
 
         if self.config["Web"]["web-enabled"]:
             wb = threading.Thread(target=self.eachsecond_web, args=())
@@ -201,8 +222,11 @@ class MCServer(object):
             # The server loop
             while True:
                 # Loop runs continously as long as server console is running
-                time.sleep(0.1)
+                self._read_console_output()
                 if self.proc.poll() is not None:
+                    # the server's last lines
+                    while not self.console_output.empty():
+                        self._read_console_output()
                     self.changestate(OFF)
                     trystart = 0
                     self.boot_server = self.server_autorestart
@@ -210,17 +234,49 @@ class MCServer(object):
                     # to (possibly) connect to server again.
                     break
 
-                # is is only reading server console output
-                for line in self.console_output_data:
-                    try:
-                        self.readconsole(line.replace("\r", ""))
-                    except Exception as e:
-                        self.log.exception(e)
-                self.console_output_data = []
-
         # code ends here on wrapper.halt.halt and execution returns to
         # the end of wrapper.start()
 
+    def _read_console_output(self):
+        """Wait (up to 0.1 seconds) for server output lines and parse
+        them, up to _CONSOLE_BATCH lines at a time."""
+        try:
+            line = self.console_output.get(timeout=0.1)
+        except queue.Empty:
+            return
+        for count in range(_CONSOLE_BATCH):
+            if count:
+                try:
+                    line = self.console_output.get_nowait()
+                except queue.Empty:
+                    return
+            try:
+                self.readconsole(line.replace("\r", ""))
+            except Exception as e:
+                self.log.exception(e)
+
+    def _queue_console_output(self, line):
+        """Hand a server output line to the handle_server loop.  When
+        the queue is full, the line is dropped (and counted) or the
+        reader waits, according to ["General"]["console-queue-full"]."""
+        if self.console_drop:
+            try:
+                self.console_output.put_nowait(line)
+            except queue.Full:
+                self.console_dropped += 1
+                if self.console_dropped in (1, 10, 100) or \
+                        not self.console_dropped % 1000:
+                    self.log.warning(
+                        "Server console queue is full; %s lines dropped "
+                        "so far", self.console_dropped)
+            return
+        while not self.wrapper.halt.halt:
+            try:
+                self.console_output.put(line, timeout=1)
+                return
+            except queue.Full:
+                continue
+
     def _toggle_server_started(self, server_started=True):
         self.wrapper.storage["ServerStarted"] = server_started
         self.wrapper.wrapper_storage.save()
@@ -629,10 +685,14 @@ class MCServer(object):
             # readconsole() (inside handle_server)
             try:
                 data = self.proc.stdout.readline()
+                if not data:
+                    # no server, or its output was closed
+                    time.sleep(0.1)
+                    continue
                 for line in data.split("\n"):
                     if len(line) < 1:
                         continue
-                    self.console_output_data.append(line)
+                    self._queue_console_output(line)
             except Exception as e:
                 time.sleep(0.1)
                 continue
@@ -645,7 +705,9 @@ class MCServer(object):
                 data = self.proc.stderr.readline()
                 if len(data) > 0:
                     for line in data.split("\n"):
-                        self.console_output_data.append(line.replace("\r", ""))
+                        self._queue_console_output(line.replace("\r", ""))
+                else:
+                    time.sleep(0.1)
             except Exception as e:
                 time.sleep(0.1)
                 continue
@@ -755,12 +817,13 @@ class MCServer(object):
         # Standardize the line to only include the text (removing
         # time and log pre-pends)
         line_words = buff.split(' ')[self.prepends_offset:]
+        # every marker substring in the line, found in one pass
+        found = self.classifier.scan(buff)
 
         # find the actual offset is where server output line
         # starts (minus date/time and info stamps).
         # .. and load the proper ops file
-        if "Starting minecraft server version" in buff and \
-                self.prepends_offset == 0:
+        if "version" in found and self.prepends_offset == 0:
 
             for place in range(len(line_words)-1):
                 self.prepends_offset = place
@@ -803,16 +866,17 @@ class MCServer(object):
         #
 
         # Over-ride OP help console display
-        if "/op <player>" in buff:
+        if "op_usage" in found:
             new_usage = "player> [-s SUPER-OP] [-o OFFLINE] [-l <level>]"
             message = buff.replace("player>", new_usage)
             buff = message
-        if "/whitelist <on|off" in buff:
+        if "whitelist_usage" in found:
             new_usage = "/whitelist <on|off|list|add|remvove|reload|offline|online>"  # noqa
             message = new_usage
             buff = message
+            found = self.classifier.scan(buff)
 
-        if "While this makes the game possible to play" in buff:
+        if "online_warning" in found:
             prefix = " ".join(buff.split(' ')[:self.prepends_offset])
 
             if not self.wrapper.wrapper_onlinemode:
@@ -835,16 +899,15 @@ class MCServer(object):
 
             if self.wrapper.proxymode:
                 buff = message
+                found = self.classifier.scan(buff)
 
         # read port of server and display proxy port, if applicable
-        if "Starting Minecraft server on" in buff:
+        if "port" in found:
             self.vitals.server_port = get_int(buff.split(':')[-1:][0])
 
         # check for server console spam before printing to wrapper console
-        server_spaming = False
-        for things in self.vitals.spammy_stuff:
-            if things in buff:
-                server_spaming = True
+        server_spaming = self.classifier.is_spam(buff,
+                                                self.vitals.spammy_stuff)
 
         # server_spaming setting does not stop it from being parsed below.
         if not server_spaming:
@@ -855,9 +918,13 @@ class MCServer(object):
 
         first_word = getargs(line_words, 0)
         second_word = getargs(line_words, 1)
-        # be careful about how these elif's are handled!
+        # the order of the checks is in ConsoleClassifier.classify
+        kind = self.classifier.classify(line_words, found)
+        if kind is None:
+            return
+
         # confirm server start
-        if "Done (" in buff:
+        if kind == "done":
             self._toggle_server_started()
             self.changestate(STARTED)
             self.log.info("Server started")
@@ -865,12 +932,12 @@ class MCServer(object):
                 self.log.info("Proxy listening on *:%s", self.wrapper.proxy.proxy_port)  # noqa
 
         # Getting world name
-        elif "Preparing level" in buff:
+        elif kind == "level":
             self.vitals.worldname = getargs(line_words, 2).replace('"', "")
             self.world = World(self.vitals.worldname, self)
 
         # Player Message
-        elif first_word[0] == "<":
+        elif kind == "chat":
             # get a name out of <name>
             name = self.stripspecial(first_word[1:-1])
             message = self.stripspecial(getargsafter(line_words, 1))
@@ -909,7 +976,7 @@ class MCServer(object):
                 self.log.debug("Console has chat from '%s', but wrapper has no "
                                "known logged-in player object by that name.", name)  # noqa
         # Player Login
-        elif second_word == "logged":
+        elif kind == "login":
             user_desc = first_word.split("[/")
             name = user_desc[0]
             ip_addr = user_desc[1].split(":")[0]
@@ -929,12 +996,12 @@ class MCServer(object):
             self.login(name, eid, location, ip_addr)
 
         # Player Logout
-        elif "lost connection" in buff:
+        elif kind == "logout":
             name = first_word
             self.logout(name)
 
         # player action
-        elif first_word == "*":
+        elif kind == "action":
             name = self.stripspecial(second_word)
             message = self.stripspecial(getargsafter(line_words, 2))
             self.wrapper.events.callevent("player.action", {
@@ -943,7 +1010,7 @@ class MCServer(object):
             }, abortable=False)
 
         # Player Achievement
-        elif "has just earned the achievement" in buff:
+        elif kind == "achievement":
             name = self.stripspecial(first_word)
             achievement = getargsafter(line_words, 6)
             self.wrapper.events.callevent("player.achievement", {
@@ -952,8 +1019,7 @@ class MCServer(object):
             }, abortable=False)
 
         # /say command
-        elif getargs(
-                line_words, 0)[0] == "[" and first_word[-1] == "]":
+        elif kind == "say":
             if self.getservertype != "vanilla":
                 # Unfortunately, Spigot and Bukkit output things
                 # that conflict with this.
@@ -968,7 +1034,7 @@ class MCServer(object):
             }, abortable=False)
 
         # Player Death
-        elif second_word in self.deathprefixes:
+        elif kind == "death":
             name = self.stripspecial(first_word)
             self.wrapper.events.callevent("player.death", {
                 "player": self.getplayer(name),
@@ -976,14 +1042,14 @@ class MCServer(object):
             }, abortable=False)
 
         # server lagged
-        elif "Can't keep up!" in buff:
+        elif kind == "lagged":
             skipping_ticks = getargs(line_words, 17)
             self.wrapper.events.callevent("server.lagged", {
                 "ticks": get_int(skipping_ticks)
             }, abortable=False)
 
         # player teleport
-        elif second_word == "Teleported" and getargs(line_words, 3) == "to":
+        elif kind == "teleported":
             playername = getargs(line_words, 2)
             # [SurestTexas00: Teleported SapperLeader to 48.49417131908783, 77.67081086259394, -279.88880690937475]  # noqa
             if playername in self.wrapper.servervitals.players:
@@ -1013,7 +1079,7 @@ class MCServer(object):
                     <payload>
 
                 """  # noqa
-        elif first_word == "Teleported" and getargs(line_words, 2) == "to":
+        elif kind == "teleport":
             playername = second_word
             # Teleported SurestTexas00 to 48.49417131908783, 77.67081086259394, -279.88880690937475  # noqa
             if playername in self.wrapper.servervitals.players:
@@ -1045,50 +1111,58 @@ class MCServer(object):
                 """  # noqa
     # mcserver.py onsecond Event Handlers
     def reboot_timer(self):
-        rb_mins = self.reboot_minutes
-        rb_mins_warn = self.config["General"]["timed-reboot-warning-minutes"]
-        while not self.wrapper.halt.halt:
-            time.sleep(1)
-            timer = rb_mins - rb_mins_warn
-            while self.vitals.state in (STARTED, STARTING):
-                timer -= 1
-                time.sleep(60)
-                if timer > 0:
-                    continue
-                if timer + rb_mins_warn > 0:
-                    if rb_mins_warn + timer > 1:
-                        self.broadcast("&cServer will reboot in %d "
-                                       "minutes!" % (rb_mins_warn + timer))
-                    else:
-                        self.broadcast("&cServer will reboot in %d "
-                                       "minute!" % (rb_mins_warn + timer))
-                        countdown = 59
-                        timer -= 1
-                        while countdown > 0:
-                            time.sleep(1)
-                            countdown -= 1
-                            if countdown == 0:
-                                if self.wrapper.backups_idle():
-                                    self.restart(self.reboot_message)
-                                else:
-                                    self.broadcast(
-                                        "&cBackup in progress. Server reboot "
-                                        "delayed for one minute..")
-                                    countdown = 59
-                            if countdown % 15 == 0:
-                                self.broadcast("&cServer will reboot in %d "
-                                               "seconds" % countdown)
-                            if countdown < 6:
-                                self.broadcast("&cServer will reboot in %d "
-                                               "seconds" % countdown)
-                    continue
-                if self.wrapper.backups_idle():
-                    self.restart(self.reboot_message)
-                else:
-                    self.broadcast(
-                        "&cBackup in progress. Server reboot "
-                        "delayed..")
-                    timer = rb_mins + rb_mins_warn + 1
+        """Run each minute by the scheduler; counts down timed reboots."""
+        if self.reboot_countdown or self.wrapper.halt.halt:
+            # the last minute is counted by _reboot_countdown
+            return
+        if self.vitals.state not in (STARTED, STARTING):
+            self.reboot_left = None
+            return
+        if self.reboot_left is None:
+            self.reboot_left = self.reboot_minutes
+        self.reboot_left -= 1
+        if self.reboot_left > self.reboot_warn_minutes:
+            return
+        if self.reboot_left > 1:
+            self.broadcast("&cServer will reboot in %d "
+                           "minutes!" % self.reboot_left)
+        elif self.reboot_left == 1:
+            self.broadcast("&cServer will reboot in %d "
+                           "minute!" % self.reboot_left)
+            self.reboot_countdown = 60
+            self._reboot_task = self.wrapper.scheduler.call_every(
+                1, self._reboot_countdown, name="timed reboot countdown")
+        elif self.wrapper.backups_idle():
+            self.reboot_left = None
+            self._timed_restart()
+        else:
+            self.broadcast(
+                "&cBackup in progress. Server reboot "
+                "delayed..")
+            self.reboot_left = 1
+
+    def _timed_restart(self):
+        # restart() waits for the server to save (seconds); keep that off
+        #  the scheduler thread, which runs everyone's periodic work.
+        self.wrapper.scheduler.call_later(
+            0, self.restart, (self.reboot_message,), name="timed reboot",
+            blocking=True)
+
+    def _reboot_countdown(self):
+        self.reboot_countdown -= 1
+        if self.reboot_countdown == 0:
+            if self.wrapper.backups_idle():
+                self._reboot_task.cancel()
+                self.reboot_left = None
+                self._timed_restart()
+                return
+            self.broadcast(
+                "&cBackup in progress. Server reboot "
+                "delayed for one minute..")
+            self.reboot_countdown = 59
+        if self.reboot_countdown % 15 == 0 or self.reboot_countdown < 6:
+            self.broadcast("&cServer will reboot in %d "
+                           "seconds" % self.reboot_countdown)
 
     def eachsecond_web(self):
         if time.time() - self.lastsizepoll > 120:
@@ -9,7 +9,11 @@
 import ast
 import fnmatch
 import copy
+import functools
 import json
+import operator
+import re
+import threading
 
 
 class Permissions(object):
@@ -30,6 +34,16 @@ class Permissions(object):
         self.wrapper = wrapper
         self.log = self.wrapper.log
 
+        # has_permission caches (see invalidate())
+        self._lock = threading.Lock()
+        self._generation = 0
+        # (uuid, node, group_match, find_child_groups): result
+        self._results = {}
+        # (uuid, find_child_groups): the user's groups and child groups
+        self._user_groups = {}
+        # ("user", uuid) or ("group", name): compiled permission nodes
+        self._matchers = {}
+
         # populate dictionary items to prevent errors due to missing items
         if "groups" not in self.wrapper.wrapper_permissions.Data:
             self.wrapper.wrapper_permissions.Data["groups"] = {}
@@ -56,8 +70,52 @@ class Permissions(object):
 
     def fill_user(self, uuid):
         self.wrapper.wrapper_permissions.Data["users"][uuid] = copy.deepcopy(self.empty_user)
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the cached has_permission results.  Every change to
+        the permissions data (or to registered permissions) must call
+        this."""
+        with self._lock:
+            self._generation += 1
+            self._results = {}
+            self._user_groups = {}
+            self._matchers = {}
+
+    @staticmethod
+    def _compile(permissions):
+        """
+        :returns: the nodes of a permissions dictionary as a list of
+         (match, value) in dictionary order; `match(node)` is true if
+         the (possibly wildcard) node matches `node`.
+        """
+        compiled = []
+        for perm, value in list(permissions.items()):
+            if "*" in perm or "?" in perm or "[" in perm:
+                match = re.compile(fnmatch.translate(perm)).match
+            else:
+                match = functools.partial(operator.eq, perm)
+            compiled.append((match, value))
+        return compiled
+
+    def _remember(self, generation, cache, key, value):
+        """Store `value` in the cache named `cache`, unless the
+        permissions changed (invalidate()) since `generation` was read
+        and `value` may be stale."""
+        with self._lock:
+            if generation == self._generation:
+                getattr(self, cache)[key] = value
+
+    def _matcher(self, generation, key, permissions):
+        try:
+            return self._matchers[key]
+        except KeyError:
+            compiled = self._compile(permissions)
+            self._remember(generation, "_matchers", key, compiled)
+            return compiled
 
     def clean_perms_data(self):
+        self.invalidate()
 
         deletes = []
         for user in self.wrapper.wrapper_permissions.Data["users"]:
@@ -81,11 +139,13 @@ class Permissions(object):
             return "Group '%s' already exists!" % groupname
 
         self.wrapper.wrapper_permissions.Data["groups"][groupname] = {"permissions": {}}
+        self.invalidate()
         return "Created a new permissions group '%s'." % groupname
 
     def group_delete(self, groupname):
         """Will attempt to delete groupname, regardless of case."""
         deletename = groupname.lower()
+        self.invalidate()
         if deletename in self.wrapper.wrapper_permissions.Data["groups"]:
             self.wrapper.wrapper_permissions.Data["groups"].pop(deletename)
             return "Deleted permissions group '%s'." % deletename
@@ -121,6 +181,7 @@ class Permissions(object):
 
         # set the node
         self.wrapper.wrapper_permissions.Data["groups"][setname]["permissions"][setnode] = value
+        self.invalidate()
         return "Added node/group '%s' to Group '%s'!" % (setnode, setname)
 
     def group_delete_permission(self, group, node):
@@ -132,6 +193,7 @@ class Permissions(object):
 
         if setnode in self.wrapper.wrapper_permissions.Data["groups"][setgroup]["permissions"]:
             del self.wrapper.wrapper_permissions.Data["groups"][setgroup]["permissions"][setnode]
+            self.invalidate()
             return "Removed permission node '%s' from group '%s'." % (
                 setnode, setgroup)
 
@@ -179,22 +241,39 @@ class Permissions(object):
         it will return the value (usually True) of the node.
         Otherwise, it returns False.
         """
-        if uuid not in self.wrapper.wrapper_permissions.Data["users"]:
-            self.fill_user(uuid)
-            # we dont just return false because it could be a first-
-            # time check for a default or None permission.
-
         if node is None:
+            if uuid not in self.wrapper.wrapper_permissions.Data["users"]:
+                self.fill_user(uuid)
             return True
 
         # ensure lower case
         node = node.lower()
 
+        key = (uuid, node, group_match, find_child_groups)
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+        generation = self._generation
+        result = self._resolve_permission(
+            generation, uuid, node, group_match, find_child_groups)
+        self._remember(generation, "_results", key, result)
+        return result
+
+    def _resolve_permission(self, generation, uuid, node, group_match,
+                            find_child_groups):
+        if uuid not in self.wrapper.wrapper_permissions.Data["users"]:
+            self.fill_user(uuid)
+            # we dont just return false because it could be a first-
+            # time check for a default or None permission.
+
+        userdata = self.wrapper.wrapper_permissions.Data["users"][uuid]
+
         # user has permission directly
-        for perm in self.wrapper.wrapper_permissions.Data["users"][uuid]["permissions"]:
-            if node in fnmatch.filter([node], perm):
-                return self.wrapper.wrapper_permissions.Data[
-                    "users"][uuid]["permissions"][perm]
+        for match, value in self._matcher(
+                generation, ("user", uuid), userdata["permissions"]):
+            if match(node):
+                return value
 
         # return a registered permission;
         for pid in self.wrapper.registered_permissions:
@@ -206,24 +285,28 @@ class Permissions(object):
             return False
 
         # summary of groups, which will include child groups
-        allgroups = []
-
-        # get the user's groups
-        for group in self.wrapper.wrapper_permissions.Data["users"][uuid]["groups"]:
-            allgroups.append(group)
-
-        if find_child_groups:
-            allgroups = self._group_find_children(allgroups)
+        groups_key = (uuid, find_child_groups)
+        try:
+            allgroups = self._user_groups[groups_key]
+        except KeyError:
+            # get the user's groups
+            allgroups = list(userdata["groups"])
+            if find_child_groups:
+                allgroups = self._group_find_children(allgroups)
+            self._remember(generation, "_user_groups", groups_key,
+                           allgroups)
 
         # return if group matches
+        groupdata = self.wrapper.wrapper_permissions.Data["groups"]
         for group in allgroups:
             # this must be checked because a race condition can
             # render the groupname non-existent.
-            if group in self.wrapper.wrapper_permissions.Data["groups"]:
-                for perm in self.wrapper.wrapper_permissions.Data["groups"][group]["permissions"]:
-                    if node in fnmatch.filter([node], perm):
-                        return self.wrapper.wrapper_permissions.Data["groups"][group][
-                            "permissions"][perm]
+            if group in groupdata:
+                for match, value in self._matcher(
+                        generation, ("group", group),
+                        groupdata[group]["permissions"]):
+                    if match(node):
+                        return value
 
         # no permission;
         return False
@@ -247,6 +330,7 @@ class Permissions(object):
             self.fill_user(uuid)
 
         self.wrapper.wrapper_permissions.Data["users"][uuid]["permissions"][node.lower()] = value
+        self.invalidate()
 
     def remove_permission(self, uuid, node):
         """Completely removes a permission node from the player. They
@@ -261,6 +345,7 @@ class Permissions(object):
 
         if node in self.wrapper.wrapper_permissions.Data["users"][uuid]["permissions"]:
             del self.wrapper.wrapper_permissions.Data["users"][uuid]["permissions"][node]
+            self.invalidate()
             return True
 
         self.log.debug("Uuid:%s does not have permission node '%s'" % (
@@ -327,6 +412,7 @@ class Permissions(object):
                 "users"][uuid]["groups"]:
             self.wrapper.wrapper_permissions.Data[
                 "users"][uuid]["groups"].append(group)
+            self.invalidate()
 
         # return the resulting change (as verification)
         return self.has_group(uuid, group)
@@ -341,6 +427,7 @@ class Permissions(object):
 
         if group in self.wrapper.wrapper_permissions.Data["users"][uuid]["groups"]:
             self.wrapper.wrapper_permissions.Data["users"][uuid]["groups"].remove(group)
+            self.invalidate()
             return True
 
         self.log.debug("UUID:%s was not part of the group '%s'" % (
@@ -350,6 +437,7 @@ class Permissions(object):
     def clear_group_data(self):
         """Resets group data."""
         self.wrapper.wrapper_permissions.Data["groups"] = {}
+        self.invalidate()
 
     def clear_user_data(self):
         for user in self.wrapper.wrapper_permissions.Data["users"]:
@@ -126,6 +126,7 @@ class Plugins(object):
         self.wrapper.commands[pid] = {}
         self.wrapper.events[pid] = {}
         self.wrapper.registered_permissions[pid] = {}
+        self.wrapper.perms.invalidate()
         self.wrapper.help[pid] = {}
         can_enable = main.onEnable()
         if can_enable is False:
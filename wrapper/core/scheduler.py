@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+One thread for wrapper's periodic work (timer events, player play time
+tracking, storage saves, timed reboots) instead of a sleeping thread
+for each.
+
+Tasks are kept in a hierarchical timer wheel: level 0 has a slot per
+tick (RESOLUTION seconds), and each higher level has a slot per turn of
+the level below.  Scheduling and cancelling a task is a dictionary
+insert or delete, and the thread only wakes when a slot holding tasks
+is due.  Tasks run on the scheduler thread, so they must be quick;
+`blocking` tasks (disk writes...) are handed to a second thread.
+
+The time spent in each task (by name) is accounted for stats().
+"""
+
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+RESOLUTION = 0.01
+SLOTS = 64
+LEVELS = 4
+
+# monotonic, high resolution clock where available
+_clock = getattr(time, "monotonic", time.time)
+
+
+class Task(object):
+    """A scheduled call.  `cancel()` stops it."""
+    __slots__ = ("scheduler", "id", "name", "func", "args", "interval",
+                 "blocking", "due", "level", "cancelled")
+
+    def __init__(self, scheduler, func, args, interval, blocking, name):
+        self.scheduler = scheduler
+        self.id = None
+        self.name = name
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.blocking = blocking
+        self.due = 0
+        self.level = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class Scheduler(object):
+    def __init__(self, name="Scheduler", resolution=RESOLUTION):
+        self.name = name
+        self.resolution = resolution
+        self.log = logging.getLogger(name)
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        # level: [slot: {task id: task}]
+        self._wheels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._counts = [0] * LEVELS
+        self._start = _clock()
+        self._tick = 0
+        self._thread = None
+        # blocking tasks waiting for the blocking thread
+        self._blocking = deque()
+        self._blocking_cond = threading.Condition()
+        self._blocking_thread = None
+        # task name: [runs, total seconds, max seconds]
+        self.costs = {}
+        self.max_late = 0.0
+
+    def call_later(self, delay, func, args=(), name=None, blocking=False):
+        """
+        Call `func(*args)` once, `delay` seconds from now.
+
+        :returns: the Task.
+        """
+        return self._schedule(func, args, None, delay, blocking, name)
+
+    def call_every(self, interval, func, args=(), name=None, blocking=False,
+                   delay=None):
+        """
+        Call `func(*args)` every `interval` seconds (the first time
+        after `delay`, which defaults to `interval`).
+
+        :returns: the Task.
+        """
+        if delay is None:
+            delay = interval
+        return self._schedule(func, args, interval, delay, blocking, name)
+
+    def cancel(self, task):
+        with self._cond:
+            task.cancelled = True
+            self._remove(task)
+
+    def _schedule(self, func, args, interval, delay, blocking, name):
+        if name is None:
+            name = getattr(func, "__name__", repr(func))
+        task = Task(self, func, args, interval, blocking, name)
+        task.id = next(self._ids)
+        with self._cond:
+            task.due = self._ticks_at(_clock() + delay)
+            self._place(task)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, args=())
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return task
+
+    def _ticks_at(self, when):
+        # the first tick at or after `when`, and never the current one
+        due = int(-(-(when - self._start) // self.resolution))
+        return max(due, self._tick + 1)
+
+    def _place(self, task):
+        delta = task.due - self._tick
+        level = 0
+        while level < LEVELS - 1 and delta >= SLOTS ** (level + 1):
+            level += 1
+        due = min(task.due, self._tick + SLOTS ** LEVELS - 1)
+        slot = (due // SLOTS ** level) % SLOTS
+        self._wheels[level][slot][task.id] = task
+        self._counts[level] += 1
+        task.level = (level, slot)
+
+    def _remove(self, task):
+        if task.level is None:
+            return
+        level, slot = task.level
+        if self._wheels[level][slot].pop(task.id, None) is not None:
+            self._counts[level] -= 1
+        task.level = None
+
+    def _next_tick(self):
+        """The next tick that has anything to do, or None."""
+        tick = self._tick
+        # a cascade is due at the next turn of the lowest busy level
+        found = None
+        for level in range(1, LEVELS):
+            if self._counts[level]:
+                span = SLOTS ** level
+                found = (tick // span + 1) * span
+                break
+        if self._counts[0]:
+            for ahead in range(1, SLOTS + 1):
+                if self._wheels[0][(tick + ahead) % SLOTS]:
+                    if found is None or tick + ahead < found:
+                        found = tick + ahead
+                    break
+        return found
+
+    def _advance(self, tick):
+        """Move to `tick`: cascade higher levels and take due tasks."""
+        self._tick = tick
+        for level in range(LEVELS - 1, 0, -1):
+            span = SLOTS ** level
+            if tick % span:
+                continue
+            slot = self._wheels[level][(tick // span) % SLOTS]
+            if not slot:
+                continue
+            tasks = list(slot.values())
+            slot.clear()
+            self._counts[level] -= len(tasks)
+            for task in tasks:
+                task.level = None
+                self._place(task)
+        slot = self._wheels[0][tick % SLOTS]
+        due = list(slot.values())
+        slot.clear()
+        self._counts[0] -= len(due)
+        for task in due:
+            task.level = None
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                tick = self._next_tick()
+                while tick is None:
+                    self._cond.wait()
+                    tick = self._next_tick()
+                wait = self._start + tick * self.resolution - _clock()
+                if wait > 0:
+                    # woken early by a new task, which may be due sooner
+                    self._cond.wait(wait)
+                    continue
+                self.max_late = max(self.max_late, -wait)
+                due = self._advance(tick)
+            for task in due:
+                if task.cancelled:
+                    continue
+                if task.blocking:
+                    self._hand_off(task)
+                else:
+                    self._call(task)
+
+    def _call(self, task):
+        start = _clock()
+        # noinspection PyBroadException
+        try:
+            task.func(*task.args)
+        except Exception as e:
+            self.log.exception("Scheduled task '%s' failed: %s", task.name, e)
+        elapsed = _clock() - start
+        with self._cond:
+            cost = self.costs.get(task.name)
+            if cost is None:
+                self.costs[task.name] = [1, elapsed, elapsed]
+            else:
+                cost[0] += 1
+                cost[1] += elapsed
+                if elapsed > cost[2]:
+                    cost[2] = elapsed
+            if task.interval is None or task.cancelled:
+                return
+            now = _clock()
+            task.due = self._ticks_at(max(
+                self._start + task.due * self.resolution + task.interval,
+                now))
+            self._place(task)
+            self._cond.notify()
+
+    def _hand_off(self, task):
+        with self._blocking_cond:
+            self._blocking.append(task)
+            if self._blocking_thread is None:
+                self._blocking_thread = threading.Thread(
+                    target=self._run_blocking, name="%s-blocking" % self.name,
+                    args=())
+                self._blocking_thread.daemon = True
+                self._blocking_thread.start()
+            self._blocking_cond.notify()
+
+    def _run_blocking(self):
+        while True:
+            with self._blocking_cond:
+                while not self._blocking:
+                    self._blocking_cond.wait()
+                task = self._blocking.popleft()
+            if not task.cancelled:
+                self._call(task)
+
+    def stats(self):
+        """
+        :returns: a dictionary of the number of scheduled tasks, the
+         latest the thread has woken ("max-late-ms") and, by task name,
+         runs, total-ms, mean-ms and max-ms.
+        """
+        with self._cond:
+            scheduled = sum(self._counts)
+            costs = [(name, list(cost)) for name, cost in self.costs.items()]
+        tasks = {}
+        for name, (runs, total, longest) in costs:
+            tasks[name] = {"runs": runs,
+                           "total-ms": round(total * 1000, 3),
+                           "mean-ms": round(total * 1000 / runs, 3),
+                           "max-ms": round(longest * 1000, 3)}
+        return {"scheduled": scheduled,
+                "max-late-ms": round(self.max_late * 1000, 3),
+                "tasks": tasks}
+
+
+# the scheduler wrapper's own periodic work runs on
+SCHEDULER = Scheduler()
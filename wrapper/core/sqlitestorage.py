@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+The "sqlite" backend of API.base.getStorage().
+
+The storage lives in one SQLite database file (<root>/<name>.db) with a
+row per top-level key of `Data`.  Rows are only read (and unpickled)
+when their key is used, so opening a large storage costs nothing, and
+secondary indexes on a field of the values answer lookups and range
+queries without reading every row.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import sqlite3
+except ImportError:
+    # Python built without sqlite
+    sqlite3 = False
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # Py2
+    from collections import MutableMapping
+
+from api.helpers import mkdir_p, getjsonfile, PY3
+from api.helpers import pickle_load, pickle_protocol, Pickle
+from core.config import Config
+from core.storage import _WRITER, _digest
+
+if PY3:
+    _KEY_TYPES = (str, int, float, bytes)
+else:
+    # noinspection PyUnresolvedReferences
+    _KEY_TYPES = (str, unicode, int, long, float)  # noqa
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS data (key PRIMARY KEY, value)",
+    "CREATE TABLE IF NOT EXISTS indexes (name TEXT PRIMARY KEY, field TEXT)",
+    "CREATE TABLE IF NOT EXISTS index_rows (name TEXT, value, key)",
+    "CREATE INDEX IF NOT EXISTS index_lookup ON index_rows (name, value)",
+    "CREATE INDEX IF NOT EXISTS index_keys ON index_rows (key)",
+)
+
+# values of each storage kept in memory (see SqliteData)
+CACHE_SIZE = 1000
+
+
+class SqliteData(MutableMapping):
+    """
+    The dictionary-like `Data` of a SqliteStorage.  Keys must be
+    strings or numbers.  Values can be anything the storage can
+    pickle (or, with pickle=False, anything json can encode).
+
+    Values that are read are kept, so changing them in place
+    (`Data["key"]["x"] = 1`) is saved like it is for a file storage.
+    Each save writes back the changed values and then releases all but
+    the `cache_size` (CACHE_SIZE) most recently used ones.  A released
+    value is still checked at the next save (and written back, with a
+    warning, if it was changed in place), and reading its key again
+    before then keeps it.  Only a value held across two saves without
+    being read again, and then changed in place, is not saved; assign
+    it back (`Data["key"] = value`) instead.
+
+    Besides the usual dictionary methods:
+
+    :range(low=None, high=None): (key, value) pairs, ordered by key,
+     of the keys between low and high (inclusive).
+
+    :add_index(name, field): index the values by `value[field]`
+     (a dictionary key or list position).
+
+    :find(name, low, high=None): the keys whose indexed field equals
+     `low` or, with `high`, lies between low and high (inclusive).
+
+    """
+    def __init__(self, storage):
+        self._storage = storage
+        self._db = storage.db
+        self._lock = storage.lock
+        # key: value of the rows recently read or written, least
+        #  recently used first
+        self._cache = OrderedDict()
+        self.cache_size = CACHE_SIZE
+        # key: digest of the cached value as it is in the database
+        self._saved = {}
+        # key: (value, digest) released by the last flush
+        self._released = {}
+        # index name: field
+        self._indexes = {}
+        with self._lock:
+            for name, field in self._db.execute(
+                    "SELECT name, field FROM indexes").fetchall():
+                self._indexes[name] = json.loads(field)
+
+    @staticmethod
+    def _checkkey(key):
+        if not isinstance(key, _KEY_TYPES):
+            raise TypeError("SqliteStorage keys must be strings or "
+                            "numbers, not %s" % type(key).__name__)
+
+    def _cached(self, key):
+        # :raises: KeyError if `key` is not cached
+        try:
+            value = self._cache.pop(key)
+        except KeyError:
+            # keep using a released value; it may be held and changed
+            value, digest = self._released.pop(key)
+            self._saved[key] = digest
+        self._cache[key] = value
+        return value
+
+    def _keep(self, key, value, digest):
+        self._cache.pop(key, None)
+        self._released.pop(key, None)
+        self._cache[key] = value
+        self._saved[key] = digest
+
+    def _load(self, key, blob):
+        try:
+            return self._cached(key)
+        except KeyError:
+            pass
+        value = self._storage.loads(blob)
+        self._keep(key, value, _digest(bytes(blob)))
+        return value
+
+    def _store(self, key, value, blob):
+        self._db.execute("INSERT OR REPLACE INTO data (key, value) "
+                         "VALUES (?, ?)", (key, self._storage.column(blob)))
+        self._index(key, value)
+
+    def _write(self, key, value, blob):
+        self._store(key, value, blob)
+        self._keep(key, value, _digest(blob))
+
+    def _index(self, key, value):
+        self._db.execute("DELETE FROM index_rows WHERE key = ?", (key,))
+        for name, field in self._indexes.items():
+            try:
+                indexed = value[field]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if isinstance(indexed, _KEY_TYPES):
+                self._db.execute(
+                    "INSERT INTO index_rows (name, value, key) "
+                    "VALUES (?, ?, ?)", (name, indexed, key))
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                return self._cached(key)
+            except KeyError:
+                pass
+            row = self._db.execute(
+                "SELECT value FROM data WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            return self._load(key, row[0])
+
+    def __setitem__(self, key, value):
+        self._checkkey(key)
+        blob = self._storage.dumps(value)
+        with self._lock:
+            self._write(key, value, blob)
+
+    def __delitem__(self, key):
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM data WHERE key = ?", (key,)).rowcount
+            self._db.execute("DELETE FROM index_rows WHERE key = ?", (key,))
+            self._cache.pop(key, None)
+            self._released.pop(key, None)
+            self._saved.pop(key, None)
+        if not deleted:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._cache:
+                return True
+            return self._db.execute(
+                "SELECT 1 FROM data WHERE key = ?", (key,)
+            ).fetchone() is not None
+
+    def __iter__(self):
+        with self._lock:
+            keys = self._db.execute(
+                "SELECT key FROM data ORDER BY key").fetchall()
+        return iter([row[0] for row in keys])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+
+    def range(self, low=None, high=None):
+        query = "SELECT key, value FROM data"
+        where = []
+        args = []
+        if low is not None:
+            where.append("key >= ?")
+            args.append(low)
+        if high is not None:
+            where.append("key <= ?")
+            args.append(high)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY key", args).fetchall()
+            return [(key, self._load(key, blob)) for key, blob in rows]
+
+    def add_index(self, name, field):
+        with self._lock:
+            if self._indexes.get(name) == field:
+                return
+            self._indexes[name] = field
+            self._db.execute("INSERT OR REPLACE INTO indexes (name, field) "
+                             "VALUES (?, ?)", (name, json.dumps(field)))
+            self._db.execute("DELETE FROM index_rows WHERE name = ?",
+                             (name,))
+            rows = self._db.execute("SELECT key, value FROM data").fetchall()
+            for key, blob in rows:
+                value = self._cache.get(key)
+                if value is None:
+                    value = self._storage.loads(blob)
+                try:
+                    indexed = value[field]
+                except (KeyError, IndexError, TypeError):
+                    continue
+                if isinstance(indexed, _KEY_TYPES):
+                    self._db.execute(
+                        "INSERT INTO index_rows (name, value, key) "
+                        "VALUES (?, ?, ?)", (name, indexed, key))
+
+    def find(self, name, low, high=None):
+        if name not in self._indexes:
+            raise KeyError("No index named '%s'" % name)
+        with self._lock:
+            if high is None:
+                rows = self._db.execute(
+                    "SELECT key FROM index_rows WHERE name = ? AND value = ?",
+                    (name, low)).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT key FROM index_rows WHERE name = ? AND "
+                    "value >= ? AND value <= ? ORDER BY value",
+                    (name, low, high)).fetchall()
+        return [row[0] for row in rows]
+
+    def flush(self, force=False):
+        """
+        Write back the cached values that were changed in place, then
+        release the least recently used ones beyond `cache_size`.
+        """
+        with self._lock:
+            changed = 0
+            for key, (value, digest) in list(self._released.items()):
+                blob = self._storage.dumps(value)
+                if _digest(blob) != digest:
+                    self._store(key, value, blob)
+                    changed += 1
+            if changed:
+                self._storage.log.warning(
+                    "%d values of storage '%s' were changed in place long "
+                    "after they were read; assign changed values back "
+                    "(Data[key] = value)", changed, self._storage.name)
+            self._released = {}
+            for key, value in list(self._cache.items()):
+                blob = self._storage.dumps(value)
+                digest = _digest(blob)
+                if force or digest != self._saved.get(key):
+                    self._store(key, value, blob)
+                    self._saved[key] = digest
+            while len(self._cache) > self.cache_size:
+                key, value = self._cache.popitem(last=False)
+                self._released[key] = (value, self._saved.pop(key))
+
+    def forget(self):
+        """Drop the cached values (they are read again when used)."""
+        with self._lock:
+            self._cache = OrderedDict()
+            self._released = {}
+            self._saved = {}
+
+
+class SqliteStorage(object):
+    """
+    A Storage kept in a SQLite database.  Returned by
+    `api.getStorage(name, backend="sqlite")`; it has the same methods
+    and properties as Storage (see core.storage), but `Data` is a
+    SqliteData.
+
+    When the database is created, an existing file storage of the same
+    name (<name>.pkl or <name>.json) is imported into it.
+
+    """
+
+    def __init__(self, name, root="wrapper-data/json", pickle=True):
+        if not sqlite3:
+            raise ImportError("The sqlite storage backend needs the Python "
+                              "sqlite3 module.")
+        self.name = name
+        self.root = root
+        self.pickle = pickle
+        self.configManager = Config()
+        self.configManager.loadconfig()
+        self.log = logging.getLogger('Storage.py')
+        self.encoding = self.configManager.config["General"]["encoding"]
+        self.paused_saving = False
+        self.periodic_save_timer = 60
+        self.file_ext = "db"
+
+        mkdir_p(self.root)
+        path = "%s/%s.%s" % (self.root, self.name, self.file_ext)
+        new = not os.path.exists(path)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+        self.Data = SqliteData(self)
+        if new:
+            self._import()
+        self.db.commit()
+
+        self.timer = time.time()
+        self.abort = False
+        _WRITER.add(self)
+
+    def dumps(self, value):
+        if self.pickle:
+            return Pickle.dumps(value, pickle_protocol(self.encoding))
+        text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        return text
+
+    def loads(self, blob):
+        if self.pickle:
+            return Pickle.loads(bytes(blob))
+        return json.loads(bytes(blob).decode("utf-8"))
+
+    @staticmethod
+    def column(blob):
+        return sqlite3.Binary(blob)
+
+    def _import(self):
+        data = None
+        if os.path.exists("%s/%s.pkl" % (self.root, self.name)):
+            data = pickle_load(self.root, "%s.pkl" % self.name)
+        elif os.path.exists("%s/%s.json" % (self.root, self.name)):
+            data = getjsonfile(self.name, self.root, encodedas=self.encoding)
+        if not isinstance(data, dict):
+            return
+        skipped = 0
+        for key, value in data.items():
+            try:
+                self.Data[key] = value
+            except TypeError:
+                skipped += 1
+        self.Data.forget()
+        self.log.info("Imported %d records into '%s/%s.db' (%d skipped)",
+                      len(data) - skipped, self.root, self.name, skipped)
+
+    def load(self):
+        """
+        Discard the values read so far; they are read from the
+        database again when used.
+
+        :return: Nothing
+
+        """
+        self.Data.forget()
+
+    def save(self, force=False):
+        """
+        Save values changed in place and commit the database.  Saves
+        are also done periodically and when the storage is closed.
+
+        :return: Nothing
+        """
+        with self.lock:
+            self.Data.flush(force)
+            self.db.commit()
+
+    def close(self):
+        """
+        Close the Storage and save it's Data to disk.
+
+        :return: Nothing
+        """
+        self.abort = True
+        _WRITER.remove(self)
+        with self.lock:
+            self.save()
+            self.db.close()
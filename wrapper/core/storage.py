@@ -9,12 +9,80 @@
 
 import os
 import time
+import json
+import hashlib
 import logging
-from api.helpers import mkdir_p, putjsonfile, getjsonfile
-from api.helpers import pickle_save, pickle_load
+from api.helpers import mkdir_p, getjsonfile
+from api.helpers import pickle_load, pickle_protocol, Pickle
 from core.config import Config
+from core.scheduler import SCHEDULER
 import threading
 
+# a journal is compacted into the main file once it grows larger than
+# the main file (or this many bytes, whichever is larger)
+JOURNAL_MIN_COMPACT = 65536
+
+
+def _replace(source, destination):
+    """Rename `source` over `destination` (atomically where possible)."""
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Py2 - rename does not overwrite an existing file on Windows
+        if os.name == "nt" and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def _digest(blob):
+    return hashlib.sha1(blob).digest()
+
+
+class _StorageWriter(object):
+    """
+    The periodic saves of every open Storage, done by one scheduler
+    task (on the scheduler's blocking thread) while any is open.
+    """
+    def __init__(self):
+        self.log = logging.getLogger('Storage.py')
+        self._lock = threading.Lock()
+        self._stores = set()
+        self._task = None
+
+    def add(self, store):
+        with self._lock:
+            self._stores.add(store)
+            if self._task is None:
+                self._task = SCHEDULER.call_every(
+                    1, self._save_due, name="storage saves", blocking=True)
+
+    def remove(self, store):
+        with self._lock:
+            self._stores.discard(store)
+            if not self._stores and self._task is not None:
+                self._task.cancel()
+                self._task = None
+
+    def _save_due(self):
+        with self._lock:
+            stores = list(self._stores)
+        now = time.time()
+        for store in stores:
+            if store.paused_saving or store.abort:
+                continue
+            if now - store.timer > store.periodic_save_timer:
+                store.timer = now
+                # noinspection PyBroadException
+                try:
+                    store.save()
+                except Exception as e:
+                    self.log.error("Periodic save of storage '%s/%s' "
+                                   "failed: %s", store.root, store.name,
+                                   e)
+
+
+_WRITER = _StorageWriter()
+
 
 class Storage(object):
     """
@@ -25,6 +93,10 @@ class Storage(object):
         :name: Storage name on disk.
         :root="wrapper-data/json": File path of the storage.
         :pickle=True: True to use Binary storage, False to use json.
+        :journal=False: True to save changes to a large dictionary
+         by appending the changed top-level keys to a journal file
+         (<name>.<ext>.journal) rather than rewriting the whole file.
+         The journal is folded back into the main file as it grows.
 
     :Methods:
         :load():
@@ -35,13 +107,21 @@ class Storage(object):
         :periodic_save_timer:  Default is 60 seconds
         :paused_saving:  Set to True to pause the periodic save.
 
+    A Storage is only written when its Data has changed since it was
+    loaded or last saved.  Files are replaced atomically (written to a
+    temporary file which is then renamed), so a crash during a save
+    leaves the previous file intact.  Periodic saves of all storages
+    are done by one shared task of the wrapper scheduler.
+
     """
 
-    def __init__(self, name, root="wrapper-data/json", pickle=True):
+    def __init__(self, name, root="wrapper-data/json", pickle=True,
+                 journal=False):
         self.Data = {}
         self.name = name
         self.root = root
         self.pickle = pickle
+        self.journal = journal
         self.configManager = Config()
         self.configManager.loadconfig()
         self.log = logging.getLogger('Storage.py')
@@ -54,25 +134,27 @@ class Storage(object):
         else:
             self.file_ext = "json"
 
+        self._lock = threading.RLock()
+        # digest of the saved Data (or, in journal mode, of each key)
+        self._saved = None
+        self._saved_keys = {}
+
         self.load()
         self.timer = time.time()
         self.abort = False
+        _WRITER.add(self)
 
-        t = threading.Thread(target=self._periodicsave, args=())
-        t.daemon = True
-        t.start()
+    @property
+    def _path(self):
+        return "%s/%s.%s" % (self.root, self.name, self.file_ext)
 
-    def _periodicsave(self):
-        # doing it this way (versus just sleep() for certain number of seconds),
-        # allows faster shutdown response
-        while not self.abort:
-            if self.paused_saving:
-                time.sleep(1)
-                continue
-            if time.time() - self.timer > self.periodic_save_timer:
-                self.save()
-                self.timer = time.time()
-            time.sleep(1)
+    @property
+    def _journal_path(self):
+        return "%s.journal" % self._path
+
+    @property
+    def _old_journal_path(self):
+        return "%s.old" % self._journal_path
 
     def load(self):
         """
@@ -85,44 +167,196 @@ class Storage(object):
         :return: Nothing
 
         """
-
-        mkdir_p(self.root)
-        if not os.path.exists(
-                        "%s/%s.%s" % (self.root, self.name, self.file_ext)):
-            # load old json storages if there is no pickled
-            # file (and if storage is using pickle)
+        with self._lock:
+            mkdir_p(self.root)
+            if self.journal:
+                self._finish_compaction()
+            if not os.path.exists(self._path):
+                # load old json storages if there is no pickled
+                # file (and if storage is using pickle)
+                if self.pickle:
+                    self.Data = self._json_load()
+                # save to the selected file mode (json or pkl)
+                self.save(force=True)
             if self.pickle:
+                filenameis = "%s.pkl" % self.name
+                self.Data = pickle_load(self.root, filenameis)
+            else:
                 self.Data = self._json_load()
-            # save to the selected file mode (json or pkl)
-            self.save()
-        if self.pickle:
-            filenameis = "%s.pkl" % self.name
-            self.Data = pickle_load(self.root, filenameis)
-        else:
-            self.Data = self._json_load()
+            self._saved = None
+            self._saved_keys = {}
+            if self.journal and isinstance(self.Data, dict):
+                self._replay_journal()
+                self._saved_keys = self._key_digests()
+            else:
+                self._saved = _digest(self._serialize(self.Data))
 
-    def save(self):
+    def save(self, force=False):
         """
-        Force a save of the Storage to disk.  Saves are also done
-         periodically and when the storage is closed.
+        Save the Storage to disk, if its Data has changed.  Saves are
+        also done periodically and when the storage is closed.
+
+        :force: write the whole file, even if nothing has changed.
 
         :return: Nothing
         """
-        if not os.path.exists(self.root):
-            mkdir_p(self.root)
+        with self._lock:
+            if not os.path.exists(self.root):
+                mkdir_p(self.root)
+            try:
+                if self.journal and not force and \
+                        isinstance(self.Data, dict):
+                    self._save_journal()
+                else:
+                    self._save_file(force)
+            except (TypeError, ValueError):
+                if self.pickle:
+                    raise
+                self.log.exception(
+                    "Error encoutered while saving json data:\n'%s'"
+                    "\nData Dump:\n%s" % (self._path, self.Data))
+
+    def _serialize(self, data):
         if self.pickle:
-            filenameis = "%s.pkl" % self.name
-            pickle_save(self.root, filenameis, self.Data, self.encoding)
+            return Pickle.dumps(data, pickle_protocol(self.encoding))
+        text = json.dumps(data, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        return text
+
+    @staticmethod
+    def _write_temp(path, blob):
+        temp = "%s.tmp" % path
+        with open(temp, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        return temp
+
+    def _write(self, path, blob):
+        _replace(self._write_temp(path, blob), path)
+
+    def _save_file(self, force):
+        blob = self._serialize(self.Data)
+        digest = _digest(blob)
+        if digest == self._saved and not force:
+            return
+        if self.journal:
+            self._compact(blob)
+            if isinstance(self.Data, dict):
+                self._saved_keys = self._key_digests()
         else:
-            self._json_save()
+            self._write(self._path, blob)
+        self._saved = digest
+
+    def _compact(self, blob):
+        """
+        Replace the main file with `blob` (which holds everything) and
+        drop the journal.  The steps are ordered so a crash at any point
+        leaves either the old file and its journal, or a complete new
+        file (see _finish_compaction); never the new file with the old
+        journal, which would replay stale values over it.
+        """
+        temp = self._write_temp(self._path, blob)
+        # from here on, <journal>.old marks <file>.tmp as complete
+        if os.path.exists(self._journal_path):
+            _replace(self._journal_path, self._old_journal_path)
+        _replace(temp, self._path)
+        if os.path.exists(self._old_journal_path):
+            os.remove(self._old_journal_path)
+
+    def _finish_compaction(self):
+        """Complete a compaction interrupted by a crash."""
+        if not os.path.exists(self._old_journal_path):
+            return
+        temp = "%s.tmp" % self._path
+        if os.path.exists(temp):
+            # the compacted file was written, but not yet put in place
+            _replace(temp, self._path)
+        # otherwise the main file already replaced the old journal
+        os.remove(self._old_journal_path)
+        self.log.warning("Finished the interrupted compaction of '%s'",
+                         self._path)
+
+    def _key_digests(self):
+        return dict((key, _digest(self._serialize(value)))
+                    for key, value in list(self.Data.items()))
+
+    def _journal_record(self, key, value, deleted):
+        if self.pickle:
+            return Pickle.dumps((key, deleted, value),
+                                pickle_protocol(self.encoding))
+        text = json.dumps([key, deleted, value], ensure_ascii=False)
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        return text + b"\n"
+
+    def _save_journal(self):
+        digests = self._key_digests()
+        changed = [key for key, digest in digests.items()
+                   if self._saved_keys.get(key) != digest]
+        removed = [key for key in self._saved_keys if key not in digests]
+        if not changed and not removed:
+            return
+        try:
+            journal_size = os.path.getsize(self._journal_path)
+            file_size = os.path.getsize(self._path)
+        except OSError:
+            journal_size, file_size = 0, 0
+        if journal_size > max(file_size, JOURNAL_MIN_COMPACT):
+            self._save_file(force=True)
+            return
+        records = [self._journal_record(key, self.Data.get(key), False)
+                   for key in changed]
+        records.extend(self._journal_record(key, None, True)
+                       for key in removed)
+        with open(self._journal_path, "ab") as f:
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._saved_keys = digests
 
-    def _json_save(self):
-        putcode = putjsonfile(self.Data, self.name, self.root)
-        if not putcode:
-            self.log.exception(
-                "Error encoutered while saving json data:\n'%s/%s.%s'"
-                "\nData Dump:\n%s" % (
-                    self.root, self.name, self.file_ext, self.Data))
+    def _replay_journal(self):
+        if not os.path.exists(self._journal_path):
+            return
+        applied = 0
+        # the end of the last complete record
+        good = 0
+        with open(self._journal_path, "rb") as f:
+            while True:
+                # a record cut short by a crash ends the journal
+                try:
+                    if self.pickle:
+                        key, deleted, value = Pickle.load(f)
+                    else:
+                        line = f.readline()
+                        if not line:
+                            break
+                        if not line.endswith(b"\n"):
+                            raise ValueError("incomplete record")
+                        key, deleted, value = json.loads(
+                            line.decode("utf-8"))
+                except (EOFError, ValueError, TypeError,
+                        Pickle.UnpicklingError):
+                    break
+                if deleted:
+                    self.Data.pop(key, None)
+                else:
+                    self.Data[key] = value
+                applied += 1
+                good = f.tell()
+        self.log.debug("Applied %d journal records to '%s'",
+                       applied, self._path)
+        if good < os.path.getsize(self._journal_path):
+            # cut off the broken record, or later records appended after
+            #  it would never be replayed
+            self.log.warning("Discarding an incomplete record at the end "
+                             "of '%s'", self._journal_path)
+            with open(self._journal_path, "r+b") as f:
+                f.truncate(good)
+                f.flush()
+                os.fsync(f.fileno())
 
     def _json_load(self):
         try_load = getjsonfile(self.name, self.root, encodedas=self.encoding)
@@ -143,4 +377,5 @@ class Storage(object):
         :return: Nothing
         """
         self.abort = True
+        _WRITER.remove(self)
         self.save()
@@ -45,6 +45,7 @@ from core.plugins import Plugins
 from core.commands import Commands
 from core.events import Events
 from core.storage import Storage
+from core.scheduler import SCHEDULER
 from core.irc import IRC
 from core.scripts import Scripts
 import core.buildinfo as buildinfo
@@ -192,7 +193,15 @@ class Wrapper(object):
 
         # core functions and datasets
         self.perms = Permissions(self)
-        self.uuids = UUIDS(self.log, self.usercache)
+        self.uuids = UUIDS(self.log, self.usercache,
+                           self.config["General"].get("mojang-api"),
+                           self.config["General"].get(
+                               "name-lookup-negative-seconds", 300),
+                           self.config["General"].get(
+                               "mojang-requests-per-second", 5),
+                           self.config["General"].get(
+                               "mojang-lookup-workers", 4))
+        self.scheduler = SCHEDULER
         self.plugins = Plugins(self)
         self.commands = Commands(self)
         self.events = Events(self)
@@ -275,6 +284,10 @@ class Wrapper(object):
         self.signals()
         self.backups = Backups(self)
         self._registerwrappershelp()
+        if self.proxymode:
+            # wrapper's commands in tab completions of command names
+            self.api.registerEvent("server.autoCompletes",
+                                   self.commands.tab_complete)
 
         # The MCServerclass is a console wherein the server is started
         self.javaserver = MCServer(self, self.servervitals)
@@ -308,16 +321,13 @@ class Wrapper(object):
         consoledaemon.daemon = True
         consoledaemon.start()
 
-        # Timer runs while not wrapper.halt.halt
-        ts = threading.Thread(target=self.event_timer_second, args=())
-        ts.daemon = True
-        ts.start()
+        # Timers run while not wrapper.halt.halt
+        self.scheduler.call_every(1, self.event_timer_second,
+                                  name="timer.second")
 
         if self.use_timer_tick_event:
-            # Timer runs while not wrapper.halt.halt
-            tt = threading.Thread(target=self.event_timer_tick, args=())
-            tt.daemon = True
-            tt.start()
+            self.scheduler.call_every(0.05, self.event_timer_tick,
+                                      name="timer.tick")
 
         if self.config["General"]["shell-scripts"]:
             if os.name in ("posix", "mac"):
@@ -735,7 +745,7 @@ class Wrapper(object):
         self.api.registerHelp(
             "Wrapper", "Internal Wrapper.py commands ",
             [
-                ("/wrapper [update/memory/halt]",
+                ("/wrapper [update/memory/metrics/halt]",
                  "If no subcommand is provided, it will"
                  " show the Wrapper version.", None),
                 ("/playerstats [all]",
@@ -1040,8 +1050,7 @@ class Wrapper(object):
             return False
 
     def event_timer_second(self):
-        while not self.halt.halt:
-            time.sleep(1)
+        if not self.halt.halt:
             self.events.callevent("timer.second", None, abortable=False)
             """ eventdoc
                 <group> wrapper <group>
@@ -1054,9 +1063,8 @@ class Wrapper(object):
             """
 
     def event_timer_tick(self):
-        while not self.halt.halt:
+        if not self.halt.halt:
             self.events.callevent("timer.tick", None, abortable=False)
-            time.sleep(0.05)
             """ eventdoc
                 <group> wrapper <group>
 
@@ -15,7 +15,7 @@ import requests
 
 # imports that are still dependent upon wrapper:
 from api.helpers import getjsonfile, putjsonfile, find_in_json
-from api.helpers import epoch_to_timestr, read_timestr
+from api.helpers import epoch_to_timestr
 from api.helpers import isipv4address
 from utils.py23 import py_str
 from proxy.utils.constants import *
@@ -43,6 +43,13 @@ except ImportError:
     Client = False
     Packet = False
 
+# the reactor engine needs `selectors` (Python 3.4+)
+from proxy.reactor import ProxyReactor, selectors
+from proxy.packets.compression import PacketCompressor
+from proxy.utils.metrics import ProxyMetrics
+from proxy.utils.capture import PacketCapture
+from proxy.utils.bans import BanIndex, parse_network, in_network
+
 """ The whole point of what follows was originally intended to 
 support making proxy an independent thing that does not need 
 a wrapper or server instance to function.  Not sure it was a 
@@ -81,11 +88,19 @@ class ProxyConfig(object):
     def __init__(self):
         self.proxy = {
             "auto-name-changes": True,
+            "compression-level": 6,
+            "compression-threshold": False,
+            "compression-workers": 2,
             "hidden-ops": [],
             "max-players": 1024,
             "online-mode": True,
+            "packet-capture": False,
+            "passthrough-unparsed": True,
             "proxy-bind": "0.0.0.0",
             "proxy-enabled": True,
+            "proxy-engine": "threaded",
+            "proxy-engine-workers": 8,
+            "proxy-metrics": False,
             "proxy-port": 25570,
             "silent-ipban": True,
         }
@@ -171,9 +186,30 @@ class Proxy(object):
         self.usehub = self.config["built-in-hub"]
         self.onlinemode = self.config["online-mode"]
 
+        # in-memory indexes of the server's ban files
+        self.banned_players = BanIndex(
+            "banned-players", lambda: self.srv_data.serverpath, "uuid")
+        self.banned_ips = BanIndex(
+            "banned-ips", lambda: self.srv_data.serverpath, "ip")
+
         # proxy internal workings
         self.proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.usingSocket = False
+        # set by host() if the "reactor" proxy-engine is used
+        self.reactor = None
+        # packet counters and parse timings ("proxy-metrics")
+        self.metrics = None
+        if self.config["proxy-metrics"]:
+            self.metrics = ProxyMetrics()
+        # received frames recorded for proxy.replay ("packet-capture")
+        self.capture = None
+        if self.config["packet-capture"]:
+            self.capture = PacketCapture(self.config["packet-capture"])
+        # shared by every connection's Packet
+        self.compressor = PacketCompressor(
+            self.config["compression-level"],
+            self.config["compression-threshold"],
+            self.config["compression-workers"])
 
         self.skins = {}
         self.skinTextures = {}
@@ -233,6 +269,15 @@ class Proxy(object):
         # proxy now up and running, bound to server port.
         self.entity_control = EntityControl(self)
 
+        if self.config["proxy-engine"] == "reactor":
+            if selectors:
+                self.reactor = ProxyReactor(
+                    self.log, self.config["proxy-engine-workers"])
+                self.reactor.start()
+            else:
+                self.log.error("The 'reactor' proxy-engine requires Python"
+                               " 3.4 or later.  Using 'threaded'.")
+
         # accept clients and start their threads
         while not (self.abort or self.caller.halt):
             try:
@@ -253,12 +298,20 @@ class Proxy(object):
             # spur off client thread
             # self.server_temp = ServerConnection(self, ip, port)
             client = Client(self, sock, addr, banned=banned_ip)
+            if self.reactor:
+                self.reactor.add_connection(client)
+                continue
             t = threading.Thread(target=client.handle, args=())
             t.daemon = True
             t.start()
 
         # received self.abort or caller.halt signal...
         self.entity_control._abortep = True
+        if self.reactor:
+            self.reactor.stop()
+        self.compressor.shutdown()
+        if self.capture:
+            self.capture.close()
 
     def removestaleclients(self):
         """removes aborted client and player objects"""
@@ -313,7 +366,7 @@ class Proxy(object):
         cwd = "%s/%s" % (
             self.srv_data.serverpath, self.srv_data.worldname)
         self.uuids.convert_files(old_local_uuid, new_local_uuid, cwd)
-        self.usercache[realuuid]["localname"] = newname
+        self.uuids.setlocalname(realuuid, newname)
         self.usercache_obj.save()
         return newname, new_local_uuid
 
@@ -355,9 +408,8 @@ class Proxy(object):
         :param uuid: uuid of player as string
         :return: string representing ban reason
         """
-        banlist = getjsonfile("banned-players", self.srv_data.serverpath)
-        if banlist:
-            banrecord = find_in_json(banlist, "uuid", uuid)
+        banrecord = self.banned_players.lookup(str(uuid))
+        if banrecord:
             return "%s by %s" % (banrecord["reason"], banrecord["source"])
         return "Banned by server"
 
@@ -400,6 +452,7 @@ class Proxy(object):
                 if putjsonfile(banlist,
                                "banned-players",
                                self.srv_data.serverpath):
+                    self.banned_players.invalidate()
                     # this actually is not needed. Commands now handle the kick.
                     console_command = "kick %s %s" % (name, reason)
                     self.eventhandler.callevent(
@@ -456,6 +509,7 @@ class Proxy(object):
                 if putjsonfile(banlist,
                                "banned-players",
                                self.srv_data.serverpath):
+                    self.banned_players.invalidate()
                     self.log.info("kicking %s... %s", username, reason)
 
                     console_command = "kick %s Banned: %s" % (username, reason)
@@ -476,7 +530,8 @@ class Proxy(object):
               source="Wrapper", expires=False):
         """
         Ban an IP address (IPV-4)
-        :param ipaddress - ip address to ban
+        :param ipaddress - ip address to ban.  May also be a network
+         ("10.1.0.0/16") or a prefix ending in a dot ("10.1.").
         :param reason - text reason for ban
         :param source - source (author/op) of ban.
         :param expires - expiration in seconds from epoch time.  Field exists
@@ -486,7 +541,8 @@ class Proxy(object):
 
         This probably only works on 1.7.10 servers or later
         """
-        if not isipv4address(ipaddress):
+        network = parse_network(ipaddress)
+        if not (isipv4address(ipaddress) or network):
             return "Invalid IPV4 address: %s" % ipaddress
         banlist = getjsonfile("banned-ips", self.srv_data.serverpath)
         if banlist is not False:  # file and directory exist.
@@ -509,9 +565,11 @@ class Proxy(object):
                                 "expires": expiration,
                                 "reason": reason})
                 if putjsonfile(banlist, "banned-ips", self.srv_data.serverpath):
+                    self.banned_ips.invalidate()
                     banned = ""
                     for client in self.srv_data.clients:
-                        if client.ip == str(ipaddress):
+                        if client.ip == str(ipaddress) or (
+                                network and in_network(client.ip, network)):
 
                             console_command = "kick %s Your IP is Banned!" % client.username  # noqa
                             self.eventhandler.callevent(
@@ -530,7 +588,7 @@ class Proxy(object):
             return "Banlist not found on disk"
 
     def pardonip(self, ipaddress):
-        if not isipv4address(ipaddress):
+        if not (isipv4address(ipaddress) or parse_network(ipaddress)):
             return "Invalid IPV4 address: %s" % ipaddress
         banlist = getjsonfile("banned-ips", self.srv_data.serverpath)
         if banlist is not False:  # file and directory exist.
@@ -542,6 +600,7 @@ class Proxy(object):
                     if x == banrecord:
                         banlist.remove(x)
                 if putjsonfile(banlist, "banned-ips", self.srv_data.serverpath):
+                    self.banned_ips.invalidate()
                     return "pardoned %s" % ipaddress
                 return "Could not write banlist to disk"
             else:
@@ -563,6 +622,7 @@ class Proxy(object):
                 if putjsonfile(banlist,
                                "banned-players",
                                self.srv_data.serverpath):
+                    self.banned_players.invalidate()
                     name = self.uuids.getusernamebyuuid(str(uuid))
                     return "pardoned %s" % name
                 return "Could not write banlist to disk"
@@ -584,6 +644,7 @@ class Proxy(object):
                 if putjsonfile(banlist,
                                "banned-players",
                                self.srv_data.serverpath):
+                    self.banned_players.invalidate()
                     return "pardoned %s" % username
                 return "Could not write banlist to disk"
             else:
@@ -591,46 +652,41 @@ class Proxy(object):
         else:
             return "Banlist not found on disk"  # error text
 
+    def pardonexpired(self):
+        """
+        Pardon every ban whose expiry time has passed.  Cheap when none
+        have (it only looks at the top of each index's expiry heap).
+        """
+        now = int(time.time())
+        for uuid in self.banned_players.expired(now):
+            pardoning = self.pardonuuid(uuid)
+            if pardoning[:8] == "pardoned":
+                self.log.info("UUID: %s was pardoned (expired ban)", uuid)
+            else:
+                self.log.warning("Attempted a pardon of uuid: %s (expired "
+                                 "ban), but it failed:\n %s", uuid, pardoning)
+        for ipaddress in self.banned_ips.expired(now):
+            pardoning = self.pardonip(ipaddress)
+            if pardoning[:8] == "pardoned":
+                self.log.info("IP: %s was pardoned (expired ban)", ipaddress)
+            else:
+                self.log.warning("Attempted a pardon of IP: %s (expired "
+                                 "ban), but it failed:\n %s",
+                                 ipaddress, pardoning)
+
     def isuuidbanned(self, uuid):  # Check if the UUID of the user is banned
-        banlist = getjsonfile("banned-players", self.srv_data.serverpath)
-        if banlist:  # make sure banlist exists
-            banrecord = find_in_json(banlist, "uuid", str(uuid))
-            if banrecord:
-                # if ban has expired
-                if read_timestr(banrecord["expires"]) < int(time.time()):
-                    pardoning = self.pardonuuid(str(uuid))
-                    if pardoning[:8] == "pardoned":
-                        self.log.info("UUID: %s was pardoned "
-                                      "(expired ban)", str(uuid))
-                        return False  # player is "NOT" banned (anymore)
-                    else:
-                        self.log.warning("isuuidbanned attempted a pardon of"
-                                         " uuid: %s (expired ban), "
-                                         "but it failed:\n %s",
-                                         uuid, pardoning)
-                return True  # player is still banned
-        return False  # banlist empty or record not found
+        self.pardonexpired()
+        return self.banned_players.lookup(str(uuid)) is not None
 
     def isipbanned(self, ipaddress):  # Check if the IP address is banned
-        banlist = getjsonfile("banned-ips", self.srv_data.serverpath)
-        if banlist:  # make sure banlist exists
-            for record in banlist:
-                _ip = record["ip"]
-                if _ip in ipaddress:
-                    _expires = read_timestr(record["expires"])
-                    if _expires < int(time.time()):  # if ban has expired
-                        pardoning = self.pardonip(ipaddress)
-                        if pardoning[:8] == "pardoned":
-                            self.log.info("IP: %s was pardoned "
-                                          "(expired ban)", ipaddress)
-                            return False  # IP is "NOT" banned (anymore)
-                        else:
-                            self.log.warning("isipbanned attempted a pardon "
-                                             "of IP: %s (expired ban),  but"
-                                             " it failed:\n %s",
-                                             ipaddress, pardoning)
-                    return True  # IP is still banned
-        return False  # banlist empty or record not found
+        """
+        :param ipaddress: an address string, or an (address, port) tuple
+         as returned by socket.accept().
+        """
+        if isinstance(ipaddress, tuple):
+            ipaddress = ipaddress[0]
+        self.pardonexpired()
+        return self.banned_ips.lookup(ipaddress) is not None
 
     def getskintexture(self, uuid):
         import pprint
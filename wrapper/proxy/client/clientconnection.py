@@ -24,6 +24,7 @@ from proxy.packets import mcpackets_sb
 from proxy.packets import mcpackets_cb
 from proxy.utils.constants import *
 
+from proxy.utils.capture import SERVERBOUND
 from proxy.utils.mcuuid import MCUUID
 from api.helpers import processcolorcodes, getjsonfile, putjsonfile
 
@@ -67,6 +68,20 @@ class Client(object):
         self.abort = False
         self.username = "PING REQUEST"
         self.packet = Packet(self.client_socket, self)
+        self.packet.compressor = self.proxy.compressor
+        self.metrics = None
+        if self.proxy.metrics:
+            self.metrics = self.proxy.metrics.connection(
+                self, "client", lambda: self.username)
+            self.packet.metrics = self.metrics
+        if self.proxy.config["passthrough-unparsed"]:
+            self.packet.parsed_ids = lambda: self.parsers[self.state]
+        self.capture_session = None
+        if self.proxy.capture:
+            self.capture_session = self.proxy.capture.new_session()
+            self.packet.capture = self.proxy.capture.recorder(
+                self.capture_session, SERVERBOUND, self.packet,
+                lambda: (self.state, self.clientversion))
         self.verifyToken = encryption.generate_challenge_token()
         self.serverID = encryption.generate_server_id().encode('utf-8')
         self.MOTD = {}
@@ -172,6 +187,8 @@ class Client(object):
         self.riding = None
         # last placement (for use in cases of bucket use)
         self.lastplacecoords = (0, 0, 0)
+        # text of the last tab completion request
+        self.tab_text = ""
 
         # misc client attributes
         self.properties = {}
@@ -247,39 +264,56 @@ class Client(object):
                 self.abort = True
                 break
 
-            # Each condition is executed and evaluated in sequence:
-            if self._parse(pkid) and \
-                    self.server_connection and \
-                    self.server_connection.packet and \
-                    self.server_connection.state == PLAY:
+            self.process_packet(pkid, orig_packet)
 
-                # wrapper handles LOGIN/HANDSHAKE with servers (via
-                # self._parse(pkid), which DOES happen in all modes
-                # as part of the `if` statement evaluation).
+        # upon self.abort
+        self._close_server_instance("Client Handle Ended")
+
+    def process_packet(self, pkid, orig_packet):
+        """
+        Parse a packet received from the client and pass it on to the
+        server if the parser allows it.
+        """
+        # Each condition is executed and evaluated in sequence:
+        if self._parse(pkid) and \
+                self.server_connection and \
+                self.server_connection.packet and \
+                self.server_connection.state == PLAY:
 
-                # sending on to the server only happens in PLAY.
-                self.server_connection.packet.send_raw_untouched(orig_packet)
+            # wrapper handles LOGIN/HANDSHAKE with servers (via
+            # self._parse(pkid), which DOES happen in all modes
+            # as part of the `if` statement evaluation).
 
-        # upon self.abort
+            # sending on to the server only happens in PLAY.
+            self.server_connection.packet.send_raw_untouched(orig_packet)
+
+    def connection_lost(self, reason):
+        """
+        Called by the reactor engine when the client socket closes.  This
+        is what the end of handle() and _flush_loop() do when threaded.
+        """
+        self.abort = True
+        if self.username != "PING REQUEST":
+            self.log.debug("%s client connection closed (%s)",
+                           self.username, reason)
         self._close_server_instance("Client Handle Ended")
+        self.proxy.removestaleclients()  # from proxy.srv_data.clients
 
     def _flush_loop(self):
         """
-        packets accumulate in the packet.queue.  They are periodically 
-        sent to the client in intervals.  The '.05' interval, which is also
-        a minecraft tick, seems ideal.  Any shorter and packets seem to 
-        get lost (Dropped items are invisible, etc).  Any longer makes the 
-        game kind of jerky. '.1' would be tolerable unless in a combat
-        situation.
+        packets accumulate in the packet.queue.  This thread sleeps until
+        something is queued and then sends the whole queue to the client
+        in a single `sendall` (so a burst of packets is coalesced).  The
+        wait timeout only bounds how long it takes to notice `self.abort`.
         """
         while not self.abort:
             try:
-                self.packet.flush()
+                if self.packet.wait_for_queue(0.5):
+                    self.packet.flush()
             except socket_error:
                 self.log.debug("%s client socket closed (socket_error).",
                                self.username)
                 break
-            time.sleep(0.05)
         if self.username != "PING REQUEST":
             self.log.debug("%s clientconnection _flush_loop thread ended",
                            self.username)
@@ -291,6 +325,9 @@ class Client(object):
         """
         if pkid in self.parsers[self.state]:
             # parser can return false
+            if self.metrics is not None:
+                return self.metrics.timed_parse(
+                    pkid, self.parsers[self.state][pkid])
             return self.parsers[self.state][pkid]()
         return True
 
@@ -348,6 +385,8 @@ class Client(object):
                     self.parse_sb.play_player_update_sign,
                 self.pktSB.SPECTATE[PKT]:
                     self.parse_sb.play_spectate,
+                self.pktSB.TAB_COMPLETE[PKT]:
+                    self.parse_sb.play_tab_complete,
                 self.pktSB.USE_ITEM[PKT]:
                     self.parse_sb.play_use_item,
                 self.pktSB.PLUGIN_MESSAGE[PKT]:
@@ -751,11 +790,14 @@ class Client(object):
 
         # start keep alives
         self.time_client_responded = time.time()
-        t_keepalives = threading.Thread(
-            target=self._keep_alive_tracker,
-            args=())
-        t_keepalives.daemon = True
-        t_keepalives.start()
+        if self.proxy.reactor:
+            self.proxy.reactor.call_every(1, self._keep_alive_tick)
+        else:
+            t_keepalives = threading.Thread(
+                target=self._keep_alive_tracker,
+                args=())
+            t_keepalives.daemon = True
+            t_keepalives.start()
         return True
 
     def _connect_to_server(self, ip=None, port=None):
@@ -785,9 +827,13 @@ class Client(object):
             return False, mess
 
         # start server handle() to read the packets
-        t = threading.Thread(target=self.server_connection.handle, args=())
-        t.daemon = True
-        t.start()
+        if self.proxy.reactor:
+            self.proxy.reactor.add_connection(self.server_connection)
+        else:
+            t = threading.Thread(target=self.server_connection.handle,
+                                 args=())
+            t.daemon = True
+            t.start()
 
         # switch server_connection to LOGIN to log in to (offline) server.
         # already done at server.connect()
@@ -1288,44 +1334,58 @@ class Client(object):
         """
         Send keep alives to client.
         """
-        while not self.abort:
+        while True:
             time.sleep(1)
-            if self.state in (PLAY, LOBBY):
-                # client expects < 20sec
-                # sending more frequently (5 seconds) seems to help with
-                # some slower connections.
-                if time.time() - self.time_last_ping_to_client > 9:
-                    # vanilla MC 1.12 .2 uses a time() value.
-                    # I use simple incrementing numbers vs randoms... I mean,
-                    # what is the point of a random keepalive?
-                    if self.version < PROTOCOL_1_12_2:
-                        # sending a keepalive every second for more than 68
-                        # years would be required to exceed the VARINT capacity
-                        self.keepalive_val += 1
-                    else:
-                        # running forever would not allow keepalive to exceed
-                        # LONG contraints
-                        self.keepalive_val += 1
-
-                    # challenge the client with it
-                    self.packet.sendpkt(
-                        self.pktCB.KEEP_ALIVE[PKT],
-                        self.pktCB.KEEP_ALIVE[PARSER],
-                        [self.keepalive_val])
-
-                    self.time_last_ping_to_client = time.time()
-
-                # check for active client keep alive status:
-                # server can allow up to 30 seconds for response
-                if time.time() - self.time_client_responded > 30:
-                    self.disconnect("Client closed due to lack of"
-                                    " keepalive response")
-                    self.log.debug("Closed %s's client thread due to "
-                                   "lack of keepalive response", self.username)
-                    return
-        self.log.debug("%s Client keepalive tracker aborted", self.username)
-        self.disconnect("Client disconnected.")
-        self.state = HANDSHAKE
+            if not self._keep_alive_tick():
+                return
+
+    def _keep_alive_tick(self):
+        """
+        One (1 second) pass of the keep alive tracker.  Run by the
+        reactor engine's timers or by _keep_alive_tracker().
+
+        :returns: False once keep alives should stop.
+        """
+        if self.abort:
+            self.log.debug("%s Client keepalive tracker aborted",
+                           self.username)
+            self.disconnect("Client disconnected.")
+            self.state = HANDSHAKE
+            return False
+        if self.state in (PLAY, LOBBY):
+            # client expects < 20sec
+            # sending more frequently (5 seconds) seems to help with
+            # some slower connections.
+            if time.time() - self.time_last_ping_to_client > 9:
+                # vanilla MC 1.12 .2 uses a time() value.
+                # I use simple incrementing numbers vs randoms... I mean,
+                # what is the point of a random keepalive?
+                if self.version < PROTOCOL_1_12_2:
+                    # sending a keepalive every second for more than 68
+                    # years would be required to exceed the VARINT capacity
+                    self.keepalive_val += 1
+                else:
+                    # running forever would not allow keepalive to exceed
+                    # LONG contraints
+                    self.keepalive_val += 1
+
+                # challenge the client with it
+                self.packet.sendpkt(
+                    self.pktCB.KEEP_ALIVE[PKT],
+                    self.pktCB.KEEP_ALIVE[PARSER],
+                    [self.keepalive_val])
+
+                self.time_last_ping_to_client = time.time()
+
+            # check for active client keep alive status:
+            # server can allow up to 30 seconds for response
+            if time.time() - self.time_client_responded > 30:
+                self.disconnect("Client closed due to lack of"
+                                " keepalive response")
+                self.log.debug("Closed %s's client thread due to "
+                               "lack of keepalive response", self.username)
+                return False
+        return True
 
     def _remove_client_and_player(self):
         """
@@ -779,6 +779,12 @@ class ParseSB(object):
                 return True
         return True
 
+    def play_tab_complete(self):
+        """Remember what is being completed, for the server's answer
+        (see ParseCB.play_tab_complete)."""
+        self.client.tab_text = self.packet.readpkt([STRING, NULL])[0]
+        return True
+
     def play_spectate(self):
         if not self.client.local:
             return True
@@ -124,6 +124,9 @@ class Entity(object):
         self.entityname = entityname
         self.active = currtime()
         self.clientname = playerclientname
+        # the EntityControl indexing this entity, and its key there
+        self.tracker = None
+        self.chunk = None
 
     def __str__(self):
         return self.entitytype
@@ -144,12 +147,16 @@ class Entity(object):
         self.position = (oldposition[0], oldposition[1], oldposition[2])
         if self.rodeBy:
             self.rodeBy.position = self.position
+        if self.tracker:
+            self.tracker.moved(self)
 
     def teleport(self, position):
         """ Track entity teleports to a specific location. """
         self.position = (position[0] / 32, position[1] / 32, position[2] / 32)  # Fixed point numbers...
         if self.rodeBy:
             self.rodeBy.position = self.position
+        if self.tracker:
+            self.tracker.moved(self)
 
     def about_entity(self):
         info = {
@@ -32,10 +32,20 @@ class EntityControl(object):
     Entity controls are established by Proxy.base and INCLUDE
     mount/unmount functions!
 
+    Tracked entities are indexed by the player (client) they were
+    sent to and by chunk, and counted by player and by type, so
+    that counts and radius queries do not scan every entity.
+
     """
 
     def __init__(self, proxy):
+        self._lock = threading.RLock()
+        # (clientname, chunk x, chunk z): {eid: entity}
         self.chunks = {}
+        # clientname: {eid: entity}
+        self._players = {}
+        # clientname: {entity name: count}
+        self._counts = {}
 
         self.proxy = proxy
         self.ent_config = self.proxy.ent_config
@@ -87,6 +97,85 @@ class EntityControl(object):
     def __del__(self):
         self._abortep = True
 
+    @staticmethod
+    def _chunk_of(clientname, position):
+        return clientname, int(position[0] // 16), int(position[2] // 16)
+
+    def add_entity(self, entity):
+        """
+        Start tracking a newly spawned entity (replacing any entity
+        tracked with the same eid).
+
+        """
+        with self._lock:
+            self.remove_entity(entity.eid)
+            key = self._chunk_of(entity.clientname, entity.position)
+            entity.chunk = key
+            entity.tracker = self
+            self.chunks.setdefault(key, {})[entity.eid] = entity
+            self._players.setdefault(
+                entity.clientname, {})[entity.eid] = entity
+            counts = self._counts.setdefault(entity.clientname, {})
+            counts[entity.entityname] = counts.get(entity.entityname, 0) + 1
+            self.entities[entity.eid] = entity
+
+    def remove_entity(self, eid):
+        """
+        Stop tracking the entity `eid` (a destroyed entity).
+
+        """
+        with self._lock:
+            entity = self.entities.pop(eid, None)
+            if entity is None:
+                return
+            entity.tracker = None
+            chunk = self.chunks.get(entity.chunk)
+            if chunk is not None:
+                chunk.pop(eid, None)
+                if not chunk:
+                    del self.chunks[entity.chunk]
+            players = self._players.get(entity.clientname)
+            if players is not None:
+                players.pop(eid, None)
+                if not players:
+                    del self._players[entity.clientname]
+            counts = self._counts.get(entity.clientname)
+            if counts is not None:
+                counts[entity.entityname] -= 1
+                if counts[entity.entityname] < 1:
+                    del counts[entity.entityname]
+                if not counts:
+                    del self._counts[entity.clientname]
+
+    def remove_player(self, playername):
+        """
+        Stop tracking all the entities of a player (client) that left.
+
+        """
+        with self._lock:
+            for eid in list(self._players.get(playername, ())):
+                self.remove_entity(eid)
+
+    def moved(self, entity):
+        """
+        Re-index `entity` if its position moved it to another chunk.
+        Called by the entity itself.
+
+        """
+        key = self._chunk_of(entity.clientname, entity.position)
+        if key == entity.chunk:
+            return
+        with self._lock:
+            if self.entities.get(entity.eid) is not entity:
+                return
+            chunk = self.chunks.get(entity.chunk)
+            if chunk is not None:
+                chunk.pop(entity.eid, None)
+                if not chunk:
+                    del self.chunks[entity.chunk]
+            entity.chunk = key
+            self.chunks.setdefault(key, {})[entity.eid] = entity
+
     # noinspection PyBroadException
     def getEntityByEID(self, eid):
         """
@@ -133,14 +222,57 @@ class EntityControl(object):
             @:type Dict
 
         """
-        ents = []
-        entities = self.entities
-        for v in iter(entities.values()):
-            if v.clientname == playername:
-                about = v.about_entity
-                if about:
-                    ents.append(about())
-        return ents
+        with self._lock:
+            entities = list(self._players.get(playername, {}).values())
+        return [entity.about_entity() for entity in entities]
+
+    def countEntityTypesInPlayer(self, playername):
+        """
+        returns a dictionary of entity name: count of the entities
+        in the player's world.
+
+            :sample:
+                .. code:: python
+
+                    {"Cow": 12, "Creeper": 2}
+
+                ..
+
+        """
+        with self._lock:
+            return dict(self._counts.get(playername, {}))
+
+    def getEntitiesNear(self, playername, position, radius, name=None):
+        """
+        Returns a list of the entities in the player's world within
+        `radius` blocks of `position` (x, y, z).
+
+        :Args:
+            :playername: the player (client) whose entities to search.
+            :position: the (x, y, z) center.
+            :radius: the distance, in blocks.
+            :name: if given, only entities of this name ("Cow").
+
+        """
+        x, y, z = position[0], position[1], position[2]
+        _, cx, cz = self._chunk_of(playername, position)
+        span = int(radius // 16) + 1
+        limit = radius * radius
+        found = []
+        with self._lock:
+            for chunkx in range(cx - span, cx + span + 1):
+                for chunkz in range(cz - span, cz + span + 1):
+                    chunk = self.chunks.get((playername, chunkx, chunkz))
+                    if not chunk:
+                        continue
+                    for entity in chunk.values():
+                        if name is not None and entity.entityname != name:
+                            continue
+                        pos = entity.position
+                        if (pos[0] - x) ** 2 + (pos[1] - y) ** 2 + \
+                                (pos[2] - z) ** 2 <= limit:
+                            found.append(entity)
+        return found
 
     def getEntityInfo(self, eid):
         """
@@ -239,18 +371,14 @@ class EntityControl(object):
                 continue
             timer = float(0)
 
-            # start looking for stale client entities
-            playerlist = []
-            for player in self.srvr_data.clients:
-                playerlist.append(player.username)
-            entity_eids = list(self.entities.keys())
-            for eid in entity_eids:
-                if self.getEntityByEID(eid).clientname not in playerlist:
-                    # noinspection PyBroadException
-                    try:
-                        self.entities.pop(eid, None)
-                    except:
-                        pass
+            # drop the entities of clients that have left
+            playerlist = set(
+                player.username for player in self.srvr_data.clients)
+            with self._lock:
+                gone = [name for name in self._players
+                        if name not in playerlist]
+            for name in gone:
+                self.remove_player(name)
         self._log.debug("_entityprocessor thread closed.")
 
     # each entity IS a dictionary, so...
@@ -279,19 +407,12 @@ class EntityControl(object):
             # loop through playerlist
             for playerclient in playerlist:
                 players_position = playerclient.position
-                his_entities = self.countEntitiesInPlayer(playerclient.username)
-                if len(his_entities) < self.startThinningThreshshold:
+                # like {"Cow": 1}
+                counts = self.countEntityTypesInPlayer(playerclient.username)
+                if sum(counts.values()) < self.startThinningThreshshold:
                     # don't worry with this player, his load is light.
                     continue
 
-                # now we need to count each entity type
-                counts = {}
-                for entity in his_entities:
-                    if entity["name"] in counts:
-                        counts[entity["name"]] += 1
-                    else:
-                        counts[entity["name"]] = 1  # like {"Cow": 1}
-
                 for mob_type in counts:
                     if "thin-%s" % mob_type in self.ent_config:
                         maxofthiskind = self.ent_config["thin-%s" % mob_type]
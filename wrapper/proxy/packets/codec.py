@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Compiled packet codecs for Packet.readpkt() and Packet.sendpkt().
+
+A parser list such as `[VARINT, DOUBLE, DOUBLE, DOUBLE, BYTE, BYTE, BOOL]`
+is compiled once into a list of steps.  Each run of fixed size fields
+becomes a single struct.Struct, so the three doubles and the bytes above
+are read with one unpack call.  Variable length fields (varints, strings,
+slots, metadata...) call the Packet's own read_/send_ method.
+
+Compiled codecs are cached by their type list, so every parser list of a
+protocol version compiles once.  mcpackets_cb/mcpackets_sb precompile
+their PARSER lists when a Packets set is created.
+"""
+
+import struct
+
+from proxy.utils.constants import *
+
+# fixed size types: struct format code
+_FORMATS = {
+    UBYTE: "B",
+    BYTE: "b",
+    INT: "i",
+    SHORT: "h",
+    USHORT: "H",
+    LONG: "q",
+    DOUBLE: "d",
+    FLOAT: "f",
+    BOOL: "b",
+    POSITION: "Q",
+}
+
+_READERS = {}
+_SENDERS = {}
+
+
+def _read_bool(value):
+    return value == 1
+
+
+def _read_position(position):
+    if position == 0xFFFFFFFFFFFFFFFF:
+        return None
+    x = int(position >> 38)
+    if x & 0x2000000:
+        x = (x & 0x1FFFFFF) - 0x2000000
+    y = int((position >> 26) & 0xFFF)
+    if y & 0x800:
+        y = (y & 0x4FF) - 0x800
+    z = int(position & 0x3FFFFFF)
+    if z & 0x2000000:
+        z = (z & 0x1FFFFFF) - 0x2000000
+    return x, y, z
+
+
+def _send_bool(value):
+    if value:
+        return 1
+    return 0
+
+
+def _send_position(position):
+    x, y, z = position
+    return (((x & 0x3FFFFFF) << 38)
+            | ((y & 0xFFF) << 26)
+            | (z & 0x3FFFFFF))
+
+
+_READ_CONVERT = {BOOL: _read_bool, POSITION: _read_position}
+_SEND_CONVERT = {BOOL: _send_bool, POSITION: _send_position}
+
+
+def _compile(args, convert):
+    """
+    Split `args` into steps.  A step is either a (Struct, count,
+    converters) tuple for a run of `count` fixed size fields, or the
+    integer type of a variable length field.  `converters` holds (index, function) pairs
+    for values that need converting (bools, positions).
+    """
+    steps = []
+    run = []
+
+    def _close_run():
+        if run:
+            converters = tuple((i, convert[arg]) for i, arg in enumerate(run)
+                               if arg in convert)
+            steps.append((struct.Struct(
+                ">" + "".join(_FORMATS[arg] for arg in run)), len(run),
+                converters))
+            del run[:]
+
+    for arg in args:
+        if arg in _FORMATS:
+            run.append(arg)
+        else:
+            _close_run()
+            steps.append(arg)
+    _close_run()
+    return tuple(steps)
+
+
+def reader(args):
+    """
+    :returns: the compiled read steps for the type list `args`.
+    """
+    key = tuple(args)
+    try:
+        return _READERS[key]
+    except KeyError:
+        steps = _compile(key, _READ_CONVERT)
+        _READERS[key] = steps
+        return steps
+
+
+def sender(args):
+    """
+    :returns: the compiled send steps for the type list `args`.
+    """
+    key = tuple(args)
+    try:
+        return _SENDERS[key]
+    except KeyError:
+        steps = _compile(key, _SEND_CONVERT)
+        _SENDERS[key] = steps
+        return steps
+
+
+def precompile(packets):
+    """
+    Compile the PARSER list of every packet definition in a
+    mcpackets_cb/mcpackets_sb `Packets` instance.
+    """
+    for definition in packets.__dict__.values():
+        if isinstance(definition, list) and len(definition) > PARSER:
+            parser = definition[PARSER]
+            if isinstance(parser, list):
+                reader(parser)
+                sender(parser)
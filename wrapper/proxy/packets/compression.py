@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Outbound packet compression shared by all proxy connections.
+
+Small packets are compressed inline by the thread that flushes them.
+Large ones (chunk data re-sent by `change_servers`, plugin built window
+packets) are handed to a small thread pool; zlib releases the GIL while
+it works, so a burst of chunks compresses in parallel instead of stalling
+the flush thread one chunk at a time.
+"""
+
+import zlib
+
+try:
+    from concurrent import futures
+except ImportError:
+    # Py2 - everything is compressed inline
+    futures = False
+
+# payloads at least this big are compressed on the pool
+OFFLOAD_SIZE = 16384
+
+
+class PacketCompressor(object):
+    """
+    :level: zlib compression level (0-9, or -1 for zlib's default).
+    :threshold: False, or the minimum payload size to compress.  It can
+     only raise the threshold negotiated with the peer (which must still
+     get compressed packets no smaller than that).
+    :workers: compression pool threads; 0 compresses everything inline.
+    """
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, threshold=False,
+                 workers=2):
+        self.level = level
+        self.threshold = threshold
+        self.executor = None
+        if workers > 0 and futures:
+            self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def compresses(self, negotiated, payload):
+        """
+        :negotiated: the connection's compression threshold.
+
+        :returns: True if `payload` should be sent compressed.
+        """
+        if self.threshold is not False and len(payload) < self.threshold:
+            return False
+        return len(payload) > negotiated
+
+    def compress(self, payload):
+        return zlib.compress(payload, self.level)
+
+    def submit(self, payload):
+        """
+        Start compressing a large `payload` on the pool.
+
+        :returns: a future whose result() is the compressed payload, or
+         None if the payload is small (or there is no pool) and should
+         be compressed inline.
+        """
+        if self.executor is None or len(payload) < OFFLOAD_SIZE:
+            return None
+        return self.executor.submit(zlib.compress, payload, self.level)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
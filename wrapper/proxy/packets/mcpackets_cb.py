@@ -7,6 +7,7 @@
 
 from __future__ import print_function
 from proxy.utils.constants import *
+from proxy.packets import codec
 
 """
 Ways to reference packets by names and not hard-coded numbers.
@@ -379,3 +380,6 @@ class Packets(object):
             # -Open sign editor
             # -Ping values has new info
             # -Display scoreboard has new info for team play
+
+        # compile this version's parser lists for Packet.readpkt/sendpkt
+        codec.precompile(self)
@@ -7,6 +7,7 @@
 
 from __future__ import print_function
 from proxy.utils.constants import *
+from proxy.packets import codec
 
 """
 Ways to reference packets by names and not hard-coded numbers.
@@ -188,3 +189,6 @@ class Packets(object):
             self.VEHICLE_MOVE[PKT] = 0x10
             self.STEER_BOAT[PKT] = 0x11
             self.CRAFT_RECIPE_REQUEST[PKT] = 0x12
+
+        # compile this version's parser lists for Packet.readpkt/sendpkt
+        codec.precompile(self)
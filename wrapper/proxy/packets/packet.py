@@ -12,11 +12,15 @@
 import io  # PY3
 import json
 import struct
+import threading
 import zlib
 import sys
 # import StringIO
 
 # local
+from proxy.packets import codec
+from proxy.packets.compression import PacketCompressor
+from proxy.packets import varint
 from proxy.utils.mcuuid import MCUUID
 
 # Py3-2
@@ -28,11 +32,17 @@ if PY3:
 
 # endregion
 
+# used by packets whose connection does not supply the proxy's compressor
+_INLINE_COMPRESSOR = PacketCompressor(workers=0)
+
 # region Constants
 # ------------------------------------------------
 
 PY3 = sys.version_info > (3,)
 
+# socket reads are done in blocks of this size
+_RECV_BLOCK = 65536
+
 _CODERS = {
     "string": 0,
     "json": 1,
@@ -61,6 +71,34 @@ _CODERS = {
 # endregion
 
 
+class PendingFrame(object):
+    """A frame whose payload is still compressing on the pool."""
+    __slots__ = ("packet", "payload", "job", "watched")
+
+    def __init__(self, packet, payload, job):
+        self.packet = packet
+        self.payload = payload
+        self.job = job
+        # set by whoever added a done callback
+        self.watched = False
+
+    def done(self):
+        return self.job.done()
+
+    def add_done_callback(self, callback):
+        """Call `callback()` (on the pool thread) once it is done."""
+        self.job.add_done_callback(lambda job: callback())
+
+    def result(self):
+        """:returns: the frame (waiting for the compression if needed)."""
+        frame = self.packet._compressed_frame(self.payload,
+                                              self.job.result())
+        metrics = self.packet.metrics
+        if metrics is not None:
+            metrics.flushed(0, 0, len(frame), len(self.payload), len(frame))
+        return frame
+
+
 # noinspection PyMethodMayBeStatic,PyBroadException,PyAugmentAssignment
 class Packet(object):
     def __init__(self, sock, obj):
@@ -80,6 +118,39 @@ class Packet(object):
         # self.buffer = StringIO.StringIO()
 
         self.queue = []
+        # `queue_ready` is notified each time something is queued so the
+        #  connection's flush thread can transmit right away.  `_sendlock`
+        #  serializes flushes so that queue order is also wire order.
+        self.queue_ready = threading.Condition()
+        self._sendlock = threading.Lock()
+        # optional callback run when something is queued (reactor engine)
+        self.on_queue = None
+
+        # Receive side.  Decrypted stream data is buffered in _rbuf and
+        #  frames are sliced out of it starting at _rpos.  The socket is
+        #  read in large blocks into _rblock (a reusable buffer) rather
+        #  than a few bytes at a time.
+        self._rbuf = bytearray()
+        self._rpos = 0
+        self._rblock = bytearray(_RECV_BLOCK)
+        self._rview = memoryview(self._rblock)
+        self._dblock = bytearray(_RECV_BLOCK + 16)
+        self._dview = memoryview(self._dblock)
+        # the recvCipher that was in effect when _rbuf was filled
+        self._rcipher = None
+        # Optional callable, set by the connection, returning the packet
+        #  ids it parses in its current state.  Compressed packets with
+        #  any other id are forwarded as-is, so they are not inflated.
+        self.parsed_ids = None
+        # feed()/grabbuffered() data (reactor engine)
+        self._inbox = []
+        self._feedlock = threading.Lock()
+        # compression level/threshold and the pool for large payloads
+        self.compressor = _INLINE_COMPRESSOR
+        # the connection's proxy.utils.metrics.ConnectionMetrics, if enabled
+        self.metrics = None
+        # callable recording each received frame ("packet-capture")
+        self.capture = None
 
         # encode/decode for NBT operations
         self._ENCODERS = {
@@ -122,7 +193,7 @@ class Packet(object):
             8: self.send_double,
             9: self.send_float,
             10: self.send_bool,
-            11: self.send_varint,
+            11: varint.pack,
             12: self.send_bytearray,
             13: self.send_bytearray_short,
             14: self.send_position,
@@ -162,6 +233,9 @@ class Packet(object):
 
     def close(self):
         self.abort = True
+        # wake any flush thread waiting on the queue
+        with self.queue_ready:
+            self.queue_ready.notify_all()
 
     def hexdigest(self, sh):
         d = int(sh.hexdigest(), 16)
@@ -176,16 +250,7 @@ class Packet(object):
             return payload
 
     def pack_varint(self, val):
-        total = b''
-        if val < 0:
-            val = (1 << 32) + val
-        while val >= 0x80:
-            bits = val & 0x7F
-            val >>= 7
-            total += struct.pack('B', (0x80 | bits))
-        bits = val & 0x7F
-        total += struct.pack('B', bits)
-        return total
+        return varint.pack(val)
 
     def unpack_varint(self):
         total = 0
@@ -217,7 +282,7 @@ class Packet(object):
         else:
             comp_payload = self.recv(
                 packet_length_rest -
-                len(self.pack_varint(packet_length_rest))
+                varint.size(packet_length_rest)
             )
             uncomp_data = zlib.decompress(comp_payload)
 
@@ -240,31 +305,147 @@ class Packet(object):
 
         """
 
-        # first field - entire raw packet Length
-        packet_length = self.unpack_varint()
-        length = packet_length
-        datalength = 0  # if 0, an uncompressed packet
-        if self.compressThreshold != -1:  # if compressed:
-            # length of the uncompressed (Packet ID + Data)
-            datalength = self.unpack_varint()
-            # find the len of the datalength field and subtract it
-            # using augmented assignment in the next line seems to BREAK this
-            length = packet_length - len(self.pack_varint(datalength))
-        orig_payload = self.recv(length)
-        payload_read = orig_payload
+        while True:
+            self._sync_recv_cipher()
+            frame = self._split_frame()
+            if frame is not None:
+                return self._unframe(frame)
+            self._fill()
 
-        if datalength > 0:  # it is compressed, unpack it
-            payload_read = zlib.decompress(orig_payload)
+    def _unframe(self, frame):
+        """
+        Load a frame (everything after the length varint) into self.buffer,
+        inflating it if needed, and read the packet id.
 
-        self.buffer = io.BytesIO(payload_read)
+        :returns: the (pkid, orig_packet) tuple returned by grabpacket().
+         orig_packet is the frame itself when compression is on, so it can
+         be passed on with send_raw_untouched() without being rebuilt.
+        """
+        if self.metrics is not None:
+            self.metrics.received(len(frame))
+        if self.capture is not None:
+            self.capture(frame)
+        self.buffer = io.BytesIO(frame)
+        if self.compressThreshold == -1:
+            pkid = self.read_varint()
+            return pkid, b"\x00" + frame
+        # length of the uncompressed (Packet ID + Data)
+        datalength = self.read_varint()
+        if datalength > 0:  # it is compressed, unpack it
+            inflater = zlib.decompressobj()
+            data = memoryview(frame)[self.buffer.tell():]
+            if self.parsed_ids is not None:
+                # inflate only enough to read the packet id (a varint is
+                #  never more than 5 bytes)...
+                head = inflater.decompress(data, 5)
+                self.buffer = io.BytesIO(head)
+                pkid = self.read_varint()
+                if pkid not in self.parsed_ids():
+                    return pkid, frame
+                # ... and the rest only if someone will parse it.
+                data = inflater.unconsumed_tail
+                self.buffer = io.BytesIO(
+                    head + inflater.decompress(data) + inflater.flush())
+            else:
+                self.buffer = io.BytesIO(
+                    inflater.decompress(data) + inflater.flush())
         pkid = self.read_varint()
-        return pkid, self.pack_varint(datalength) + orig_payload
+        return pkid, frame
+
+    def _fill(self):
+        """
+        Blocking read of whatever the socket has waiting (up to a block)
+        into _rbuf, decrypting it on the way.
+        """
+        length = self.socket.recv_into(self._rblock)
+        if length == 0:
+            raise EOFError("Packet stream ended (Client disconnected")
+        data = self._rview[:length]
+        if self.recvCipher is not None:
+            decrypted = self.recvCipher.update_into(data, self._dblock)
+            data = self._dview[:decrypted]
+        if self._rpos == len(self._rbuf):
+            # everything buffered was consumed; start over (no copying)
+            del self._rbuf[:]
+            self._rpos = 0
+        self._rbuf += data
+
+    def feed(self, data):
+        """
+        Hand raw (still encrypted) socket data to the packet.  Used by the
+        reactor engine, which reads the sockets itself; the frames are
+        then taken out with grabbuffered().
+        """
+        with self._feedlock:
+            self._inbox.append(data)
+
+    def has_fed_data(self):
+        """True if feed() data is waiting to be moved into the buffer."""
+        with self._feedlock:
+            return len(self._inbox) > 0
+
+    def _sync_recv_cipher(self):
+        """
+        Encryption is switched on by a parser in the middle of a stream.
+        Anything buffered past that frame arrived encrypted but was stored
+        as-is, so decrypt it now.
+        """
+        if self.recvCipher is self._rcipher:
+            return
+        if self._rcipher is None and self._rpos < len(self._rbuf):
+            self._rbuf[self._rpos:] = self.recvCipher.update(
+                bytes(self._rbuf[self._rpos:]))
+        self._rcipher = self.recvCipher
+
+    def _split_frame(self):
+        """
+        Take one whole frame (the bytes after the length varint) out of
+        _rbuf.  Returns None if a whole frame is not buffered yet.
+        """
+        buf = self._rbuf
+        end = len(buf)
+        try:
+            length, pos = varint.unpack_from(buf, self._rpos)
+        except IndexError:
+            return None
+        if pos + length > end:
+            return None
+        with memoryview(buf) as view:
+            frame = view[pos:pos + length].tobytes()
+        self._rpos = pos + length
+        # compact once the consumed part is the larger part of the buffer
+        if self._rpos > 65536 and self._rpos * 2 > end:
+            del buf[:self._rpos]
+            self._rpos = 0
+        return frame
+
+    def grabbuffered(self):
+        """
+        The non-blocking version of grabpacket() for data supplied with
+        feed().
+
+        :returns: A (pkid, orig_packet) tuple like grabpacket(), or None
+         if a complete packet has not been received yet.
+        """
+        self._sync_recv_cipher()
+        with self._feedlock:
+            data = b"".join(self._inbox)
+            self._inbox = []
+        if data:
+            if self.recvCipher is not None:
+                data = self.recvCipher.update(data)
+            self._rbuf += data
+        frame = self._split_frame()
+        if frame is None:
+            return None
+        return self._unframe(frame)
 
     def socket_transmit(self, packet):
+        # sendall - a bare send() may transmit only part of a large burst.
         if self.sendCipher is None:
-            self.socket.send(packet)
+            self.socket.sendall(packet)
         else:
-            self.socket.send(self.sendCipher.update(packet))
+            self.socket.sendall(self.sendCipher.update(packet))
 
     def handle_compression(self, compression_threshhold, payload):
         """  # noqa
@@ -283,34 +464,129 @@ class Packet(object):
         """
         if compression_threshhold > -1:
             # compose compressed packet
-            if len(payload) > self.compressThreshold:
-                pktcomp = self.pack_varint(len(payload)) + zlib.compress(
-                    payload)
-                return self.pack_varint(len(pktcomp)) + pktcomp
+            if self.compressor.compresses(self.compressThreshold, payload):
+                return self._compressed_frame(
+                    payload, self.compressor.compress(payload))
             else:
-                packet = self.pack_varint(0) + payload
-                return self.pack_varint(len(packet)) + packet
+                # a DataLength of 0 (one byte) marks it as not compressed
+                return b"".join((
+                    varint.pack(len(payload) + 1), b"\x00", payload))
         else:
             # compose uncompressed packet
-            return self.pack_varint(len(payload)) + payload
+            return varint.pack(len(payload)) + payload
+
+    def _compressed_frame(self, payload, compressed):
+        datalength = varint.pack(len(payload))
+        return b"".join((varint.pack(len(datalength) + len(compressed)),
+                         datalength, compressed))
+
+    def wait_for_queue(self, timeout=None):
+        """
+        Block until packets are queued for sending, the packet is
+        closed, or `timeout` seconds elapse.
+
+        :returns: True if there is something in the queue to flush.
+        """
+        with self.queue_ready:
+            if len(self.queue) == 0 and not self.abort:
+                self.queue_ready.wait(timeout)
+            return len(self.queue) > 0
+
+    def _take_frames(self):
+        """
+        Empty the queue and frame it, in order.
+
+        :returns: a list of frames: bytes or, for the large payloads
+         that are compressing on the compressor pool, PendingFrames.
+        """
+        with self.queue_ready:
+            if len(self.queue) == 0:
+                return []
+            pending = self.queue
+            self.queue = []
+        # start the large payloads compressing on the pool first...
+        jobs = {}
+        for index, (compression, packet) in enumerate(pending):
+            if compression > -1 and self.compressor.compresses(
+                    self.compressThreshold, packet):
+                job = self.compressor.submit(packet)
+                if job is not None:
+                    jobs[index] = job
+        # ... then frame everything else in order, small packets inline.
+        frames = []
+        sent = 0
+        # payload and frame bytes of the packets compressed here
+        compressed_in = compressed_out = 0
+        for index, (compression, packet) in enumerate(pending):
+            if index in jobs:
+                frames.append(PendingFrame(self, packet, jobs[index]))
+                continue
+            frame = self.handle_compression(compression, packet)
+            frames.append(frame)
+            sent += len(frame)
+            if compression > -1 and self.compressor.compresses(
+                    self.compressThreshold, packet):
+                compressed_in += len(packet)
+                compressed_out += len(frame)
+        if self.metrics is not None:
+            self.metrics.flushed(len(pending),
+                                 sum(len(packet) for _, packet in pending),
+                                 sent, compressed_in, compressed_out)
+        return frames
+
+    def _take_queue(self):
+        """Empty the queue and return it framed as one bytes string."""
+        return b"".join(
+            frame if isinstance(frame, bytes) else frame.result()
+            for frame in self._take_frames())
 
     def flush(self):
-        while len(self.queue) > 0:
-            # grab next packet
-            packet_tuple = self.queue.pop(0)
-            # see if it is compressed
-            compression = packet_tuple[0]
-            packet = packet_tuple[1]  # `payload`
-            trans_packet = self.handle_compression(compression, packet)
-            self.socket_transmit(trans_packet)
+        """
+        Send everything in the queue.  The whole queue is taken at once,
+        framed in order, and coalesced into a single socket transmission.
+        """
+        with self._sendlock:
+            data = self._take_queue()
+            if data:
+                self.socket_transmit(data)
+
+    def drain(self):
+        """
+        Like flush(), but returns the (encrypted) bytes instead of
+        sending them.  Used by the replay benchmark.
+        """
+        with self._sendlock:
+            data = self._take_queue()
+            if data and self.sendCipher is not None:
+                data = self.sendCipher.update(data)
+            return data
+
+    def take_frames(self):
+        """
+        The non-blocking version of drain(), for the reactor engine: the
+        queue's frames without waiting for the compressor pool.
+
+        :returns: (frames, cipher): the frames as from _take_frames(),
+         and the send cipher (or None) that must encrypt them, in order,
+         once they are complete.
+        """
+        with self._sendlock:
+            return self._take_frames(), self.sendCipher
+
+    def _enqueue(self, packet_tuple):
+        with self.queue_ready:
+            self.queue.append(packet_tuple)
+            self.queue_ready.notify()
+        if self.on_queue:
+            self.on_queue()
 
     def send_raw_untouched(self, payload):
         if not self.abort:
-            self.queue.append((-1, payload))
+            self._enqueue((-1, payload))
 
     def send_raw(self, payload):
         if not self.abort:
-            self.queue.append((self.compressThreshold, payload))
+            self._enqueue((self.compressThreshold, payload))
 
     def readpkt(self, args):
         """
@@ -331,9 +607,18 @@ class Packet(object):
 
         """
         result = []
-        for arg in args:
-            item = self._PKTREAD[arg]()
-            result.append(item)
+        for step in codec.reader(args):
+            if type(step) is int:
+                result.append(self._PKTREAD[step]())
+                continue
+            # a run of fixed size fields, read with one struct
+            fields, count, converters = step
+            values = fields.unpack(self.read_data(fields.size))
+            if converters:
+                values = list(values)
+                for index, convert in converters:
+                    values[index] = convert(values[index])
+            result.extend(values)
         return result
 
     def sendpkt(self, pkid, args, payload,):
@@ -355,17 +640,25 @@ class Packet(object):
                             same order the args were passed.
 
                 """
-        result = b""  # PY 2-3
         # start with packet id
-        result += self.send_varint(pkid)
+        parts = [varint.pack(pkid)]
         # append results to the result packet for each type
-        argcount = len(args)
-        if argcount == 0:
-            self.send_raw(result)
-            return result
-        for x, arg in enumerate(args):
-            pay = payload[x]
-            result += self._PKTSEND[arg](pay)
+        x = 0
+        for step in codec.sender(args):
+            if type(step) is int:
+                parts.append(self._PKTSEND[step](payload[x]))
+                x += 1
+                continue
+            # a run of fixed size fields, packed with one struct
+            fields, count, converters = step
+            values = payload[x:x + count]
+            if converters:
+                values = list(values)
+                for index, convert in converters:
+                    values[index] = convert(values[index])
+            parts.append(fields.pack(*values))
+            x += count
+        result = b"".join(parts)
         self.send_raw(result)
         return result
 
@@ -376,7 +669,7 @@ class Packet(object):
             returnitem = payload.encode("utf-8")
         except:
             returnitem = payload
-        return self.send_varint(len(returnitem)) + returnitem
+        return varint.pack(len(returnitem)) + returnitem
 
     def send_json(self, payload):
         return self.send_string(json.dumps(payload))
@@ -412,10 +705,10 @@ class Packet(object):
             return self.send_byte(0)
 
     def send_varint(self, payload):
-        return self.pack_varint(payload)
+        return varint.pack(payload)
 
     def send_bytearray(self, payload):
-        return self.send_varint(len(payload)) + payload
+        return varint.pack(len(payload)) + payload
 
     def send_bytearray_short(self, payload):
         return self.send_short(len(payload)) + payload
@@ -460,7 +753,7 @@ class Packet(object):
             if value_type == 0:
                 b += self.send_byte(value)
             elif value_type == 1:
-                b += self.send_varint(value)
+                b += varint.pack(value)
             elif value_type == 2:
                 b += self.send_float(value)
             elif value_type == 3:
@@ -485,7 +778,7 @@ class Packet(object):
                     b += self.send_position(value[1])
 
             elif value_type == 10:
-                b += self.send_varint(value)
+                b += varint.pack(value)
 
             elif value_type == 11:  # OPT UUID
                 bool_option = value[0]
@@ -494,7 +787,7 @@ class Packet(object):
                     b += self.send_uuid(value[1])
 
             elif value_type == 12:
-                b += self.send_varint(value)
+                b += varint.pack(value)
 
             else:
                 self.log.error("Unsupported data type '%d' for"
@@ -546,7 +839,7 @@ class Packet(object):
         the number of strings in the array.  Hence, this combines the
         Wiki.vg items of `VARINT|STRING(array of STRING)` """
         b = b""
-        b += self.pack_varint(len(payload))
+        b += varint.pack(len(payload))
         for strings in payload:
             thisone = self.send_string(strings)
             b += thisone
@@ -621,20 +914,17 @@ class Packet(object):
     # -- READING Methods  -- #
     # ---------------------- #
     def recv(self, length):
-        if length > 200:
-            d = b""  # Py 2-3
-            while len(d) < length:
-                m = length - len(d)
-                if m > 5000:
-                    m = 5000
-                d += self.socket.recv(m)
-        else:
-            d = self.socket.recv(length)
-            if len(d) == 0:
-                raise EOFError("Packet stream ended (Client disconnected")
-        if self.recvCipher is None:
-            return d
-        return self.recvCipher.update(d)
+        """
+        Blocking read of exactly `length` (decrypted) bytes from the
+        stream.
+        """
+        self._sync_recv_cipher()
+        while len(self._rbuf) - self._rpos < length:
+            self._fill()
+        with memoryview(self._rbuf) as view:
+            d = view[self._rpos:self._rpos + length].tobytes()
+        self._rpos += length
+        return d
 
     def read_data(self, length):
         d = self.buffer.read(length)
@@ -680,16 +970,39 @@ class Packet(object):
         return struct.unpack("b", self.read_data(1))[0] == 1
 
     def read_varint(self):
-        total = 0
-        shift = 0
-        val = 0x80
-        while val & 0x80:
-            val = struct.unpack('B', self.read_data(1))[0]
-            total |= ((val & 0x7F) << shift)
-            shift += 7
-        if total & (1 << 31):
-            total = total - (1 << 32)
-        return total
+        buf = self.buffer
+        first = buf.read(1)
+        if not first:
+            # "Received no data or less data than expected - connection closed"
+            self.obj.close_server()
+            raise ValueError("Packet ended before a varint")
+        val = ord(first)
+        if val < 0x80:
+            return val
+        # a longer varint; decode the rest of it in one go
+        rest = buf.read(varint.MAX_LENGTH - 1)
+        try:
+            value, pos = varint.unpack_from(first + rest)
+        except IndexError:
+            self.obj.close_server()
+            raise ValueError("Packet ended inside a varint")
+        buf.seek(pos - 1 - len(rest), io.SEEK_CUR)
+        return value
+
+    def read_varint_array(self, count):
+        """
+        Read `count` consecutive varints (entity id lists, palettes...)
+        in one go.
+        """
+        buf = self.buffer
+        data = buf.read(count * varint.MAX_LENGTH)
+        try:
+            values, pos = varint.unpack_array(data, count)
+        except IndexError:
+            self.obj.close_server()
+            raise ValueError("Packet ended inside a varint array")
+        buf.seek(pos - len(data), io.SEEK_CUR)
+        return values
 
     def read_bytearray(self):
         return self.read_data(self.read_varint())
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Minecraft VarInt encoding and decoding.
+
+Every packet starts with at least two varints (the length and the packet
+id; three when compression is on), so these are on the proxy's hottest
+path.  Values below 2^14 (one and two byte varints - nearly every length,
+packet id and entity id) are encoded from a precomputed table.
+
+Varints are 32 bit signed values; negative numbers are sent as their
+unsigned 32 bit two's complement (and are always five bytes long).
+"""
+
+import sys
+
+# values encoded from the table (one and two byte varints)
+_TABLE_SIZE = 1 << 14
+# a 32 bit varint is never longer than this
+MAX_LENGTH = 5
+
+if sys.version_info > (3,):
+    def _octets(data):
+        return data
+else:
+    # Py2 str indexes as characters
+    _octets = bytearray
+
+
+def _encode(value):
+    if value < 0:
+        value += 1 << 32
+    out = bytearray()
+    while value >= 0x80:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+_TABLE = tuple(_encode(value) for value in range(_TABLE_SIZE))
+
+
+def pack(value):
+    """
+    :returns: `value` encoded as a varint (bytes).
+    """
+    if 0 <= value < _TABLE_SIZE:
+        return _TABLE[value]
+    return _encode(value)
+
+
+def size(value):
+    """
+    :returns: the encoded length of `value`, without encoding it.
+    """
+    if value < 0:
+        return MAX_LENGTH
+    length = 1
+    while value >= 0x80:
+        value >>= 7
+        length += 1
+    return length
+
+
+def unpack_from(data, pos=0):
+    """
+    Decode one varint from `data` (bytes or bytearray), starting at `pos`.
+
+    :returns: a (value, next_pos) tuple.
+
+    :raises: IndexError if `data` ends inside the varint;
+     ValueError if the varint is longer than five bytes.
+    """
+    data = _octets(data)
+    val = data[pos]
+    pos += 1
+    if val < 0x80:
+        return val, pos
+    total = val & 0x7F
+    shift = 7
+    while True:
+        val = data[pos]
+        pos += 1
+        total |= (val & 0x7F) << shift
+        if not val & 0x80:
+            break
+        shift += 7
+        if shift > 28:
+            raise ValueError("VarInt is too big")
+    if total & (1 << 31):
+        total -= 1 << 32
+    return total, pos
+
+
+def unpack_array(data, count, pos=0):
+    """
+    Decode `count` consecutive varints (entity id lists, palettes...)
+    from `data`, starting at `pos`.
+
+    :returns: a (list_of_values, next_pos) tuple.
+
+    :raises: IndexError if `data` holds fewer than `count` varints.
+    """
+    data = _octets(data)
+    values = []
+    append = values.append
+    for _ in range(count):
+        val = data[pos]
+        pos += 1
+        if val < 0x80:
+            append(val)
+            continue
+        total = val & 0x7F
+        shift = 7
+        while True:
+            val = data[pos]
+            pos += 1
+            total |= (val & 0x7F) << shift
+            if not val & 0x80:
+                break
+            shift += 7
+            if shift > 28:
+                raise ValueError("VarInt is too big")
+        if total & (1 << 31):
+            total -= 1 << 32
+        append(total)
+    return values, pos
+
+
+def pack_array(values):
+    """
+    :returns: the varints of `values`, concatenated.
+    """
+    return b"".join([pack(value) for value in values])
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+The reactor proxy engine ("proxy-engine": "reactor").
+
+In the default threaded engine, each player costs about five threads:
+the client handle, flush and keepalive threads and the server connection's
+handle and flush threads.  The reactor runs every client and server socket
+on a single selector loop instead.  The loop only does socket I/O.
+Complete frames are handed to a small, fixed pool of worker threads that
+run the usual `_parse` dispatchers (ParseSB/ParseCB tables) and events.
+
+A connection's frames are always processed by one worker at a time and in
+the order received, so parsers see exactly what they see when threaded.
+Parsers and plugins may still block (disconnect messages, Mojang
+session requests, plugin event handlers); that only ties up a worker,
+never the loop.
+
+A connection object given to `add_connection()` must provide:
+    :packet: its proxy.packets.packet.Packet instance.
+    :abort: True once the connection is finished.
+    :process_packet(pkid, orig_packet): handles one received packet.
+    :connection_lost(reason): called (on a worker) when the socket closes.
+"""
+
+import errno
+import heapq
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+
+try:
+    import selectors
+except ImportError:
+    selectors = False
+
+try:
+    import queue
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import Queue as queue
+
+# frames a worker handles for one connection before giving others a turn
+_BATCH = 64
+# stop reading a socket while this much data waits to be parsed
+_MAX_BACKLOG = 4 * 1024 * 1024
+# a non-blocking socket call that would have blocked
+_WOULDBLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+class _Channel(object):
+    """Reactor-side state for one socket."""
+    def __init__(self, sock, conn):
+        self.sock = sock
+        self.conn = conn
+        self.packet = conn.packet
+        self.outbuf = bytearray()
+        # (frame, cipher) taken from the packet but not yet in `outbuf`;
+        #  a frame may still be compressing (see Packet.take_frames)
+        self.frames = deque()
+        self.backlog = 0
+        self.scheduled = False
+        self.paused = False
+        self.closed = False
+
+
+class ProxyReactor(object):
+    def __init__(self, log, workers=8):
+        self.log = log
+        self.abort = False
+        self.workers = max(1, workers)
+
+        self.selector = selectors.DefaultSelector()
+        self.channels = {}
+
+        # other threads never touch the selector; they post callables to
+        # `_calls` and write to the wake up socket.
+        self._lock = threading.Lock()
+        self._calls = []
+        self._dirty = set()
+        self._woken = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        # (when, sequence, interval, callback) heap for call_every()
+        self._timers = []
+        self._timerseq = 0
+
+        # channels with frames to parse and timer callbacks to run
+        self._work = queue.Queue()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker,
+                                 name="ProxyWorker-%d" % i, args=())
+            t.daemon = True
+            t.start()
+        t = threading.Thread(target=self._run, name="ProxyReactor", args=())
+        t.daemon = True
+        t.start()
+        self.call_every(1, self._sweep, on_loop=True)
+
+    def stop(self):
+        self.abort = True
+        for _ in range(self.workers):
+            self._work.put(None)
+        self._wake()
+
+    # Public methods (any thread)
+    # ---------------------------
+
+    def add_connection(self, conn):
+        """
+        Start servicing `conn`.  Its socket must already be connected.
+        """
+        sock = conn.packet.socket
+        sock.setblocking(False)
+        channel = _Channel(sock, conn)
+        conn.packet.on_queue = lambda: self._request_flush(channel)
+        self._call_soon(lambda: self._register(channel))
+
+    def call_every(self, interval, callback, on_loop=False):
+        """
+        Run `callback` every `interval` seconds until it returns False.
+        Callbacks run on the worker pool (so they may block) unless
+        `on_loop` is set.
+        """
+        def _add():
+            self._timerseq += 1
+            heapq.heappush(self._timers, (time.time() + interval,
+                                          self._timerseq, interval,
+                                          callback, on_loop))
+        self._call_soon(_add)
+
+    # loop thread
+    # -----------
+
+    def _call_soon(self, callback):
+        with self._lock:
+            self._calls.append(callback)
+        self._wake()
+
+    def _request_flush(self, channel):
+        with self._lock:
+            self._dirty.add(channel)
+        self._wake()
+
+    def _wake(self):
+        with self._lock:
+            if self._woken:
+                return
+            self._woken = True
+        try:
+            self._wake_w.send(b"\x00")
+        except socket.error:
+            pass
+
+    def _register(self, channel):
+        self.channels[channel.sock.fileno()] = channel
+        self.selector.register(channel.sock, selectors.EVENT_READ, channel)
+        # anything queued before registration
+        self._flush(channel)
+
+    def _run(self):
+        while not self.abort:
+            timeout = 1.0
+            if self._timers:
+                timeout = min(max(self._timers[0][0] - time.time(), 0), 1.0)
+            for key, mask in self.selector.select(timeout):
+                channel = key.data
+                if channel is None:
+                    self._drain_wakeups()
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._send(channel)
+                if mask & selectors.EVENT_READ:
+                    self._read(channel)
+            self._run_calls()
+            self._run_timers()
+        for channel in list(self.channels.values()):
+            self._close(channel, "Proxy reactor stopped")
+        self.selector.close()
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _run_calls(self):
+        with self._lock:
+            calls = self._calls
+            self._calls = []
+            dirty = self._dirty
+            self._dirty = set()
+            self._woken = False
+        for callback in calls:
+            callback()
+        for channel in dirty:
+            self._flush(channel)
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            when, seq, interval, callback, on_loop = heapq.heappop(
+                self._timers)
+            if on_loop:
+                self._timer_call(callback, interval, on_loop)
+            else:
+                self._work.put(lambda c=callback, i=interval:
+                               self._timer_call(c, i, False))
+
+    def _timer_call(self, callback, interval, on_loop):
+        try:
+            again = callback() is not False
+        except Exception as e:
+            self.log.error("Proxy reactor timer %s failed: %s\n%s",
+                           callback, e, traceback.format_exc())
+            again = False
+        if again and not self.abort:
+            self.call_every(interval, callback, on_loop)
+
+    def _sweep(self):
+        """Close channels whose connection has aborted."""
+        for channel in list(self.channels.values()):
+            if channel.conn.abort:
+                self._close(channel, "aborted")
+
+    def _read(self, channel):
+        try:
+            data = channel.sock.recv(65536)
+        except socket.error as e:
+            if e.args and e.args[0] in _WOULDBLOCK:
+                return
+            return self._close(channel, "socket error: %s" % e)
+        if not data:
+            return self._close(channel, "EOF")
+        with self._lock:
+            channel.packet.feed(data)
+            channel.backlog += len(data)
+            if channel.backlog > _MAX_BACKLOG and not channel.paused:
+                channel.paused = True
+                self._set_events(channel)
+            if not channel.scheduled:
+                channel.scheduled = True
+                self._work.put(channel)
+
+    def _flush(self, channel, wait=False):
+        if channel.closed:
+            return
+        try:
+            frames, cipher = channel.packet.take_frames()
+            channel.frames.extend((frame, cipher) for frame in frames)
+            self._output(channel, wait)
+        except Exception as e:
+            return self._close(channel, "could not frame packets: %s" % e)
+        self._send(channel)
+
+    def _output(self, channel, wait):
+        """
+        Move the channel's complete frames, in order, to its output
+        buffer.  The loop never waits for a frame still compressing
+        (unless `wait`, when closing); it is flushed again when done.
+        """
+        while channel.frames:
+            frame, cipher = channel.frames[0]
+            if not isinstance(frame, bytes):
+                if not wait and not frame.done():
+                    if not frame.watched:
+                        frame.watched = True
+                        frame.add_done_callback(
+                            lambda: self._request_flush(channel))
+                    return
+                frame = frame.result()
+            channel.frames.popleft()
+            if cipher is not None:
+                frame = cipher.update(frame)
+            channel.outbuf += frame
+
+    def _send(self, channel):
+        if channel.closed:
+            return
+        if channel.outbuf:
+            try:
+                sent = channel.sock.send(channel.outbuf)
+                del channel.outbuf[:sent]
+            except socket.error as e:
+                if not (e.args and e.args[0] in _WOULDBLOCK):
+                    return self._close(channel, "socket error: %s" % e)
+        self._set_events(channel)
+
+    def _set_events(self, channel):
+        if channel.closed:
+            return
+        events = 0
+        if not channel.paused:
+            events |= selectors.EVENT_READ
+        if channel.outbuf:
+            events |= selectors.EVENT_WRITE
+        try:
+            if events:
+                self.selector.modify(channel.sock, events, channel)
+            else:
+                self.selector.unregister(channel.sock)
+        except (KeyError, ValueError):
+            if events:
+                self.selector.register(channel.sock, events, channel)
+
+    def _resume(self, channel):
+        if channel.paused and not channel.closed:
+            channel.paused = False
+            self._set_events(channel)
+
+    def _close(self, channel, reason):
+        if channel.closed:
+            return
+        # last chance for anything queued (a disconnect message, say)
+        self._flush(channel, wait=True)
+        channel.closed = True
+        channel.packet.on_queue = None
+        self.channels.pop(channel.sock.fileno(), None)
+        try:
+            self.selector.unregister(channel.sock)
+        except (KeyError, ValueError):
+            pass
+        if channel.outbuf:
+            try:
+                channel.sock.setblocking(True)
+                channel.sock.settimeout(1)
+                channel.sock.sendall(bytes(channel.outbuf))
+            except socket.error:
+                pass
+        try:
+            channel.sock.close()
+        except socket.error:
+            pass
+        self._work.put(lambda: channel.conn.connection_lost(reason))
+
+    # worker threads
+    # --------------
+
+    def _worker(self):
+        while not self.abort:
+            item = self._work.get()
+            if item is None:
+                break
+            if isinstance(item, _Channel):
+                self._service(item)
+                continue
+            try:
+                item()
+            except Exception as e:
+                self.log.error("Proxy worker task failed: %s\n%s",
+                               e, traceback.format_exc())
+
+    def _service(self, channel):
+        """Parse a channel's frames, in order, on this worker."""
+        count = 0
+        while True:
+            if channel.closed or channel.conn.abort:
+                with self._lock:
+                    channel.scheduled = False
+                return
+            try:
+                frame = channel.packet.grabbuffered()
+                if frame is not None:
+                    channel.conn.process_packet(*frame)
+            except Exception as e:
+                self.log.error("Proxy connection failed to process a "
+                               "packet: %s\n%s", e, traceback.format_exc())
+                channel.conn.abort = True
+                self._call_soon(lambda: self._close(channel, "%s" % e))
+                return
+            if frame is None:
+                with self._lock:
+                    if channel.packet.has_fed_data():
+                        continue
+                    channel.scheduled = False
+                    channel.backlog = 0
+                    paused = channel.paused
+                # (_call_soon takes the lock itself)
+                if paused:
+                    self._call_soon(lambda: self._resume(channel))
+                return
+            count += 1
+            if count >= _BATCH:
+                # give other connections a turn
+                self._work.put(channel)
+                return
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Replay a packet capture (see proxy.utils.capture) through the proxy as a
+benchmark.  No Minecraft server, client or Mojang session is needed.
+
+Run it from the wrapper source directory:
+
+    python -m proxy.replay capture.bin [--repeat N] [--allocations]
+
+Each recorded frame is fed to the Packet of a real Client (serverbound)
+or ServerConnection (clientbound), just as the reactor engine feeds
+received data.  PLAY packets then run through the usual `_parse`
+dispatchers (ParseSB/ParseCB) and whatever they send is framed,
+compressed and drained.  Frames recorded in other states (handshake,
+login and status involve sockets, encryption and Mojang) are only
+unframed.  The sockets are in-memory stand-ins that discard output.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+import time
+import traceback
+
+try:
+    import tracemalloc
+except ImportError:
+    # Py2
+    tracemalloc = False
+
+from api.wrapperconfig import CONFIG
+from core.servervitals import ServerVitals
+from proxy.base import Proxy, ProxyConfig, HaltSig, NullEventHandler
+from proxy.client.clientconnection import Client
+from proxy.packets import varint
+from proxy.packets.packet import Packet
+from proxy.server.serverconnection import ServerConnection
+from proxy.utils.capture import read_capture, SERVERBOUND
+from proxy.utils.constants import PLAY
+
+
+class _NullSocket(object):
+    """A connected socket stand-in that discards everything sent."""
+    def __init__(self):
+        self.sent = 0
+
+    def connect(self, address):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def recv_into(self, buf):
+        return 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class _NullReactor(object):
+    """
+    Set as proxy.reactor so connections start no flush or keepalive
+    threads; the replay drains their packets itself.
+    """
+    def add_connection(self, conn):
+        pass
+
+    def call_every(self, interval, callback, on_loop=False):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _Owner(object):
+    """The `obj` of the Packet that unframes non-PLAY frames."""
+    def __init__(self, log):
+        self.log = log
+
+    def close_server(self, *args):
+        pass
+
+
+class _NullUsercache(object):
+    def __init__(self):
+        self.Data = {}
+
+
+class Replay(object):
+    def __init__(self, records, log):
+        self.records = records
+        self.log = log
+
+        config = ProxyConfig()
+        config.proxy = dict(CONFIG["Proxy"])
+        config.entity = dict(CONFIG["Entities"])
+        config.proxy["online-mode"] = False
+        config.proxy["packet-capture"] = False
+        config.proxy["proxy-enabled"] = True
+        vitals = ServerVitals({})
+        vitals.state = 2
+        self.proxy = Proxy(HaltSig(), config, vitals, log, _NullUsercache(),
+                           NullEventHandler())
+        self.proxy.reactor = _NullReactor()
+
+        # session number: (client, server)
+        self.sessions = {}
+        self.scratch = Packet(_NullSocket(), _Owner(log))
+
+        self.parsed = 0
+        self.framed = 0
+        self.bytes_in = 0
+        self.errors = {}
+
+    def _session(self, record):
+        try:
+            return self.sessions[record.session]
+        except KeyError:
+            pass
+        self.proxy.srv_data.protocolVersion = record.protocol
+        client = Client(self.proxy, _NullSocket(), ("127.0.0.1", 0))
+        client.clientversion = record.protocol
+        client._getclientpacketset()
+        client.username = "Replay%d" % record.session
+        client.mojanguuid = self.proxy.uuids.getuuidfromname(
+            client.username)
+        client.wrapper_uuid = client.mojanguuid
+        client.local_uuid = client.mojanguuid
+        client._inittheplayer()
+        client.state = PLAY
+
+        server = ServerConnection(client, None, None)
+        server.server_socket = _NullSocket()
+        server.connect()
+        server.state = PLAY
+        client.server_connection = server
+        self.sessions[record.session] = (client, server)
+        return client, server
+
+    def run(self):
+        for record in self.records:
+            stream = varint.pack(len(record.frame)) + record.frame
+            self.bytes_in += len(stream)
+            if record.state != PLAY:
+                self.scratch.compressThreshold = record.threshold
+                self.scratch.feed(stream)
+                self.scratch.grabbuffered()
+                self.framed += 1
+                continue
+
+            client, server = self._session(record)
+            if record.direction == SERVERBOUND:
+                conn = client
+            else:
+                conn = server
+            conn.packet.compressThreshold = record.threshold
+            conn.packet.feed(stream)
+            pkid, orig_packet = conn.packet.grabbuffered()
+            try:
+                conn.process_packet(pkid, orig_packet)
+            except Exception as e:
+                key = ("SB" if conn is client else "CB", pkid)
+                if key not in self.errors:
+                    self.log.debug("%s 0x%02x failed: %s\n%s", key[0], pkid,
+                                   e, traceback.format_exc())
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self.parsed += 1
+            # what a flush thread / the reactor would send
+            client.packet.socket.sent += len(client.packet.drain())
+            server.packet.socket.sent += len(server.packet.drain())
+
+    def bytes_out(self):
+        total = 0
+        for client, server in self.sessions.values():
+            total += client.packet.socket.sent + server.packet.socket.sent
+        return total
+
+    def close(self):
+        for client, server in self.sessions.values():
+            client.abort = True
+            server.abort = True
+        self.proxy.compressor.shutdown()
+
+
+def _timed(records, repeat, log):
+    """:returns: (Replay, seconds) of the fastest of `repeat` runs."""
+    best = None
+    for _ in range(repeat):
+        replay = Replay(records, log)
+        start = time.time()
+        replay.run()
+        elapsed = time.time() - start
+        replay.close()
+        if best is None or elapsed < best[1]:
+            best = (replay, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a Wrapper.py proxy packet capture as a "
+                    "benchmark.")
+    parser.add_argument("capture", help="a file recorded with the Proxy "
+                                        "'packet-capture' option")
+    parser.add_argument("--repeat", "-r", type=int, default=3,
+                        help="runs to time (the fastest is reported)")
+    parser.add_argument("--allocations", "-a", action="store_true",
+                        help="also report memory allocations (an extra, "
+                             "slower, run with tracemalloc)")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="log the first traceback of each failing "
+                             "packet type")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.CRITICAL)
+    log = logging.getLogger("replay")
+
+    records = list(read_capture(args.capture))
+    replay, elapsed = _timed(records, max(args.repeat, 1), log)
+    total = replay.parsed + replay.framed
+    print("%d frames (%d parsed in PLAY, %d only unframed), %d sessions" % (
+        total, replay.parsed, replay.framed, len(replay.sessions)))
+    print("%.3f seconds: %.0f packets/sec, %.2f MB/sec in, %d bytes out" % (
+        elapsed, total / max(elapsed, 1e-9),
+        replay.bytes_in / max(elapsed, 1e-9) / 1048576, replay.bytes_out()))
+    for (direction, pkid), count in sorted(replay.errors.items()):
+        print("  %s 0x%02x: %d parse errors" % (direction, pkid, count))
+
+    if args.allocations:
+        if not tracemalloc:
+            print("--allocations needs tracemalloc (Python 3.4+)")
+            return 1
+        replay = Replay(records, log)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        replay.run()
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        replay.close()
+        print("allocations: %d bytes retained, %d bytes peak" % (
+            current, peak))
+        for stat in after.compare_to(before, "lineno")[:10]:
+            print("  %s" % stat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
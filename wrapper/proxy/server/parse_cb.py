@@ -398,10 +398,12 @@ class ParseCB(object):
             return True
         rawdata = self.packet.readpkt(self.pktCB.TAB_COMPLETE[PARSER])
         data = rawdata[0]
+        original = list(data)
 
         payload = self.proxy.eventhandler.callevent(
             "server.autoCompletes", {
                 "playername": self.client.username,
+                "text": self.client.tab_text,
                 "completes": data})
         """ eventdoc
             <group> Proxy <group>
@@ -418,6 +420,7 @@ class ParseCB(object):
             <comments>
             <payload>
             "playername": player's name
+            "text": what the player is completing (like "/he").
             "completes": A list of auto-completions supplied by the server.
             <payload>
 
@@ -427,7 +430,9 @@ class ParseCB(object):
         if payload is False:
             return False
 
-        # change payload.
+        # change payload (or completions added to the list).
+        if type(payload) != list and data != original:
+            payload = data
         if type(payload) == list:
             self.client.packet.sendpkt(self.pktCB.TAB_COMPLETE[PKT],
                                        self.pktCB.TAB_COMPLETE[PARSER],
@@ -529,11 +534,11 @@ class ParseCB(object):
         if dt[2] in self.ent_control.objecttypes:
             objectname = self.ent_control.objecttypes[
                 dt[2]]
-            newobject = {dt[0]: Entity(dt[0], entityuuid, dt[2], objectname,
-                                       (dt[3], dt[4], dt[5],), (dt[6], dt[7]),
-                                       True, self.client.username)}
+            newobject = Entity(dt[0], entityuuid, dt[2], objectname,
+                               (dt[3], dt[4], dt[5],), (dt[6], dt[7]),
+                               True, self.client.username)
 
-            self.ent_control.entities.update(newobject)
+            self.ent_control.add_entity(newobject)
         return True
 
     def play_spawn_mob(self):
@@ -566,12 +571,12 @@ class ParseCB(object):
         if dt[2] in self.ent_control.entitytypes:
             mobname = self.ent_control.entitytypes[
                 dt[2]]["name"]
-            newmob = {dt[0]: Entity(dt[0], entityuuid, dt[2], mobname,
-                                    (dt[3], dt[4], dt[5],),
-                                    (dt[6], dt[7], dt[8]),
-                                    False, self.client.username)}
+            newmob = Entity(dt[0], entityuuid, dt[2], mobname,
+                            (dt[3], dt[4], dt[5],),
+                            (dt[6], dt[7], dt[8]),
+                            False, self.client.username)
 
-            self.ent_control.entities.update(newmob)
+            self.ent_control.add_entity(newmob)
         return True
 
     def play_entity_relative_move(self):
@@ -709,22 +714,15 @@ class ParseCB(object):
         if not self.ent_control:
             return True
 
-        # noinspection PyUnusedLocal
-        eids = []  # todo what was this for??
         if self.server.version < PROTOCOL_1_8START:
             # make sure we get iterable integer
             entitycount = bytearray(self.packet.readpkt([BYTE])[0])[0]
-            parser = [INT]
+            eids = self.packet.readpkt([INT] * entitycount)
         else:
-            # TODO - error when more than 256 entities?
-            rawread = self.packet.readpkt([VARINT])
-            entitycount = rawread[0]
-            parser = [VARINT]
-
-        for _ in range(entitycount):
-            eid = self.packet.readpkt(parser)[0]
-            # noinspection PyBroadException
-            if eid in self.ent_control.entities:
-                self.ent_control.entities.pop(eid, None)
+            entitycount = self.packet.read_varint()
+            eids = self.packet.read_varint_array(entitycount)
+
+        for eid in eids:
+            self.ent_control.remove_entity(eid)
 
         return True
@@ -19,6 +19,7 @@ from proxy.packets import mcpackets_sb
 from proxy.packets import mcpackets_cb
 
 from proxy.utils.constants import *
+from proxy.utils.capture import CLIENTBOUND
 from proxy.utils.mcuuid import MCUUID
 
 
@@ -52,6 +53,7 @@ class ServerConnection(object):
         self.state = HANDSHAKE
         self.packet = None
         self.parse_cb = None
+        self.metrics = None
 
         # dictionary of parser packet constants and associated parsing methods
         self.parsers = {}
@@ -96,24 +98,42 @@ class ServerConnection(object):
         # start packet handler
         self.packet = Packet(self.server_socket, self)
         self.packet.version = self.client.clientversion
+        self.packet.compressor = self.proxy.compressor
+        if self.proxy.metrics:
+            self.metrics = self.proxy.metrics.connection(
+                self, "server", lambda: self.client.username)
+            self.packet.metrics = self.metrics
+        if self.proxy.capture:
+            self.packet.capture = self.proxy.capture.recorder(
+                self.client.capture_session, CLIENTBOUND, self.packet,
+                lambda: (self.state, self.version))
+        if self.proxy.config["passthrough-unparsed"]:
+            self.packet.parsed_ids = lambda: self.parsers[self.state]
 
         # define parsers
         self.parse_cb = ParseCB(self, self.packet)
         self._define_parsers()
 
-        t = threading.Thread(target=self.flush_loop, args=())
-        t.daemon = True
-        t.start()
+        # the reactor engine does its own sending
+        if not self.proxy.reactor:
+            t = threading.Thread(target=self.flush_loop, args=())
+            t.daemon = True
+            t.start()
 
     def flush_loop(self):
+        """
+        Sends queued packets to the server as soon as they are queued.
+        The timeout only bounds how long it takes to notice `abort`.
+        """
+        packet = self.packet
         while not self.abort:
             try:
-                self.packet.flush()
+                if packet.wait_for_queue(0.5):
+                    packet.flush()
             except socket.error:
                 self.log.debug("Socket_error- server socket was closed"
                                " %s", self.infos_debug)
                 break
-            time.sleep(0.05)
         self.log.debug("%s serverconnection flush_loop thread ended.",
                        self.client.username)
 
@@ -135,19 +155,38 @@ class ServerConnection(object):
                         e, traceback.format_exc())
                 )
 
-            # parse it
-            # send packet if parsing passed and client in play mode.
-            # all packets are parsed, but only play mode ones are transmitted.
-            if self.parse(pkid) and self.client.state == PLAY:
-                try:
-                    # self.parse will reject (False) any packet proxy modifies.
-                    self.client.packet.send_raw_untouched(orig_packet)
-                except Exception as e:
-                    return self.close_server(
-                        "handle could not send packet '%s'.  "
-                        "Exception: %s TRACEBACK: \n%s" % (
-                            pkid, e, traceback.format_exc())
-                    )
+            if not self.process_packet(pkid, orig_packet):
+                return
+
+    def process_packet(self, pkid, orig_packet):
+        """
+        Parse a packet received from the server and pass it on to the
+        client if the parser allows it.
+
+        :returns: False if the connection had to be closed.
+        """
+        # parse it
+        # send packet if parsing passed and client in play mode.
+        # all packets are parsed, but only play mode ones are transmitted.
+        if self.parse(pkid) and self.client.state == PLAY:
+            try:
+                # self.parse will reject (False) any packet proxy modifies.
+                self.client.packet.send_raw_untouched(orig_packet)
+            except Exception as e:
+                self.close_server(
+                    "handle could not send packet '%s'.  "
+                    "Exception: %s TRACEBACK: \n%s" % (
+                        pkid, e, traceback.format_exc())
+                )
+                return False
+        return True
+
+    def connection_lost(self, reason):
+        """
+        Called by the reactor engine when the server socket closes.
+        """
+        if not self.abort:
+            self.close_server("handle %s" % reason)
 
     def close_server(self, reason="Disconnected"):
         """
@@ -160,6 +199,8 @@ class ServerConnection(object):
 
         # end 'handle' and 'flush_loop' cleanly
         self.abort = True
+        if self.packet:
+            self.packet.close()
         time.sleep(0.1)
 
         # noinspection PyBroadException
@@ -270,6 +311,9 @@ class ServerConnection(object):
 
     def parse(self, pkid):
         if pkid in self.parsers[self.state]:
+            if self.metrics is not None:
+                return self.metrics.timed_parse(
+                    pkid, self.parsers[self.state][pkid])
             return self.parsers[self.state][pkid]()
         return True
 
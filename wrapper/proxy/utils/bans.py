@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+In-memory indexes of the server's ban files, so that checking a joining
+player or address does not read and parse a json file.
+
+An index reloads its file only when the file's modification time or size
+changes (someone used the server's own ban commands, or edited it) or
+after invalidate() (the proxy wrote it).
+"""
+
+import heapq
+import os
+import socket
+import struct
+import threading
+
+from api.helpers import getjsonfile, read_timestr
+
+
+def ip_to_int(address):
+    """
+    :returns: the integer value of an IPv4 address string.
+
+    :raises: socket.error if `address` is not a valid address.
+    """
+    return struct.unpack(">I", socket.inet_aton(address))[0]
+
+
+def parse_network(entry):
+    """
+    Parse an "ip" entry of banned-ips.json that is not a plain address:
+    a CIDR network ("10.1.0.0/16") or a prefix ending in a dot
+    ("192.168.").
+
+    :returns: a (network, mask) tuple of integers, or None.
+    """
+    try:
+        if "/" in entry:
+            address, bits = entry.split("/", 1)
+            bits = int(bits)
+            if not 0 <= bits <= 32:
+                return None
+        elif entry.endswith("."):
+            octets = entry[:-1].split(".")
+            if len(octets) > 3:
+                return None
+            bits = 8 * len(octets)
+            address = ".".join(octets + ["0"] * (4 - len(octets)))
+        else:
+            return None
+        mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+        return ip_to_int(address) & mask, mask
+    except (ValueError, socket.error):
+        return None
+
+
+def in_network(address, network):
+    """
+    :returns: True if the IPv4 `address` string is in `network` (a
+     (network, mask) tuple from parse_network).
+    """
+    try:
+        return ip_to_int(address) & network[1] == network[0]
+    except (socket.error, TypeError):
+        return False
+
+
+class BanIndex(object):
+    """
+    The records of one ban file, indexed by `key`.
+
+    :filename: "banned-players" or "banned-ips" (no extension).
+    :directory: callable returning the file's directory.
+    :key: "uuid" or "ip".  "ip" indexes also match CIDR and prefix
+     entries (see parse_network).
+    """
+    def __init__(self, filename, directory, key):
+        self.filename = filename
+        self.directory = directory
+        self.key = key
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._exact = {}
+        # (network, mask, record)
+        self._networks = []
+        # (expiry epoch, key value) of records that do not last forever
+        self._expiry = []
+
+    def invalidate(self):
+        """Reload the file on the next lookup."""
+        with self._lock:
+            self._stamp = None
+
+    def _refresh(self):
+        path = "%s/%s.json" % (self.directory(), self.filename)
+        try:
+            info = os.stat(path)
+            stamp = (info.st_mtime, info.st_size)
+        except OSError:
+            stamp = False
+        if stamp == self._stamp:
+            return
+        records = None
+        if stamp:
+            records = getjsonfile(self.filename, self.directory())
+        self._stamp = stamp
+        self._exact = {}
+        self._networks = []
+        self._expiry = []
+        for record in records or []:
+            try:
+                value = record[self.key]
+            except (KeyError, TypeError):
+                continue
+            self._exact[value] = record
+            if self.key == "ip":
+                network = parse_network(value)
+                if network:
+                    self._networks.append(network + (record,))
+            expires = read_timestr(record.get("expires", "forever"))
+            # read_timestr gives 9999999999 for "forever"
+            if expires < 9999999999:
+                self._expiry.append((expires, value))
+        heapq.heapify(self._expiry)
+
+    def lookup(self, value):
+        """
+        :returns: the ban record matching `value`, or None.
+        """
+        with self._lock:
+            self._refresh()
+            record = self._exact.get(value)
+            if record is not None or not self._networks:
+                return record
+            try:
+                address = ip_to_int(value)
+            except (socket.error, TypeError):
+                return None
+            for network, mask, record in self._networks:
+                if address & mask == network:
+                    return record
+            return None
+
+    def expired(self, now):
+        """
+        Take the entries whose expiry time has passed off the expiry
+        heap.  The caller is expected to pardon them.
+
+        :returns: a list of key values (uuids or ip entries).
+        """
+        with self._lock:
+            self._refresh()
+            due = []
+            while self._expiry and self._expiry[0][0] < now:
+                due.append(heapq.heappop(self._expiry)[1])
+            return due
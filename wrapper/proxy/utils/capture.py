@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Proxy packet capture ("packet-capture" in the Proxy config section).
+
+Every frame a proxy Packet receives (the decrypted bytes following the
+length varint, still compressed if compression is on) is appended to a
+capture file together with the connection state, compression threshold
+and protocol version it was received with.  `proxy.replay` plays a
+capture back through the framing code and the ParseSB/ParseCB parsers.
+
+File layout: the MAGIC line, then one record per frame:
+    RECORD header (session, direction, state, threshold, protocol,
+    length) followed by `length` bytes of frame.
+"""
+
+import itertools
+import os
+import struct
+import threading
+from collections import namedtuple
+
+MAGIC = b"WRAPPER.PY CAPTURE 1\n"
+RECORD = struct.Struct(">IBBiiI")
+
+# directions
+SERVERBOUND = 0  # received from the client
+CLIENTBOUND = 1  # received from the server
+
+CaptureRecord = namedtuple("CaptureRecord", [
+    "session", "direction", "state", "threshold", "protocol", "frame"])
+
+
+class PacketCapture(object):
+    """Appends the frames of every proxy connection to `filename`."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        new = not os.path.exists(filename) or not os.path.getsize(filename)
+        # sessions of earlier runs in the file keep their own numbers
+        last = 0 if new else last_session(filename)
+        self._sessions = itertools.count(last + 1)
+        self._file = open(filename, "ab")
+        if new:
+            self._file.write(MAGIC)
+
+    def new_session(self):
+        """:returns: a number identifying one player's connections."""
+        with self._lock:
+            return next(self._sessions)
+
+    def recorder(self, session, direction, packet, status):
+        """
+        :returns: a callable for `Packet.capture`.
+
+        :session: from new_session().
+        :direction: SERVERBOUND or CLIENTBOUND.
+        :packet: the connection's Packet (for its compression threshold).
+        :status: callable returning the connection's current
+         (state, protocol version).
+        """
+        def _record(frame):
+            state, protocol = status()
+            self.record(session, direction, state,
+                        packet.compressThreshold, protocol, frame)
+        return _record
+
+    def record(self, session, direction, state, threshold, protocol, frame):
+        header = RECORD.pack(session, direction, state, threshold, protocol,
+                             len(frame))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(header + frame)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _headers(capture):
+    # (session, direction, state, threshold, protocol, length) of each
+    # complete record from the current position of `capture`
+    while True:
+        header = capture.read(RECORD.size)
+        if len(header) < RECORD.size:
+            # end of file (or a record cut short by a crash)
+            return
+        yield RECORD.unpack(header)
+
+
+def last_session(filename):
+    """
+    :returns: the highest session number in a capture file (0 if there
+     are none, or it is not a capture file).
+    """
+    last = 0
+    with open(filename, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            return 0
+        for fields in _headers(capture):
+            last = max(last, fields[0])
+            capture.seek(fields[-1], os.SEEK_CUR)
+    return last
+
+
+def read_capture(filename):
+    """
+    Generator of the CaptureRecord tuples in a capture file.
+
+    :raises: ValueError if `filename` is not a capture file.
+    """
+    with open(filename, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a packet capture file" % filename)
+        for fields in _headers(capture):
+            frame = capture.read(fields[-1])
+            if len(frame) < fields[-1]:
+                return
+            yield CaptureRecord(*(fields[:-1] + (frame,)))
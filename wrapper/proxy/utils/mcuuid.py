@@ -8,10 +8,23 @@
 # system imports
 import uuid
 import hashlib
+import threading
 import time
 import requests
 import os
 
+try:
+    from concurrent import futures
+except ImportError:
+    # Py2 - bulk lookups run one at a time
+    futures = False
+
+MOJANG_API = "https://api.mojang.com"
+# names per bulk profile request (Mojang's limit)
+NAME_BATCH = 10
+# how long a usercache record is good for
+CACHE_SECONDS = 2592000  # 30 days.
+
 
 class MCUUID(uuid.UUID):
     """
@@ -27,10 +40,205 @@ class MCUUID(uuid.UUID):
         return str(self)
 
 
+class _Flight(object):
+    """A Mojang lookup in progress (see UsercacheIndex.singleflight)."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class RateLimit(object):
+    """
+    Allow `rate` requests per second on average (and bursts of up to
+    `rate`).  A rate of 0 is unlimited.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._last = time.time()
+
+    def wait(self):
+        """Sleep until the next request may be made."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # take a token, even if that means waiting for it
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return
+            delay = -self._tokens / self.rate
+        time.sleep(delay)
+
+
+class UsercacheIndex(object):
+    """
+    Lookup state shared by every UUIDS using the same usercache
+    dictionary (wrapper's and the proxy's): a lower case 'localname' to
+    uuid index, names Mojang did not know (for `negative_ttl` seconds),
+    lookups in progress, and the Mojang API address, request rate limit
+    and bulk lookup thread count.
+
+    Records added to the usercache are noticed by its size changing;
+    code changing a 'localname' should use UUIDS.setlocalname.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, usercache):
+        self.usercache = usercache
+        self.api = MOJANG_API
+        self.negative_ttl = 300
+        self.rate = RateLimit(5)
+        self.workers = 4
+        self._lock = threading.Lock()
+        # lower case localname: uuid, and uuid: lower case localname
+        self._names = {}
+        self._uuids = {}
+        self._indexed = -1
+        # lower case name: time Mojang said there is no such player
+        self._unknown = {}
+        # key: _Flight
+        self._flights = {}
+
+    @classmethod
+    def of(cls, usercache):
+        """:returns: the UsercacheIndex of `usercache`."""
+        with cls._shared_lock:
+            try:
+                return cls._shared[id(usercache)]
+            except KeyError:
+                index = cls(usercache)
+                cls._shared[id(usercache)] = index
+                return index
+
+    def _rebuild(self):
+        names = {}
+        uuids = {}
+        for useruuid, record in list(self.usercache.items()):
+            try:
+                name = record["localname"].lower()
+            except (AttributeError, KeyError, TypeError):
+                continue
+            names[name] = useruuid
+            uuids[useruuid] = name
+        self._names = names
+        self._uuids = uuids
+        self._indexed = len(self.usercache)
+
+    def find(self, name):
+        """
+        :returns: the uuid (string) of the usercache record whose
+         'localname' is `name` (any case), or None.
+        """
+        name = name.lower()
+        with self._lock:
+            if self._indexed != len(self.usercache):
+                self._rebuild()
+            useruuid = self._names.get(name)
+            if useruuid is None:
+                return None
+            try:
+                if self.usercache[useruuid]["localname"].lower() == name:
+                    return useruuid
+            except (AttributeError, KeyError, TypeError):
+                pass
+            # the record was renamed behind our back
+            self._rebuild()
+            return self._names.get(name)
+
+    def update(self, useruuid):
+        """Index the (new or changed) usercache record of `useruuid`."""
+        with self._lock:
+            try:
+                localname = self.usercache[useruuid]["localname"]
+            except KeyError:
+                return
+            if self._indexed != len(self.usercache) - 1 and \
+                    self._indexed != len(self.usercache):
+                # more than this record changed
+                self._rebuild()
+                return
+            oldname = self._uuids.pop(useruuid, None)
+            if oldname is not None and self._names.get(oldname) == useruuid:
+                del self._names[oldname]
+            if localname:
+                self._names[localname.lower()] = useruuid
+                self._uuids[useruuid] = localname.lower()
+                self._unknown.pop(localname.lower(), None)
+            self._indexed = len(self.usercache)
+
+    def unknown(self, name):
+        """:returns: True if Mojang recently had no player `name`."""
+        when = self._unknown.get(name.lower())
+        if when is None:
+            return False
+        if time.time() - when < self.negative_ttl:
+            return True
+        self._unknown.pop(name.lower(), None)
+        return False
+
+    def set_unknown(self, name):
+        self._unknown[name.lower()] = time.time()
+
+    def singleflight(self, key, lookup):
+        """
+        Run `lookup()`, unless a lookup with the same `key` is already
+        running; then wait for it and share its result.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+        if not leader:
+            flight.done.wait()
+            return flight.result
+        try:
+            flight.result = lookup()
+            return flight.result
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
 class UUIDS(object):
-    def __init__(self, loginstance, usercache):
+    """
+    :loginstance: the logger.
+    :usercache: the usercache dictionary.
+    :api: the Mojang API address (default MOJANG_API), which can point
+     to a stand-in service.
+    :negative_ttl: seconds to remember that Mojang has no player by a
+     name.
+    :rate: Mojang requests per second (0 for no limit).
+    :workers: threads making the requests of bulk lookups.
+
+    These settings are shared by every UUIDS using the same usercache.
+    """
+    def __init__(self, loginstance, usercache, api=None, negative_ttl=None,
+                 rate=None, workers=None):
         self.log = loginstance
         self.usercache = usercache
+        self.index = UsercacheIndex.of(usercache)
+        if api:
+            self.index.api = api.rstrip("/")
+        if negative_ttl is not None:
+            self.index.negative_ttl = negative_ttl
+        if rate is not None:
+            self.index.rate = RateLimit(rate)
+        if workers is not None:
+            self.index.workers = workers
+
+    def setlocalname(self, useruuid, name):
+        """Change the name the server knows player `useruuid` by."""
+        self.usercache[useruuid]["localname"] = name
+        self.index.update(useruuid)
 
     @staticmethod
     def formatuuid(playeruuid):
@@ -72,23 +280,34 @@ class UUIDS(object):
                 Yields False if failed.
         """
         user_name = "%s" % username  # create a new name variable that is unrelated the the passed variable.
-        frequency = 2592000  # 30 days.
+        frequency = CACHE_SECONDS
         if forcepoll:
             frequency = 3600  # do not allow more than hourly
         user_uuid_matched = None
-        for useruuid in self.usercache:  # try wrapper cache first
-            if user_name.lower() == self.usercache[useruuid]["localname"].lower():
-                # This search need only be done by 'localname', which is always populated and is always
-                # the same as the 'name', unless a localname has been assigned on the server (such as
-                # when "falling back' on an old name).'''
-                if (time.time() - self.usercache[useruuid]["time"]) < frequency:
-                    return MCUUID(useruuid)
-                # if over the time frequency, it needs to be updated by using actual last polled name.
-                user_name = self.usercache[useruuid]["name"]
-                user_uuid_matched = useruuid  # cache for later in case multiple name changes require a uuid lookup.
+        # try wrapper cache first.  This search need only be done by
+        # 'localname', which is always populated and is always the same as
+        # the 'name', unless a localname has been assigned on the server
+        # (such as when "falling back' on an old name).
+        useruuid = self.index.find(user_name)
+        if useruuid is not None:
+            if (time.time() - self.usercache[useruuid]["time"]) < frequency:
+                return MCUUID(useruuid)
+            # if over the time frequency, it needs to be updated by using actual last polled name.
+            user_name = self.usercache[useruuid]["name"]
+            user_uuid_matched = useruuid  # cache for later in case multiple name changes require a uuid lookup.
+        elif self.index.unknown(user_name):
+            return False
 
+        # concurrent lookups of one name share a single Mojang poll
+        return self.index.singleflight(
+            ("name", user_name.lower()),
+            lambda: self._pollmojangname(user_name, user_uuid_matched))
+
+    def _pollmojangname(self, user_name, user_uuid_matched):
         # try mojang  (a new player or player changed names.)
-        r = requests.get("https://api.mojang.com/users/profiles/minecraft/%s" % user_name)
+        self.index.rate.wait()
+        r = requests.get("%s/users/profiles/minecraft/%s" % (
+            self.index.api, user_name))
         if r.status_code == 200:
             useruuid = self.formatuuid(r.json()["id"])  # returns a string uuid with dashes
             correctcapname = r.json()["name"]
@@ -111,6 +330,9 @@ class UUIDS(object):
                                  "(a non-MCUUID object).  This will likely "
                                  "create other logical/program flow errors")
                 return False
+            # no such player; don't ask again for a while
+            self.index.set_unknown(user_name)
+            return False
         else:
             self.log.warning(
                 "UUID returned False (a non-MCUUID object).  This "
@@ -142,7 +364,9 @@ class UUIDS(object):
 
         # continue on and poll... because user is not in cache or is old record that needs re-polled
         # else:  # user is not in cache
-        names = self._pollmojanguuid(useruuid)
+        names = self.index.singleflight(
+            ("uuid", str(useruuid)),
+            lambda: self._pollmojanguuid(useruuid))
         numbofnames = 0
         if names is not False:  # service returned data
             numbofnames = len(names)
@@ -195,6 +419,7 @@ class UUIDS(object):
             self.usercache[useruuid]["name"] = pastnames[0]["name"]
             if self.usercache[useruuid]["localname"] is None:
                 self.usercache[useruuid]["localname"] = pastnames[0]["name"]
+        self.index.update(useruuid)
         if uselocalname:
             return self.usercache[useruuid]["localname"]
         else:
@@ -209,9 +434,10 @@ class UUIDS(object):
                 - otherwise, a list of names...
         """
 
+        self.index.rate.wait()
         r = requests.get(
-            "https://api.mojang.com/user/profiles/%s/names" %
-            str(user_uuid).replace("-", ""))
+            "%s/user/profiles/%s/names" % (
+                self.index.api, str(user_uuid).replace("-", "")))
         if r.status_code == 200:
             return r.json()
         if r.status_code == 204:
@@ -249,6 +475,142 @@ class UUIDS(object):
                         except TypeError:
                             return False
 
+    def _bulk(self, work, items):
+        """Run `work(item)` for every item, on up to `workers` threads."""
+        workers = min(self.index.workers, len(items))
+        if workers < 2 or not futures:
+            for item in items:
+                work(item)
+            return
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(work, items):
+                pass
+
+    def getuuidsbyusernames(self, usernames):
+        """
+        Bulk version of getuuidbyusername.  Names are looked up in the
+        usercache first; the rest are sent to Mojang NAME_BATCH names per
+        request.  New players are added to the usercache without their
+        name history.
+
+        :param usernames: a list of names.
+        :returns: a dictionary of each name: its MCUUID, or False.
+        """
+        results = {}
+        # lower case name to poll: [name to poll, cached uuid, [names]]
+        wanted = {}
+        for username in usernames:
+            user_name = "%s" % username
+            useruuid = self.index.find(user_name)
+            poll = user_name
+            if useruuid is not None:
+                record = self.usercache[useruuid]
+                if time.time() - record["time"] < CACHE_SECONDS:
+                    results[user_name] = MCUUID(useruuid)
+                    continue
+                # like getuuidbyusername, poll the last known name
+                poll = record["name"] or user_name
+            elif self.index.unknown(user_name):
+                results[user_name] = False
+                continue
+            wanted.setdefault(poll.lower(), [poll, useruuid, []])[2].append(
+                user_name)
+
+        polls = list(wanted.values())
+        batches = [polls[i:i + NAME_BATCH]
+                   for i in range(0, len(polls), NAME_BATCH)]
+
+        def _batch(batch):
+            found = self._pollmojangnames([item[0] for item in batch])
+            for poll, matched, names in batch:
+                result = False
+                if found is None:
+                    pass
+                elif poll.lower() in found:
+                    useruuid, correctcapname = found[poll.lower()]
+                    self._cacheprofile(useruuid, correctcapname)
+                    result = MCUUID(useruuid)
+                elif matched:
+                    # Mojang no longer knows the old name
+                    if self.getusernamebyuuid(matched, forcepoll=True):
+                        result = MCUUID(matched)
+                else:
+                    self.index.set_unknown(poll)
+                for user_name in names:
+                    results[user_name] = result
+
+        self._bulk(_batch, batches)
+        return results
+
+    def getusernamesbyuuids(self, useruuids):
+        """
+        Bulk version of getusernamebyuuid.  UUIDs missing from (or
+        outdated in) the usercache are polled on up to `workers` threads.
+
+        :param useruuids: a list of string UUIDs.
+        :returns: a dictionary of each uuid: its localname, or False.
+        """
+        results = {}
+        misses = []
+        for useruuid in useruuids:
+            useruuid = str(useruuid)
+            record = self.usercache.get(useruuid)
+            if record and time.time() - record["time"] < CACHE_SECONDS:
+                results[useruuid] = record["localname"]
+            else:
+                misses.append(useruuid)
+
+        def _lookup(useruuid):
+            results[useruuid] = self.getusernamebyuuid(useruuid)
+
+        self._bulk(_lookup, misses)
+        return results
+
+    def _pollmojangnames(self, names):
+        """
+        Look up several (at most NAME_BATCH) names with one request.
+
+        :returns: a dictionary of the lower case names Mojang knows:
+         (string uuid, correctly capitalized name), or None if the
+         request failed.
+        """
+        self.index.rate.wait()
+        try:
+            r = requests.post("%s/profiles/minecraft" % self.index.api,
+                              json=names)
+        except requests.RequestException as e:
+            self.log.warning("Bulk name lookup failed: %s", e)
+            return None
+        if r.status_code != 200:
+            self.log.warning("Bulk name lookup failed (status code %s)",
+                             r.status_code)
+            return None
+        found = {}
+        for profile in r.json():
+            found[profile["name"].lower()] = (
+                self.formatuuid(profile["id"]), profile["name"])
+        return found
+
+    def _cacheprofile(self, useruuid, name):
+        """Record a player's current name (from a bulk lookup)."""
+        record = self.usercache.get(useruuid)
+        if record is None:
+            self.usercache[useruuid] = {
+                "time": time.time(),
+                "original": None,
+                "name": name,
+                "online": True,
+                "localname": name,
+                "IP": None,
+                "names": []
+            }
+        else:
+            record["name"] = name
+            record["time"] = time.time()
+            if record["localname"] is None:
+                record["localname"] = name
+        self.index.update(useruuid)
+
     # noinspection PyBroadException
     @staticmethod
     def remove_uuidfiles(olduuid, cwd):
@@ -300,8 +662,9 @@ class UUIDS(object):
         self._conv_user(all_uuids, cwd, onlinemode)
 
     def _conv_user(self, alluuids, cwd, online=False):
+        usernames = self.getusernamesbyuuids(alluuids)
         for onlineuuid_str in alluuids:
-            username_str = self.getusernamebyuuid(onlineuuid_str)
+            username_str = usernames[str(onlineuuid_str)]
             offlineuuid_str = self.getuuidfromname(username_str).string
             if online:
                 self.convert_files(offlineuuid_str, onlineuuid_str, cwd)
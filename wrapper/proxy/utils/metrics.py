@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016 - 2018 - BenBaptist and Wrapper.py developer(s).
+# https://github.com/benbaptist/minecraft-wrapper
+# This program is distributed under the terms of the GNU
+# General Public License, version 3 or later.
+
+"""
+Proxy packet metrics ("proxy-metrics" in the Proxy config section).
+
+Each client and server connection gets a ConnectionMetrics, updated by
+its Packet (packets and bytes in when frames are received, packets and
+bytes out, the batch size and the bytes compressed when the queue is
+flushed) and by the connection's
+parse dispatcher (parse time per packet id).  When metrics are disabled
+those hooks are a single `is None` test.
+
+Counters are plain attributes, each written by only one thread (the
+receiving thread or the flushing thread), so no locks are needed.
+"""
+
+import threading
+import time
+
+# monotonic, high resolution clock where available
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class Histogram(object):
+    """
+    Durations counted in power of two microsecond buckets (bucket `n`
+    holds samples shorter than 2^n microseconds).
+    """
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[min(int(seconds * 1000000).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in enumerate(other.buckets):
+            self.buckets[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """
+        :returns: the upper bound (in seconds) of the bucket holding the
+         `fraction` (0-1) percentile.
+        """
+        wanted = self.count * fraction
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min((1 << bucket) / 1000000.0, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean-ms": round(self.total * 1000 / self.count, 3),
+                "p99-ms": round(self.percentile(0.99) * 1000, 3),
+                "max-ms": round(self.max * 1000, 3),
+                "total-ms": round(self.total * 1000, 3)}
+
+
+class ConnectionMetrics(object):
+    """
+    Counters for one proxy socket.
+
+    :conn: the ClientConnection/ServerConnection (used to notice when
+     it is finished).
+    :kind: "client" (receives serverbound packets) or "server" (receives
+     clientbound packets).
+    :player: callable returning the player's name.
+    """
+    __slots__ = ("conn", "kind", "player", "packets_in", "bytes_in",
+                 "packets_out", "bytes_out", "bytes_sent", "batch_max",
+                 "compressed_in", "compressed_out", "parse")
+
+    def __init__(self, conn, kind, player):
+        self.conn = conn
+        self.kind = kind
+        self.player = player
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        # payload bytes queued, and the (framed/compressed) bytes sent
+        self.bytes_out = 0
+        self.bytes_sent = 0
+        # the most packets sent by one flush
+        self.batch_max = 0
+        # payload bytes of the packets the proxy compressed, and the
+        # bytes of their compressed frames (frames passed on untouched
+        # or below the threshold are not counted)
+        self.compressed_in = 0
+        self.compressed_out = 0
+        # packet id: Histogram
+        self.parse = {}
+
+    def received(self, length):
+        self.packets_in += 1
+        self.bytes_in += length
+
+    def flushed(self, packets, payload_bytes, sent_bytes, compressed_in=0,
+                compressed_out=0):
+        self.packets_out += packets
+        self.bytes_out += payload_bytes
+        self.bytes_sent += sent_bytes
+        self.compressed_in += compressed_in
+        self.compressed_out += compressed_out
+        if packets > self.batch_max:
+            self.batch_max = packets
+
+    def parsed(self, pkid, seconds):
+        try:
+            self.parse[pkid].record(seconds)
+        except KeyError:
+            histogram = Histogram()
+            histogram.record(seconds)
+            self.parse[pkid] = histogram
+
+    def timed_parse(self, pkid, parser):
+        """Run `parser` and record how long it took."""
+        start = _clock()
+        try:
+            return parser()
+        finally:
+            self.parsed(pkid, _clock() - start)
+
+    def counters(self):
+        return {"packets-in": self.packets_in,
+                "bytes-in": self.bytes_in,
+                "packets-out": self.packets_out,
+                "bytes-out": self.bytes_out,
+                "bytes-sent": self.bytes_sent,
+                "compressed-in": self.compressed_in,
+                "compressed-out": self.compressed_out,
+                "batch-max": self.batch_max}
+
+
+class ProxyMetrics(object):
+    """The registry of every connection's metrics."""
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.connections = []
+        # counters and parse times of connections that have closed
+        self._closed = {"client": ConnectionMetrics(None, "client", None),
+                        "server": ConnectionMetrics(None, "server", None)}
+        self._last = (self.started, 0, 0)
+
+    def connection(self, conn, kind, player):
+        """
+        :returns: a new ConnectionMetrics for `conn` (see ConnectionMetrics).
+        """
+        metrics = ConnectionMetrics(conn, kind, player)
+        with self._lock:
+            self.connections.append(metrics)
+        return metrics
+
+    def _prune(self):
+        live = []
+        for metrics in list(self.connections):
+            if not metrics.conn.abort:
+                live.append(metrics)
+                continue
+            closed = self._closed[metrics.kind]
+            closed.packets_in += metrics.packets_in
+            closed.bytes_in += metrics.bytes_in
+            closed.flushed(metrics.packets_out, metrics.bytes_out,
+                           metrics.bytes_sent, metrics.compressed_in,
+                           metrics.compressed_out)
+            closed.batch_max = max(closed.batch_max, metrics.batch_max)
+            for pkid, histogram in list(metrics.parse.items()):
+                closed.parse.setdefault(pkid, Histogram()).merge(histogram)
+        self.connections = live
+
+    def snapshot(self, top=10):
+        """
+        :returns: a dictionary of proxy totals, rates (since the previous
+         snapshot), per connection counters and the `top` packet ids by
+         total parse time.
+        """
+        with self._lock:
+            self._prune()
+            every = self.connections + list(self._closed.values())
+        totals = dict((key, 0) for key in self._closed["client"].counters())
+        parse = {}
+        for metrics in every:
+            for key, value in metrics.counters().items():
+                if key == "batch-max":
+                    totals[key] = max(totals[key], value)
+                else:
+                    totals[key] += value
+            direction = "SB" if metrics.kind == "client" else "CB"
+            for pkid, histogram in list(metrics.parse.items()):
+                name = "%s 0x%02x" % (direction, pkid)
+                parse.setdefault(name, Histogram()).merge(histogram)
+        if totals["compressed-out"]:
+            totals["compression-ratio"] = round(
+                float(totals["compressed-in"]) / totals["compressed-out"], 2)
+
+        now = time.time()
+        last_time, last_in, last_out = self._last
+        elapsed = max(now - last_time, 0.001)
+        rates = {"packets-in/sec": round(
+                     (totals["packets-in"] - last_in) / elapsed, 1),
+                 "packets-out/sec": round(
+                     (totals["packets-out"] - last_out) / elapsed, 1)}
+        self._last = (now, totals["packets-in"], totals["packets-out"])
+
+        connections = []
+        for metrics in every[:-len(self._closed)]:
+            item = metrics.counters()
+            item["player"] = metrics.player()
+            item["kind"] = metrics.kind
+            connections.append(item)
+
+        slowest = sorted(parse.items(), key=lambda x: x[1].total,
+                         reverse=True)[:top]
+        return {"uptime": round(now - self.started),
+                "totals": totals,
+                "rates": rates,
+                "connections": connections,
+                "parse": dict((name, histogram.summary())
+                              for name, histogram in slowest)}